@@ -0,0 +1,200 @@
+"""Structured access log.
+
+One JSON line per request:
+
+    {"time": "...", "method": "GET", "path": "/", "route": "warbler.homepage",
+     "status": 200, "user": 12, "ms": 8.1, "sql_ms": 2.3, "queries": 4,
+     "bytes": 10241, "cache": {"popular": "hit", "timelines": "partial"}}
+
+`bytes` is null for streamed responses. `cache` has an entry per cache
+the request consulted (see `cache_result`): "hit", "miss", or "partial"
+when it did both.
+
+The request thread only builds the record and puts it on a bounded
+in-memory queue of ACCESS_LOG_QUEUE records; it never waits. When the
+queue is full the record is dropped and counted, and the next batch
+written starts with a {"time": ..., "dropped": n} line. A background
+thread per worker writes the queue in batches of up to ACCESS_LOG_BATCH
+records, at least every ACCESS_LOG_FLUSH_SECONDS, with one write() per
+batch so the lines of different workers don't interleave. Past
+ACCESS_LOG_MAX_BYTES the file is rotated to ACCESS_LOG.1 .. .N, keeping
+ACCESS_LOG_BACKUPS; a lock file stops two workers rotating at once.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from time import perf_counter
+
+from flask import g, has_request_context, request
+
+import sqlstats
+
+logger = logging.getLogger(__name__)
+
+
+def cache_result(name, hit):
+    """Note that this request found (or didn't find) what it wanted in
+    cache `name`."""
+
+    if has_request_context():
+        g.setdefault('cache_results', {}).setdefault(name, set()).add(hit)
+
+
+def _cache_flags(results):
+    return {name: 'partial' if len(hits) > 1 else
+            'hit' if True in hits else 'miss'
+            for name, hits in results.items()}
+
+
+class AccessLog:
+    """Queue request records and write them from a background thread."""
+
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self.size = 10000
+        self.batch = 500
+        self.flush_seconds = 1.0
+        self.max_bytes = 100 * 2 ** 20
+        self.backups = 5
+        self.written = 0
+        self.dropped = 0
+        self._unreported = 0
+        self._queue = None
+        self._lock = threading.Lock()
+        # threads don't survive fork; warmup requests may have started a
+        # writer in the master
+        os.register_at_fork(after_in_child=self._forget_writer)
+
+    def init_app(self, app):
+        """Read the ACCESS_LOG* settings and install the request hooks."""
+
+        self.enabled = app.config.get('ACCESS_LOG_ENABLED', False)
+        self.path = app.config.get('ACCESS_LOG') or os.path.join(
+            app.instance_path, 'access.log')
+        self.size = app.config.get('ACCESS_LOG_QUEUE', self.size)
+        self.batch = app.config.get('ACCESS_LOG_BATCH', self.batch)
+        self.flush_seconds = app.config.get('ACCESS_LOG_FLUSH_SECONDS',
+                                            self.flush_seconds)
+        self.max_bytes = app.config.get('ACCESS_LOG_MAX_BYTES',
+                                        self.max_bytes)
+        self.backups = app.config.get('ACCESS_LOG_BACKUPS', self.backups)
+
+        app.before_request(self.start)
+        app.after_request(self.finish)
+
+    # Request hooks ########################################################
+
+    def start(self):
+        g.access_start = perf_counter()
+
+    def finish(self, response):
+        start = g.get('access_start')
+        if not self.enabled or start is None:
+            return response
+
+        sql = sqlstats.current()
+        user = g.get('user')
+        self.put({
+            'time': datetime.utcnow().isoformat(),
+            'method': request.method,
+            'path': request.path,
+            'route': request.endpoint,
+            'status': response.status_code,
+            'user': user.id if user else None,
+            'ms': round((perf_counter() - start) * 1000, 2),
+            'sql_ms': round(sql.seconds * 1000, 2),
+            'queries': sql.count,
+            'bytes': response.content_length,
+            'cache': _cache_flags(g.get('cache_results', {})),
+        })
+        return response
+
+    # Queue ################################################################
+
+    def put(self, record):
+        """Queue `record` for writing, or drop it if the queue is full."""
+
+        self._start_writer()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+                self._unreported += 1
+
+    def _start_writer(self):
+        if self._queue is not None:
+            return
+
+        with self._lock:
+            if self._queue is None:
+                records = queue.Queue(self.size)
+                threading.Thread(target=self._write_forever, args=(records,),
+                                 daemon=True, name='access-log').start()
+                self._queue = records
+
+    def _forget_writer(self):
+        self._queue = None
+        self._lock = threading.Lock()
+
+    def _write_forever(self, records):
+        while True:
+            batch = [records.get()]
+            deadline = time.monotonic() + self.flush_seconds
+            while len(batch) < self.batch:
+                try:
+                    batch.append(records.get(
+                        timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            self.write(batch)
+
+    # Writing ##############################################################
+
+    def write(self, batch):
+        """Append `batch` (and any drop count) to the log in one write."""
+
+        with self._lock:
+            dropped, self._unreported = self._unreported, 0
+        if dropped:
+            batch = [{'time': datetime.utcnow().isoformat(),
+                      'dropped': dropped}] + batch
+
+        data = ''.join(json.dumps(record) + '\n' for record in batch).encode()
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'ab', buffering=0) as f:
+                f.write(data)
+                size = f.tell()
+            self.written += len(batch)
+            if size >= self.max_bytes:
+                self._rotate()
+        except OSError:
+            logger.exception("Could not write the access log")
+
+    def _rotate(self):
+        with open(self.path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                # another worker may have rotated while we waited
+                if os.path.getsize(self.path) < self.max_bytes:
+                    return
+                for n in range(self.backups - 1, 0, -1):
+                    if os.path.exists(f"{self.path}.{n}"):
+                        os.replace(f"{self.path}.{n}", f"{self.path}.{n + 1}")
+                if self.backups:
+                    os.replace(self.path, f"{self.path}.1")
+                else:
+                    os.remove(self.path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+access_log = AccessLog()
@@ -0,0 +1,317 @@
+"""Admission control for expensive endpoints.
+
+Login, signup and profile updates spend most of their time in bcrypt,
+the user directory can scan the whole users table and exports stream a
+whole account. A burst on any of them would tie up every worker and stall
+the cheap routes. ADMISSION_LIMITS caps each such endpoint with:
+
+- a token bucket: `rate` requests per second, bursts of up to `burst`;
+  an empty bucket answers 429 Too Many Requests
+- a concurrency limit: at most `concurrency` requests in flight across
+  all workers; more answer 503 Service Unavailable. Each admitted
+  request holds a lease for at most `lease` seconds (default
+  LEASE_SECONDS)
+
+Both answers are immediate and carry Retry-After, so shed requests cost
+next to nothing. Limits only apply to the listed `methods` (default: all).
+
+The counters live in a small file shared by every worker process
+(ADMISSION_FILE, default <instance>/admission.bin), memory-mapped and
+updated under an flock. Each limited endpoint owns a slot holding its
+bucket, its admitted/429/503 totals and one lease (pid, start time) per
+request it may have in flight. `flask admission stats` prints them.
+The file starts with a header naming that layout; a process finding
+another layout there (a file from before ADMISSION_LIMITS changed)
+zeroes the file and writes its own.
+
+A request releases its lease when it ends. The lease of a worker killed
+mid-request, or of a request running longer than `lease`, is reclaimed
+by the next request to that endpoint, so lost releases never shrink the
+limit for good. `flask admission reset` clears all counters.
+"""
+
+import fcntl
+import hashlib
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from typing import NamedTuple, Tuple
+
+import click
+from flask import g, request
+from flask.cli import AppGroup
+
+# magic, digest of the slot layout
+HEADER = struct.Struct('=8s32s')
+MAGIC = b'wbadmit1'
+
+# tokens, last refill, admitted, rate limited, overloaded
+SLOT = struct.Struct('=ddqqq')
+# pid, start time of a request in flight; pid 0 marks a free lease
+LEASE = struct.Struct('=qd')
+
+LEASE_SECONDS = 300
+
+
+class Limit(NamedTuple):
+    """The limits of one endpoint and its slot in the shared file."""
+
+    offset: int
+    rate: float
+    burst: float
+    concurrency: int
+    methods: Tuple[str, ...]
+    lease: float
+
+    @property
+    def size(self):
+        return SLOT.size + LEASE.size * self.concurrency
+
+
+class SlotStats(NamedTuple):
+    """A snapshot of one endpoint's counters."""
+
+    endpoint: str
+    tokens: float
+    in_flight: int
+    admitted: int
+    rate_limited: int
+    overloaded: int
+
+
+class AdmissionControl:
+    """Shed requests to expensive endpoints beyond their limits."""
+
+    def __init__(self):
+        self.path = None
+        self.limits = {}
+        self.size = 0
+        self.header = None
+        self._map = None
+        self._fd = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Read ADMISSION_LIMITS/ADMISSION_FILE and install the hooks."""
+
+        self.configure(
+            app.config.get('ADMISSION_LIMITS', {}),
+            app.config.get('ADMISSION_FILE') or os.path.join(
+                app.instance_path, 'admission.bin'))
+
+        app.before_request(self.admit)
+        app.teardown_request(self.release)
+        app.cli.add_command(admission_cli)
+
+    def configure(self, limits, path):
+        """Set the per-endpoint `limits` and the shared counter file."""
+
+        self.path = path
+        self.limits = {}
+        offset = HEADER.size
+        for endpoint, spec in sorted(limits.items()):
+            limit = Limit(offset, float(spec['rate']),
+                          float(spec.get('burst', spec['rate'])),
+                          spec['concurrency'],
+                          tuple(spec.get('methods', ())),
+                          float(spec.get('lease', LEASE_SECONDS)))
+            self.limits[endpoint] = limit
+            offset += limit.size
+        self.size = offset
+
+        layout = repr((SLOT.format, LEASE.format,
+                       [(endpoint, limit.offset, limit.concurrency)
+                        for endpoint, limit in self.limits.items()]))
+        self.header = HEADER.pack(
+            MAGIC, hashlib.sha256(layout.encode('utf-8')).digest())
+        self._close()
+
+    # Shared counters ######################################################
+
+    def _open(self):
+        # Opened on first use in each process; a mapping inherited over
+        # fork would work, but its flock would be shared with the parent.
+        if self._pid == os.getpid():
+            return
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        size = max(self.size, mmap.PAGESIZE)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+        self._fd = fd
+        self._map = mmap.mmap(fd, size)
+        self._pid = os.getpid()
+
+    def _close(self):
+        if self._map is not None and self._pid == os.getpid():
+            self._map.close()
+            os.close(self._fd)
+        self._map = self._fd = self._pid = None
+
+    def _check_layout(self):
+        # Under the flock. Never shrinks the file: a process still using
+        # a larger mapping of it would fault.
+        if self._map[:HEADER.size] != self.header:
+            self._map[:] = bytes(len(self._map))
+            self._map[:HEADER.size] = self.header
+
+    @contextmanager
+    def _slot(self, limit):
+        """Lock the slot of `limit` across threads and processes; yield its
+        fields and its leases as lists.
+
+        Changes made to the yielded lists are written back.
+        """
+
+        with self._lock:
+            self._open()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                self._check_layout()
+                fields = list(SLOT.unpack_from(self._map, limit.offset))
+                leases = [list(LEASE.unpack_from(
+                    self._map, _lease_offset(limit, n)))
+                    for n in range(limit.concurrency)]
+                yield fields, leases
+                SLOT.pack_into(self._map, limit.offset, *fields)
+                for n, lease in enumerate(leases):
+                    LEASE.pack_into(self._map, _lease_offset(limit, n),
+                                    *lease)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    # Request hooks ########################################################
+
+    def admit(self):
+        limit = self.limits.get(request.endpoint)
+        if limit is None or (limit.methods
+                             and request.method not in limit.methods):
+            return
+
+        with self._slot(limit) as (slot, leases):
+            tokens, updated = slot[:2]
+            now = time.time()
+            tokens = min(limit.burst, tokens + (now - updated) * limit.rate)
+            slot[0], slot[1] = tokens, now
+
+            for lease in leases:
+                if not _held(lease, now, limit.lease):
+                    lease[:] = [0, 0.0]
+            free = next((n for n, (pid, _) in enumerate(leases) if not pid),
+                        None)
+
+            if free is None:
+                slot[4] += 1
+                return _shed(503, "Server busy, try again shortly.", 1)
+
+            if tokens < 1:
+                slot[3] += 1
+                return _shed(429, "Too many requests, try again shortly.",
+                             math.ceil((1 - tokens) / limit.rate))
+
+            slot[0] -= 1
+            slot[2] += 1
+            leases[free] = [os.getpid(), now]
+
+        g.admission_lease = (limit, free, now)
+
+    def release(self, exc=None):
+        held = g.pop('admission_lease', None)
+        if held is None:
+            return
+
+        limit, n, started = held
+        with self._slot(limit) as (_, leases):
+            # unless it was reclaimed (and maybe handed out again)
+            if leases[n] == [os.getpid(), started]:
+                leases[n] = [0, 0.0]
+
+    # Reporting ############################################################
+
+    def stats(self):
+        """Return a `SlotStats` for every limited endpoint."""
+
+        result = []
+        for endpoint, limit in self.limits.items():
+            with self._slot(limit) as (slot, leases):
+                tokens, updated, admitted, limited, busy = slot
+            now = time.time()
+            tokens = min(limit.burst, tokens + (now - updated) * limit.rate)
+            in_flight = sum(_held(lease, now, limit.lease)
+                            for lease in leases)
+            result.append(SlotStats(endpoint, tokens, in_flight, admitted,
+                                    limited, busy))
+        return result
+
+    def reset(self):
+        """Zero every counter and free every lease."""
+
+        for limit in self.limits.values():
+            with self._slot(limit) as (slot, leases):
+                slot[:] = [0] * len(slot)
+                for lease in leases:
+                    lease[:] = [0, 0.0]
+
+
+def _lease_offset(limit, n):
+    return limit.offset + SLOT.size + n * LEASE.size
+
+
+def _held(lease, now, seconds):
+    """Whether `lease` belongs to a live process and hasn't expired."""
+
+    pid, started = lease
+    if pid <= 0 or not 0 <= now - started <= seconds:
+        return False
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _shed(status, message, retry_after):
+    return message, status, {'Retry-After': str(retry_after),
+                             'Cache-Control': 'no-store'}
+
+
+admission = AdmissionControl()
+
+admission_cli = AppGroup('admission', help="Inspect admission control.")
+
+
+@admission_cli.command('stats')
+def stats_command():
+    """Show in-flight requests and shed counts per endpoint."""
+
+    click.echo(f"{'endpoint':<24} {'depth':>7} {'tokens':>8} "
+               f"{'admitted':>10} {'429':>8} {'503':>8}")
+    for row in admission.stats():
+        limit = admission.limits[row.endpoint]
+        click.echo(f"{row.endpoint:<24} "
+                   f"{row.in_flight:>3}/{limit.concurrency:<3} "
+                   f"{row.tokens:>8.1f} {row.admitted:>10} "
+                   f"{row.rate_limited:>8} {row.overloaded:>8}")
+
+
+@admission_cli.command('reset')
+def reset_command():
+    """Zero all counters and free all leases."""
+
+    admission.reset()
+    click.echo("Admission counters reset.")
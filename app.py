@@ -1,45 +1,265 @@
 import os
+from datetime import datetime, timedelta
 
-from flask import Flask, render_template, request, flash, redirect, session, g
-from flask_debugtoolbar import DebugToolbarExtension
+from flask import (
+    Blueprint, Flask, Response, current_app, render_template, request, flash,
+    redirect, session, g, send_from_directory, stream_with_context, abort,
+    jsonify)
 from sqlalchemy.exc import IntegrityError
 
+import export
+import follows
+import jinjacache
+import partitions
+import querycache
+import readmodels
+import sqlstats
+from accesslog import access_log
+from admission import admission
+from archive import archive
+from availability import availability
+from channels import channels
+from compression import compression
+from config import PROFILES
+from feeds import timelines, feed_messages
 from forms import UserAddForm, LoginForm, MessageForm, UserProfileForm, PasswordForm
-from models import db, connect_db, User, Message, Likes
+from images import images, VARIANTS, DIGEST_RE
+from invalidation import (
+    invalidation, FOLLOW_CHANGED, MESSAGE_DELETED, MESSAGE_POSTED,
+    USER_CHANGED)
+from likes import like_buffer
+from livefeed import live_hub
+from models import db, connect_db, user_by_id, User, Message
+from pagecache import page_cache
+from popular import popular
+from profiler import profiler
+from purger import purger
+from slowlog import slow_queries
+from tags import index_message, trending
 
 CURR_USER_KEY = "curr_user"
 
-app = Flask(__name__)
+# One year: the longest max-age caches are asked to honour.
+IMAGE_MAX_AGE = 365 * 24 * 60 * 60
 
-# Get DB_URI from environ variable (useful for production/testing) or,
-# if not set there, use development local db.
-app.config['SQLALCHEMY_DATABASE_URI'] = (
-    os.environ.get('DATABASE_URL', 'postgres:///warbler'))
+bp = Blueprint('warbler', __name__)
 
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = False
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
-toolbar = DebugToolbarExtension(app)
 
-connect_db(app)
+def init_debug_toolbar(app):
+    """Install Flask-DebugToolbar (dev only; imported on demand)."""
+
+    from flask_debugtoolbar import DebugToolbarExtension
+    DebugToolbarExtension(app)
+
+
+# Optional extensions by name, as listed in the EXTENSIONS config setting.
+# Each loader imports its package itself so unused ones cost nothing.
+EXTENSIONS = {
+    'debug_toolbar': init_debug_toolbar,
+}
+
+
+def create_app(profile=None):
+    """Create the Warbler app for `profile` ('dev', 'test' or 'prod').
+
+    Defaults to the WARBLER_PROFILE environment variable, then 'dev'.
+    """
+
+    profile = profile or os.environ.get('WARBLER_PROFILE', 'dev')
+
+    app = Flask(__name__)
+    app.config.from_object(PROFILES[profile])
+    app.config['PROFILE'] = profile
+
+    connect_db(app)
+    access_log.init_app(app)
+    page_cache.init_app(app)
+    compression.init_app(app)
+    partitions.init_app(app)
+    admission.init_app(app)
+    querycache.init_app(app)
+    timelines.init_app(app)
+    images.init_app(app)
+    like_buffer.init_app(app)
+    sqlstats.init_app(app)
+    profiler.init_app(app)
+    slow_queries.init_app(app)
+    jinjacache.init_app(app)
+    trending.init_app(app)
+    popular.init_app(app)
+    export.init_app(app)
+    channels.init_app(app)
+    live_hub.init_app(app)
+    invalidation.init_app(app)
+    archive.init_app(app)
+    purger.init_app(app)
+    availability.init_app(app)
+
+    for name in app.config['EXTENSIONS']:
+        EXTENSIONS[name](app)
+
+    app.register_blueprint(bp)
+
+    if app.config['NO_CACHE_HEADERS']:
+        app.after_request(add_header)
+
+    return app
+
+
+def __getattr__(name):
+    """Build the default app on first access to `app.app`.
+
+    Lets `from app import app` keep working without every importer of
+    this module paying for an app it doesn't use.
+    """
+
+    if name == 'app':
+        globals()['app'] = create_app()
+        return globals()['app']
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 ##############################################################################
 # User signup/login/logout
 
 
-@app.before_request
+@bp.before_app_request
 def add_user_to_gobal():
     """If we're logged in, add curr user to Flask global."""
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = user_by_id(session[CURR_USER_KEY])
 
     else:
         g.user = None
 
 
+def following_ids_of(user_id):
+    """Ids of the users `user_id` follows, read once per request."""
+
+    cache = g.setdefault('following_ids', {})
+    if user_id not in cache:
+        cache[user_id] = readmodels.following_ids(user_id)
+    return cache[user_id]
+
+
+@invalidation.handler(USER_CHANGED)
+def user_changed(user_id, deleted, username=None, email=None, new=False):
+    """Forget a deleted user's cached timeline and pages in this worker and
+    keep its name filter current."""
+
+    page_cache.forget('warbler.users_show', user_id=user_id)
+    page_cache.forget('warbler.list_users')
+    if deleted:
+        timelines.discard(user_id)
+        page_cache.forget('warbler.messages_show')
+    availability.add(username, email)
+    if not new:
+        availability.discard()
+
+
+@invalidation.handler(MESSAGE_POSTED)
+def message_posted(message_id, user_id, timestamp):
+    """Add a new message to its author's list in this worker."""
+
+    timelines.push(user_id, datetime.fromisoformat(timestamp), message_id)
+
+
+@invalidation.handler(MESSAGE_DELETED)
+def message_deleted(message_id, user_id):
+    """Drop a deleted message from this worker's caches."""
+
+    timelines.remove(user_id, message_id)
+    popular.forget(message_id)
+    page_cache.forget('warbler.messages_show', message_id=message_id)
+    page_cache.forget('warbler.users_show', user_id=user_id)
+
+
+@invalidation.handler(FOLLOW_CHANGED)
+def follow_changed(follower_id, followed_ids, following):
+    """Update the authors this worker streams to the follower."""
+
+    live_hub.follow_changed(follower_id, followed_ids, following)
+
+
+def user_stats(user_id):
+    """Profile counts of `user_id`, archived messages included."""
+
+    return add_archived(user_id, readmodels.user_stats(user_id))
+
+
+def add_archived(user_id, stats):
+    """Add the archived messages of `user_id` to its `UserStats`."""
+
+    archived = archive.count(user_id)
+    return stats._replace(messages=stats.messages + archived) \
+        if archived else stats
+
+
+def merge_pages(hot, archived, limit):
+    """Merge two newest-first pages of messages, dropping duplicates."""
+
+    rows = {row.id: row for row in archived}
+    rows.update((row.id, row) for row in hot)
+    return sorted(rows.values(), key=lambda row: (row.timestamp, row.id),
+                  reverse=True)[:limit]
+
+
+def read_through_archive(user, messages, before, limit):
+    """Fill out a profile page from the archive once it reaches archived
+    times."""
+
+    newest_archived = archive.newest()
+    if newest_archived and (len(messages) < limit
+                            or messages[-1].timestamp <= newest_archived):
+        author = readmodels.Author(user.id, user.username, user.image_url)
+        messages = merge_pages(messages,
+                               archive.user_messages(author, before=before,
+                                                     limit=limit),
+                               limit=limit)
+    return messages
+
+
+def profile_messages(user_id, before, limit):
+    """Return a profile page of `user_id`'s messages, older than `before`.
+
+    Read within the feed window first, so on PostgreSQL the query skips
+    older partitions; a quiet author's page is filled out past it.
+    """
+
+    since = feed_window_start()
+    messages = readmodels.user_messages(user_id, before=before, limit=limit,
+                                        since=since)
+    if since is not None and len(messages) < limit:
+        messages += readmodels.user_messages(
+            user_id, before=messages[-1].id if messages else before,
+            limit=limit - len(messages))
+    return messages
+
+
+def feed_window_start():
+    """Oldest time the home feed (and first read of a profile page) reads
+    from: FEED_WINDOW_DAYS back when messages are partitioned, so the
+    query skips older partitions; None otherwise. Pages the window can't
+    fill are filled from older messages."""
+
+    days = current_app.config['FEED_WINDOW_DAYS']
+    if not days or not current_app.config.get('MESSAGE_PARTITIONS'):
+        return None
+    return datetime.utcnow() - timedelta(days=days)
+
+
+@bp.app_context_processor
+def follow_helpers():
+    """Let templates ask whether the current user follows someone."""
+
+    def is_following(user_id):
+        return bool(g.user) and user_id in following_ids_of(g.user.id)
+
+    return dict(is_following=is_following)
+
+
 def do_login(user):
     """Log in user."""
 
@@ -53,7 +273,7 @@ def do_logout():
         del session[CURR_USER_KEY]
 
 
-@app.route('/signup', methods=["GET", "POST"])
+@bp.route('/signup', methods=["GET", "POST"])
 def signup():
     """Handle user signup.
 
@@ -68,6 +288,16 @@ def signup():
     form = UserAddForm()
 
     if form.validate_on_submit():
+        # checked before the password is hashed; the unique keys still
+        # catch a name taken in the meantime
+        if not availability.username_available(form.username.data):
+            flash("Username already taken", 'danger')
+            return render_template('users/signup.html', form=form)
+        if not availability.email_available(form.email.data):
+            # don't confirm that the address has an account
+            flash("Username or email already taken", 'danger')
+            return render_template('users/signup.html', form=form)
+
         try:
             user = User.signup(
                 username=form.username.data,
@@ -75,12 +305,18 @@ def signup():
                 email=form.email.data,
                 image_url=form.image_url.data or User.image_url.default.arg,
             )
+            db.session.flush()
+            invalidation.publish(USER_CHANGED, user_id=user.id, deleted=False,
+                                 username=user.username, email=user.email,
+                                 new=True)
             db.session.commit()
 
         except IntegrityError:
-            flash("Username already taken", 'danger')
+            flash("Username or email already taken", 'danger')
             return render_template('users/signup.html', form=form)
 
+        user_changed(user.id, False, user.username, user.email, new=True)
+        images.submit_user(user)
         do_login(user)
 
         return redirect("/")
@@ -89,7 +325,22 @@ def signup():
         return render_template('users/signup.html', form=form)
 
 
-@app.route('/login', methods=["GET", "POST"])
+@bp.route('/api/username-available')
+def username_available():
+    """Tell whether the 'username' is free.
+
+    Returns e.g. {"username": true}. Emails aren't answered here: that
+    would tell anyone whether an address is registered.
+    """
+
+    username = request.args.get('username')
+    if not username:
+        return jsonify(error="Give a username to check."), 400
+
+    return jsonify(username=availability.username_available(username))
+
+
+@bp.route('/login', methods=["GET", "POST"])
 def login():
     """Handle user login."""
 
@@ -109,7 +360,7 @@ def login():
     return render_template('users/login.html', form=form)
 
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     """Handle logout of user."""
 
@@ -122,7 +373,7 @@ def logout():
 ##############################################################################
 # General user routes:
 
-@app.route('/users')
+@bp.route('/users')
 def list_users():
     """Page with listing of users.
 
@@ -130,33 +381,33 @@ def list_users():
     """
 
     search = request.args.get('q')
-
-    if not search:
-        users = User.query.all()
-    else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+    users = readmodels.directory(search)
 
     return render_template('users/index.html', users=users)
 
 
-@app.route('/users/<int:user_id>')
+@bp.route('/users/<int:user_id>')
 def users_show(user_id):
-    """Show user profile."""
+    """Show user profile.
+
+    Can take a 'before' message id in querystring to page back through
+    older messages.
+    """
 
     user = User.query.get_or_404(user_id)
+    before = request.args.get('before', type=int)
 
     # snagging messages in order from the database;
     # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    return render_template('users/show.html', user=user, messages=messages)
+    messages = profile_messages(user_id, before, limit=100)
 
+    messages = read_through_archive(user, messages, before, limit=100)
 
-@app.route('/users/<int:user_id>/following')
+    return render_template('users/show.html', user=user, messages=messages,
+                           stats=user_stats(user_id))
+
+
+@bp.route('/users/<int:user_id>/following')
 def show_following(user_id):
     """Show list of people this user is following."""
 
@@ -165,10 +416,12 @@ def show_following(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    return render_template('users/following.html', user=user,
+                           following=readmodels.following(user_id),
+                           stats=user_stats(user_id))
 
 
-@app.route('/users/<int:user_id>/followers')
+@bp.route('/users/<int:user_id>/followers')
 def users_followers(user_id):
     """Show list of followers of this user."""
 
@@ -177,10 +430,12 @@ def users_followers(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    return render_template('users/followers.html', user=user,
+                           followers=readmodels.followers(user_id),
+                           stats=user_stats(user_id))
 
 
-@app.route('/users/follow/<int:follow_id>', methods=['POST'])
+@bp.route('/users/follow/<int:follow_id>', methods=['POST'])
 def add_follow(follow_id):
     """Add a follow for the currently-logged-in user."""
 
@@ -190,12 +445,14 @@ def add_follow(follow_id):
 
     followed_user = User.query.get_or_404(follow_id)
     g.user.following.append(followed_user)
+    invalidation.publish(FOLLOW_CHANGED, follower_id=g.user.id,
+                         followed_ids=[follow_id], following=True)
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
 
 
-@app.route('/users/stop-following/<int:follow_id>', methods=['POST'])
+@bp.route('/users/stop-following/<int:follow_id>', methods=['POST'])
 def stop_following(follow_id):
     """Have currently-logged-in-user stop following this user."""
 
@@ -205,12 +462,68 @@ def stop_following(follow_id):
 
     followed_user = User.query.get(follow_id)
     g.user.following.remove(followed_user)
+    invalidation.publish(FOLLOW_CHANGED, follower_id=g.user.id,
+                         followed_ids=[follow_id], following=False)
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
 
 
-@app.route('/users/profile/<int:user_id>', methods=["GET", "POST"])
+@bp.route('/api/follows', methods=['POST'])
+def bulk_follow():
+    """Follow many users at once.
+
+    Takes JSON {"users": [...]} of user ids and/or usernames, at most
+    BULK_FOLLOW_MAX, and returns {"followed": <count>, "results": [...]},
+    one {"user", "id", "status"} per entry in order; see follows.py for
+    the statuses. Only JSON bodies are read, which browsers can't send
+    cross-site without a preflight.
+    """
+
+    if not g.user:
+        return jsonify(error="Log in first."), 401
+
+    body = request.get_json(silent=True)
+    entries = body.get('users') if isinstance(body, dict) else None
+    if not isinstance(entries, list) \
+            or not all(map(follows.valid_entry, entries)):
+        return jsonify(error="Send {\"users\": [ids or usernames]}."), 400
+    if len(entries) > current_app.config['BULK_FOLLOW_MAX']:
+        return jsonify(error="Too many users in one request."), 413
+
+    results, new_ids = follows.follow_many(g.user.id, entries)
+    for batch in follows.event_batches(new_ids):
+        invalidation.publish(FOLLOW_CHANGED, follower_id=g.user.id,
+                             followed_ids=batch, following=True)
+    db.session.commit()
+
+    return jsonify(followed=len(new_ids),
+                   results=[result._asdict() for result in results])
+
+
+@bp.route('/users/export')
+def export_user():
+    """Download the current user's data as a zip, streamed as it's built.
+
+    Can take a 'format' of ndjson (the default) or csv in querystring.
+    """
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in export.FORMATS:
+        abort(400)
+
+    filename = f"warbler-{g.user.username}-{fmt}.zip"
+    return Response(
+        stream_with_context(export.export_zip(g.user.id, fmt)),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+
+@bp.route('/users/profile/<int:user_id>', methods=["GET", "POST"])
 def profile(user_id):
     """Update profile for current user."""
 
@@ -225,8 +538,14 @@ def profile(user_id):
     if form.validate_on_submit():
         user = User.authenticate(user.username, form.password.data)
         if user:
+            # committed along with the update
+            names = dict(username=form.username.data, email=form.email.data)
+            invalidation.publish(USER_CHANGED, user_id=user.id,
+                                 deleted=False, **names)
             user = User.updateprofile(user, form)
             if user:
+                user_changed(user.id, False, **names)
+                images.submit_user(user)
                 flash("Profile Udpated.", "success")
                 return redirect(f"/users/{g.user.id}")
         flash("Incorrect Password, profile not udpated!", "danger")
@@ -234,7 +553,7 @@ def profile(user_id):
     return render_template("/users/profile.html", form=form, user=user)
 
 
-@app.route('/users/delete', methods=["POST"])
+@bp.route('/users/delete', methods=["POST"])
 def delete_user():
     """Delete user."""
 
@@ -244,8 +563,12 @@ def delete_user():
 
     do_logout()
 
+    user_id = g.user.id
     db.session.delete(g.user)
+    invalidation.publish(USER_CHANGED, user_id=user_id, deleted=True)
     db.session.commit()
+    archive.delete_user(user_id)
+    user_changed(user_id, True)
 
     return redirect("/signup")
 
@@ -253,7 +576,7 @@ def delete_user():
 ##############################################################################
 # Messages routes:
 
-@app.route('/messages/new', methods=["GET", "POST"])
+@bp.route('/messages/new', methods=["GET", "POST"])
 def messages_add():
     """Add a message:
 
@@ -269,22 +592,33 @@ def messages_add():
     if form.validate_on_submit():
         msg = Message(text=form.text.data)
         g.user.messages.append(msg)
+        db.session.flush()
+        tags = index_message(msg)
+        live_hub.publish(msg.id, g.user.id)
+        invalidation.publish(MESSAGE_POSTED, message_id=msg.id,
+                             user_id=g.user.id,
+                             timestamp=msg.timestamp.isoformat())
         db.session.commit()
+        # at once here; other workers apply the event when it arrives
+        message_posted(msg.id, g.user.id, msg.timestamp.isoformat())
+        trending.record(tags)
 
         return redirect(f"/users/{g.user.id}")
 
     return render_template('messages/new.html', form=form)
 
 
-@app.route('/messages/<int:message_id>', methods=["GET"])
+@bp.route('/messages/<int:message_id>', methods=["GET"])
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.get(message_id)
+    msg = (Message.query
+           .filter(Message.id == message_id, Message.not_deleted())
+           .first_or_404())
     return render_template('messages/show.html', message=msg)
 
 
-@app.route('/messages/<int:message_id>/delete', methods=["POST"])
+@bp.route('/messages/<int:message_id>/delete', methods=["POST"])
 def messages_destroy(message_id):
     """Delete a message."""
 
@@ -292,18 +626,76 @@ def messages_destroy(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    msg = Message.query.get(message_id)
-    db.session.delete(msg)
+    # only marked here; purger.py removes the row and its likes later
+    author_id = readmodels.message_author_id(message_id)
+    marked = author_id is not None and db.session.execute(
+        Message.__table__.update()
+        .where(Message.id == message_id, Message.not_deleted())
+        .values(deleted_at=datetime.utcnow())).rowcount
+
+    if not marked:
+        # archived, maybe just now; only its author can see it there
+        if not archive.holds(g.user.id, message_id):
+            abort(404)
+        author_id = g.user.id
+        archive.delete_messages([message_id])
+
+    invalidation.publish(MESSAGE_DELETED, message_id=message_id,
+                         user_id=author_id)
     db.session.commit()
+    # at once here; other workers apply the event when it arrives
+    message_deleted(message_id, author_id)
 
     flash("Message deleted", "success")
     return redirect(f"/users/{g.user.id}")
 
+##############################################################################
+# Tag and mention routes:
+
+@bp.route('/trending')
+def trending_tags():
+    """Show the most used tags of the last TRENDING_WINDOW_MINUTES."""
+
+    return render_template('messages/trending.html',
+                           tags=trending.top(limit=20),
+                           window=trending.window)
+
+
+@bp.route('/tags/<tag>')
+def tag_timeline(tag):
+    """Show messages using #tag, newest first.
+
+    Can take a 'before' message id in querystring for the next page.
+    """
+
+    before = request.args.get('before', type=int)
+    messages = readmodels.tag_messages(tag.lower(), before=before, limit=100)
+
+    return render_template('messages/timeline.html', messages=messages,
+                           title=f"#{tag.lower()}", base_url=f"/tags/{tag}")
+
+
+@bp.route('/users/<int:user_id>/mentions')
+def mention_timeline(user_id):
+    """Show messages mentioning a user, newest first.
+
+    Can take a 'before' message id in querystring for the next page.
+    """
+
+    user = User.query.get_or_404(user_id)
+    before = request.args.get('before', type=int)
+    messages = readmodels.mention_messages(user_id, before=before, limit=100)
+
+    return render_template('messages/timeline.html', messages=messages,
+                           title=f"Mentions of @{user.username}",
+                           base_url=f"/users/{user_id}/mentions")
+
+
 ##############################################################################
 # Like routes:
 
 
-@app.route("/users/<int:user_id>/likes", methods=["GET"])
+@bp.route("/users/<int:user_id>/likes", methods=["GET"])
 def display_like_messages(user_id):
     """Display liked messages"""
 
@@ -312,38 +704,84 @@ def display_like_messages(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('/users/likes.html', user=user, likes=user.likes)
+    likes = readmodels.liked_messages(user_id)
+
+    # Show the user their own likes that haven't been flushed yet
+    if user.id == g.user.id:
+        pending = like_buffer.pending_for(user.id)
+        likes = [msg for msg in likes if pending.get(msg.id, True)]
+        shown = {msg.id for msg in likes}
+        added = [msg_id for msg_id, liked in pending.items()
+                 if liked and msg_id not in shown]
+        likes = readmodels.messages_by_ids(added) + likes
 
+    return render_template('/users/likes.html', user=user, likes=likes,
+                           stats=user_stats(user_id))
 
-@app.route("/users/add_like/<int:msg_id>", methods=["POST"])
+
+@bp.route("/users/add_like/<int:msg_id>", methods=["POST"])
 def message_like(msg_id):
-    """Handles user like messages"""
+    """Handles user like messages
+
+    The like is recorded in the write-behind buffer (see likes.py) and
+    written to the database with the next batch.
+    """
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    # Get the likes of the message
-    like = Likes.query.filter_by(message_id=msg_id).first()
-    message = Message.query.get(msg_id)
-    if message.user.id != g.user.id:
-        if like:
-            db.session.delete(like)
+    author_id = readmodels.message_author_id(msg_id)
+    if author_id is None:
+        abort(404)
+
+    if author_id != g.user.id:
+        # the button posts the state it asks for; older pages don't
+        liked = request.form.get('liked', type=int)
+        if liked is None:
+            like_buffer.toggle(g.user.id, msg_id)
         else:
-            like = Likes(
-                user_id=g.user.id,
-                message_id=msg_id
-            )
-            db.session.add(like)
-        db.session.commit()
+            like_buffer.set(g.user.id, msg_id, bool(liked))
     return redirect("/")
 
 
+@bp.route('/popular')
+def popular_messages():
+    """Show the messages with the fastest-growing likes, best first."""
+
+    messages = readmodels.messages_by_ids(popular.top())
+
+    return render_template('messages/timeline.html', messages=messages,
+                           title="Popular")
+
+
+##############################################################################
+# Image routes:
+
+
+@bp.route('/images/<digest>/<filename>')
+def image_variant(digest, filename):
+    """Serve a resized user image from the local image cache.
+
+    Paths are content-addressed, so responses can be cached forever.
+    """
+
+    if (not DIGEST_RE.match(digest)
+            or filename not in {images.variant_filename(v) for v in VARIANTS}):
+        abort(404)
+
+    response = send_from_directory(images.variant_dir(digest), filename,
+                                   max_age=IMAGE_MAX_AGE)
+    response.headers['Cache-Control'] = (
+        f"public, max-age={IMAGE_MAX_AGE}, immutable")
+    return response
+
+
 ##############################################################################
 # Homepage and error pages
 
 
-@app.route('/')
+@bp.route('/')
 def homepage():
     """Show homepage:
 
@@ -353,31 +791,69 @@ def homepage():
 
     if g.user:
         # Get the folliwing id's and include loggedin user id
-        following_ids = [f.id for f in g.user.following] + [g.user.id]
-        messages = (Message
-                    .query
-                    .filter(Message.user_id.in_(following_ids))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
+        following_ids = list(following_ids_of(g.user.id)) + [g.user.id]
+        messages = feed_messages(following_ids, limit=100,
+                                 engine=current_app.config['FEED_ENGINE'],
+                                 since=feed_window_start())
 
-        likes = [like.id for like in g.user.likes]
-        return render_template('home.html', messages=messages, likes=likes)
+        likes = like_buffer.liked_ids(g.user.id,
+                                      readmodels.liked_ids(g.user.id))
+        return render_template('home.html', messages=messages, likes=likes,
+                               stats=user_stats(g.user.id))
 
     else:
         return render_template('home-anon.html')
 
 
+@bp.route('/live')
+def live_feed():
+    """Stream the ids of new messages from followed users as server-sent
+    events."""
+
+    if not g.user:
+        abort(401)
+
+    stream = live_hub.connect(g.user.id,
+                              following_ids_of(g.user.id) | {g.user.id})
+    if stream is None:
+        return "Too many live connections.", 503, {'Retry-After': '30'}
+
+    return Response(live_hub.events(stream), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache',
+                             'X-Accel-Buffering': 'no'})
+
+
+@bp.route('/feed/since')
+def feed_since():
+    """Render the homepage messages newer than the 'after' message id."""
+
+    if not g.user:
+        abort(401)
+
+    after = request.args.get('after', 0, type=int)
+    following_ids = list(following_ids_of(g.user.id)) + [g.user.id]
+    messages = readmodels.feed_since(following_ids, after)
+
+    likes = like_buffer.liked_ids(g.user.id, readmodels.liked_ids(g.user.id))
+    return render_template('messages/feed_items.html', messages=messages,
+                           likes=likes)
+
+
 ##############################################################################
 # Turn off all caching in Flask
 #   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
+#   handled elsewhere, so only profiles with NO_CACHE_HEADERS install it)
 #
 # https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
 
-@app.after_request
 def add_header(req):
-    """Add non-caching headers on every request."""
+    """Add non-caching headers on every request.
+
+    Responses already marked immutable (e.g. cached images) are left alone.
+    """
+
+    if 'immutable' in req.headers.get('Cache-Control', ''):
+        return req
 
     req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
     req.headers["Pragma"] = "no-cache"
@@ -0,0 +1,418 @@
+"""Cold archive of old messages in compressed segment files.
+
+`flask archive run` moves messages older than ARCHIVE_AFTER_DAYS out of
+the `messages` table into a new segment file in ARCHIVE_DIR (default
+<instance>/archive). The hot table and its indexes then stay small
+enough to live in RAM. Segments are written once and never modified.
+
+A segment holds the archived messages sorted by (user_id, timestamp,
+id). They are cut into blocks of BLOCK_RECORDS JSON lines, and each block
+is zlib-compressed. A footer holds the sparse index: the first key,
+offset and length of every block. Readers memory-map the file, bisect
+the index to find a user's blocks and decompress only those, newest
+block first.
+
+Liked messages stay hot, because likes reference them. Archived messages
+are read-only: they can't be liked, and their tag and mention index
+entries are dropped with them. Deleting one, or its author, appends a
+tombstone to TOMBSTONES in ARCHIVE_DIR, which every reader applies; a
+message soft-deleted while a run archives it is tombstoned by the run.
+
+A run writes and syncs its segment before it deletes anything. If it
+dies between the two, the messages exist in both places, and readers
+drop the duplicates by id.
+"""
+
+import bisect
+import json
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from mmap import mmap, ACCESS_READ
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import exists
+
+from accesslog import cache_result
+from models import db, Likes, Message
+from readmodels import MessageRow
+
+MAGIC = b'WSEG'
+FOOTER = struct.Struct('<Q4s')
+SUFFIX = '.seg'
+
+# Append-only log of deleted archived messages and users, one
+# "message <id>" or "user <id>" line each.
+TOMBSTONES = 'deleted.log'
+
+# Messages per compressed block; one block is the unit of reading.
+BLOCK_RECORDS = 256
+
+# Rows deleted from the hot table per statement.
+DELETE_BATCH = 10000
+
+# Decompressed blocks kept in memory per process.
+BLOCK_CACHE_SIZE = 256
+
+
+class Segment:
+    """One read-only, memory-mapped segment file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        with open(path, 'rb') as f:
+            self._map = mmap(f.fileno(), 0, access=ACCESS_READ)
+
+        index_size, magic = FOOTER.unpack_from(self._map,
+                                               len(self._map) - FOOTER.size)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a message archive segment")
+
+        start = len(self._map) - FOOTER.size - index_size
+        index = json.loads(self._map[start:start + index_size])
+        self.newest = datetime.fromisoformat(index['newest'])
+        self.keys = [tuple(block[:3]) for block in index['blocks']]
+        self.spans = [tuple(block[3:]) for block in index['blocks']]
+
+    def blocks_of(self, user_id):
+        """Return the numbers of the blocks that can hold `user_id`."""
+
+        # the block before the first one starting with `user_id` may hold
+        # its oldest messages
+        first = max(bisect.bisect_left(self.keys, (user_id,)) - 1, 0)
+        stop = bisect.bisect_left(self.keys, (user_id + 1,))
+        return range(first, stop)
+
+    def read_block(self, number):
+        """Return the records of block `number`."""
+
+        offset, length = self.spans[number]
+        data = zlib.decompress(self._map[offset:offset + length])
+        return [json.loads(line) for line in data.splitlines()]
+
+    def close(self):
+        self._map.close()
+
+
+class MessageArchive:
+    """Write and read the segment files of archived messages."""
+
+    def __init__(self):
+        self.directory = None
+        self.after = timedelta(days=365)
+        self._segments = []
+        self._scanned = None
+        self._blocks = OrderedDict()
+        self._counts = {}
+        self._deleted = {'message': set(), 'user': set()}
+        self._tombstones_read = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Read ARCHIVE_DIR and ARCHIVE_AFTER_DAYS."""
+
+        self.directory = app.config.get('ARCHIVE_DIR') or os.path.join(
+            app.instance_path, 'archive')
+        self.after = timedelta(days=app.config.get('ARCHIVE_AFTER_DAYS',
+                                                   365))
+        self._scanned = None
+        self._forget_tombstones()
+        app.cli.add_command(archive_cli)
+
+    # Reading ##############################################################
+
+    def segments(self):
+        """Return the open segments, newest first.
+
+        The directory is rescanned when its mtime changes, so segments
+        written by other processes show up.
+        """
+
+        try:
+            mtime = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            return []
+
+        if mtime != self._scanned:
+            with self._lock:
+                known = {segment.name: segment for segment in self._segments}
+                names = sorted((name for name in os.listdir(self.directory)
+                                if name.endswith(SUFFIX)), reverse=True)
+                self._segments = [known.get(name) or Segment(
+                    os.path.join(self.directory, name)) for name in names]
+                self._blocks.clear()
+                self._counts.clear()
+                self._scanned = mtime
+
+        return self._segments
+
+    def _block(self, segment, number):
+        key = (segment.name, number)
+        with self._lock:
+            records = self._blocks.get(key)
+            if records is not None:
+                self._blocks.move_to_end(key)
+        cache_result('archive', records is not None)
+        if records is not None:
+            return records
+
+        records = segment.read_block(number)
+        with self._lock:
+            self._blocks[key] = records
+            while len(self._blocks) > BLOCK_CACHE_SIZE:
+                self._blocks.popitem(last=False)
+        return records
+
+    # Tombstones ###########################################################
+
+    def _forget_tombstones(self):
+        with self._lock:
+            self._deleted = {'message': set(), 'user': set()}
+            self._tombstones_read = 0
+            self._counts.clear()
+
+    def _tombstones(self):
+        """Return the {'message': ids, 'user': ids} deleted so far,
+        reading the lines other processes appended since last time."""
+
+        try:
+            with open(os.path.join(self.directory, TOMBSTONES), 'rb') as f:
+                if os.fstat(f.fileno()).st_size < self._tombstones_read:
+                    self._forget_tombstones()
+                f.seek(self._tombstones_read)
+                data = f.read()
+        except FileNotFoundError:
+            return self._deleted
+
+        # a line still being appended is read next time
+        data = data[:data.rfind(b'\n') + 1]
+        if data:
+            with self._lock:
+                for line in data.decode().splitlines():
+                    kind, _, ident = line.partition(' ')
+                    self._deleted[kind].add(int(ident))
+                self._tombstones_read += len(data)
+                self._counts.clear()
+        return self._deleted
+
+    def _tombstone(self, kind, ids):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, TOMBSTONES), 'a') as f:
+            f.write(''.join(f"{kind} {ident}\n" for ident in ids))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def delete_messages(self, message_ids):
+        """Tombstone archived `message_ids`."""
+
+        if message_ids:
+            self._tombstone('message', message_ids)
+
+    def delete_user(self, user_id):
+        """Tombstone every archived message of `user_id`."""
+
+        self._tombstone('user', [user_id])
+
+    def holds(self, user_id, message_id):
+        """Whether `message_id` is an archived, undeleted message of
+        `user_id`."""
+
+        deleted = self._tombstones()
+        if message_id in deleted['message'] or user_id in deleted['user']:
+            return False
+        return any(record[0] == message_id and record[1] == user_id
+                   for segment in self.segments()
+                   for number in segment.blocks_of(user_id)
+                   for record in self._block(segment, number))
+
+    def newest(self):
+        """Return the newest archived timestamp, or None."""
+
+        segments = self.segments()
+        return max(segment.newest for segment in segments) \
+            if segments else None
+
+    def user_messages(self, author, before=None, limit=100):
+        """Return archived messages of `author` (a readmodels.Author).
+
+        Newest first, older than the message id `before` if given, as
+        `MessageRow`s.
+        """
+
+        deleted = self._tombstones()
+        if author.id in deleted['user']:
+            return []
+
+        found = {}
+        for segment in self.segments():
+            taken = 0
+            for number in reversed(segment.blocks_of(author.id)):
+                for msg_id, user_id, timestamp, text in reversed(
+                        self._block(segment, number)):
+                    if user_id != author.id or (before and msg_id >= before) \
+                            or msg_id in deleted['message']:
+                        continue
+                    found[msg_id] = MessageRow(
+                        msg_id, text, datetime.fromisoformat(timestamp),
+                        author)
+                    taken += 1
+                if taken >= limit:
+                    break
+
+        rows = sorted(found.values(), key=lambda row: (row.timestamp, row.id),
+                      reverse=True)
+        return rows[:limit]
+
+    def user_records(self, user_id):
+        """Yield (id, text, timestamp) for every archived message of
+        `user_id`, oldest segment first, one block in memory at a time."""
+
+        deleted = self._tombstones()
+        if user_id in deleted['user']:
+            return
+
+        seen = set()
+        for segment in reversed(self.segments()):
+            for number in segment.blocks_of(user_id):
+                for msg_id, author_id, timestamp, text in \
+                        segment.read_block(number):
+                    if author_id == user_id and msg_id not in seen \
+                            and msg_id not in deleted['message']:
+                        seen.add(msg_id)
+                        yield msg_id, text, datetime.fromisoformat(timestamp)
+
+    def count(self, user_id):
+        """Return how many messages of `user_id` are archived."""
+
+        segments = self.segments()
+        deleted = self._tombstones()
+        if user_id in deleted['user']:
+            return 0
+        if user_id not in self._counts:
+            ids = {record[0]
+                   for segment in segments
+                   for number in segment.blocks_of(user_id)
+                   for record in self._block(segment, number)
+                   if record[1] == user_id}
+            self._counts[user_id] = len(ids - deleted['message'])
+        return self._counts[user_id]
+
+    # Writing ##############################################################
+
+    def run(self, now=None):
+        """Archive the messages older than the cutoff into a new segment.
+
+        Returns (segment name, messages archived); the name is None when
+        nothing was old enough.
+        """
+
+        cutoff = (now or datetime.utcnow()) - self.after
+        archivable = (Message.timestamp < cutoff, Message.not_deleted(),
+                      ~exists().where(Likes.message_id == Message.id))
+
+        rows = (db.session
+                .query(Message.id, Message.user_id, Message.timestamp,
+                       Message.text)
+                .filter(*archivable)
+                .order_by(Message.user_id, Message.timestamp, Message.id)
+                .yield_per(BLOCK_RECORDS * 4))
+
+        os.makedirs(self.directory, exist_ok=True)
+        name = datetime.utcnow().strftime('%Y%m%dT%H%M%S%f') + SUFFIX
+        path = os.path.join(self.directory, name)
+        written = _write_segment(path + '.tmp', rows)
+        db.session.commit()
+
+        if not written:
+            os.remove(path + '.tmp')
+            return None, 0
+
+        os.rename(path + '.tmp', path)
+
+        # exactly the rows in the segment: rows may have become archivable
+        # since they were read, and must not go without a copy. Rows
+        # soft-deleted since then are locked, tombstoned and removed with
+        # the rest; messages_destroy finds them archived from then on.
+        for start in range(0, len(written), DELETE_BATCH):
+            batch = written[start:start + DELETE_BATCH]
+            self.delete_messages([
+                msg_id for msg_id, deleted_at in (
+                    db.session.query(Message.id, Message.deleted_at)
+                    .filter(Message.id.in_(batch))
+                    .with_for_update())
+                if deleted_at is not None])
+            db.session.execute(Message.__table__.delete().where(
+                Message.id.in_(batch)))
+            db.session.commit()
+
+        return name, len(written)
+
+
+def _write_segment(path, rows):
+    """Write `rows` (sorted) as a segment at `path`; return their ids."""
+
+    blocks = []
+    block = []
+    written = []
+    offset = 0
+    newest = datetime.min
+
+    with open(path, 'wb') as f:
+        def flush():
+            nonlocal offset
+            first = block[0]
+            data = zlib.compress(
+                b''.join(json.dumps(record).encode() + b'\n'
+                         for record in block), 6)
+            f.write(data)
+            # key (user_id, timestamp, id), then where the block is
+            blocks.append([first[1], first[2], first[0], offset, len(data)])
+            offset += len(data)
+            block.clear()
+
+        for msg_id, user_id, timestamp, text in rows:
+            block.append([msg_id, user_id, timestamp.isoformat(), text])
+            newest = max(newest, timestamp)
+            written.append(msg_id)
+            if len(block) == BLOCK_RECORDS:
+                flush()
+        if block:
+            flush()
+
+        index = json.dumps({'newest': newest.isoformat(),
+                            'blocks': blocks}).encode()
+        f.write(index)
+        f.write(FOOTER.pack(len(index), MAGIC))
+        f.flush()
+        os.fsync(f.fileno())
+
+    return written
+
+
+archive = MessageArchive()
+
+archive_cli = AppGroup('archive', help="Manage the cold message archive.")
+
+
+@archive_cli.command('run')
+def run_command():
+    """Move messages older than ARCHIVE_AFTER_DAYS into a new segment."""
+
+    name, count = archive.run()
+    click.echo(f"Archived {count} messages to {name}." if name
+               else "Nothing to archive.")
+
+
+@archive_cli.command('stats')
+def stats_command():
+    """List the archive segments."""
+
+    for segment in archive.segments():
+        click.echo(f"{segment.name}: {len(segment.keys)} blocks, "
+                   f"{os.path.getsize(segment.path)} bytes, "
+                   f"newest {segment.newest:%Y-%m-%d}")
@@ -0,0 +1,28 @@
+"""ASGI entry point: the async read path in front of the Flask app.
+
+    uvicorn asgi:application --workers 4
+
+GET / and GET /users/<id> are served by asyncreads.ReadPath on the event
+loop; everything else runs the Flask app on a thread pool through
+asyncreads.WsgiFallback.
+Builds the app with the 'prod' profile (or WARBLER_PROFILE), like
+wsgi.py.
+
+With MESSAGE_SNOWFLAKE_IDS, run several workers through gunicorn so each
+gets its own snowflake worker id (see gunicorn.conf.py):
+
+    gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker \
+        asgi:application
+"""
+
+import os
+
+from app import create_app
+from asyncreads import ReadPath, WsgiFallback
+from jinjacache import warmup
+
+app = create_app(os.environ.get('WARBLER_PROFILE', 'prod'))
+warmup(app)
+
+application = ReadPath(app, WsgiFallback(
+    app, threads=app.config.get('ASGI_WSGI_THREADS', 32)))
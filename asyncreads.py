@@ -0,0 +1,513 @@
+"""Async read path for the home feed and profile pages.
+
+A sync worker holds its thread for the whole of a request, however slow
+the client, and `homepage()` makes its queries one after another.
+`ReadPath` is an ASGI app (see asgi.py) that serves GET / and
+GET /users/<id> from an event loop instead. A waiting client costs a
+coroutine rather than a thread, and the queries that don't depend on
+each other (the viewer, followed ids, liked ids, counts, the messages)
+run at the same time. Every other request, and so every write, goes to
+the Flask app through `WsgiFallback`, which runs it on a pool of
+ASGI_WSGI_THREADS threads like a threaded gunicorn worker: a slow write
+or an open /live stream holds one of them, never the event loop or the
+other requests.
+
+On PostgreSQL, `AsyncReads` queries through an asyncpg pool of
+ASYNC_POOL_SIZE connections per process. On other databases it runs the
+readmodels functions on a pool of as many threads: the queries still
+overlap, but each holds a thread while it runs. The 'merge' FEED_ENGINE
+reads in-process timelines, so it always runs on the threads.
+
+Pages are rendered from the same templates in a Flask request context
+built from the ASGI scope, so they match what the sync routes return,
+and the app's before/after/teardown request hooks run around them as
+they do around any view: the access log records them, admission control
+limits them and anonymous profiles are served from, and stored in, the
+page cache (see pagecache.py). Anonymous home page requests fall through
+to Flask; unknown users get the sync view's 404.
+"""
+
+import asyncio
+import io
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import g, render_template, request, session
+
+import readmodels
+from app import (
+    CURR_USER_KEY, add_archived, feed_window_start, read_through_archive)
+from feeds import feed_messages
+from likes import like_buffer
+from models import message_ids
+from readmodels import Author, MessageRow, Profile, UserStats
+from snowflake import min_id_for
+
+PROFILE_PATH = re.compile(r'/users/(\d+)')
+
+POSTGRES_URL = re.compile(r'postgres(?:ql)?(?:\+\w+)?://')
+
+# Messages per page, as on the sync routes.
+PAGE_SIZE = 100
+
+PROFILE = """
+    SELECT id, username, image_url, header_image_url, bio, location
+    FROM users WHERE id = $1
+"""
+
+FOLLOWING_IDS = """
+    SELECT user_being_followed_id FROM follows WHERE user_following_id = $1
+"""
+
+LIKED_IDS = "SELECT message_id FROM likes WHERE user_id = $1"
+
+USER_STATS = """
+    SELECT (SELECT count(*) FROM messages
+            WHERE user_id = $1 AND deleted_at IS NULL),
+           (SELECT count(*) FROM follows WHERE user_following_id = $1),
+           (SELECT count(*) FROM follows WHERE user_being_followed_id = $1),
+           (SELECT count(*) FROM likes WHERE user_id = $1)
+"""
+
+MESSAGES = """
+    SELECT m.id, m.text, m.timestamp, u.id, u.username, u.image_url
+    FROM messages m JOIN users u ON u.id = m.user_id
+    WHERE {where} AND m.deleted_at IS NULL
+    ORDER BY {order} LIMIT {limit}
+"""
+
+# The viewer and the users they follow, read in the same statement as
+# the messages so the feed needn't wait for the follow list.
+FEED_AUTHORS = """
+    m.user_id = ANY(array_append(ARRAY(
+        SELECT user_being_followed_id FROM follows
+        WHERE user_following_id = $1), $1))
+"""
+
+
+def _newest_first():
+    if message_ids.enabled:
+        return "m.id DESC"
+    return "m.timestamp DESC, m.id DESC"
+
+
+def _message_rows(rows):
+    return [MessageRow(msg_id, text, timestamp,
+                       Author(user_id, username, image_url))
+            for msg_id, text, timestamp, user_id, username, image_url
+            in rows]
+
+
+def _home_feed(user_id, limit, engine, since):
+    user_ids = readmodels.following_ids(user_id) | {user_id}
+    return feed_messages(user_ids, limit, engine=engine, since=since)
+
+
+class AsyncReads:
+    """Awaitable versions of the read models behind the home and profile
+    pages."""
+
+    def __init__(self, app):
+        self.app = app
+        self.size = app.config.get('ASYNC_POOL_SIZE', 10)
+        self.engine = app.config.get('FEED_ENGINE', 'sql')
+
+        url = app.config['SQLALCHEMY_DATABASE_URI']
+        match = POSTGRES_URL.match(url)
+        self.dsn = 'postgresql://' + url[match.end():] if match else None
+
+        self._pool = None
+        self._threads = None
+
+    async def _connect(self):
+        # concurrent first callers await the same pool
+        if self._pool is None:
+            import asyncpg
+            self._pool = asyncio.ensure_future(asyncpg.create_pool(
+                self.dsn, min_size=1, max_size=self.size))
+        return await self._pool
+
+    async def close(self):
+        """Close the connection pool; the next query opens a new one."""
+
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            await (await pool).close()
+
+    async def _fetch(self, sql, *args):
+        pool = await self._connect()
+        return await pool.fetch(sql, *args)
+
+    async def _call(self, func, *args):
+        """Run the sync `func` on the thread pool, in an app context."""
+
+        if self._threads is None:
+            self._threads = ThreadPoolExecutor(
+                self.size, thread_name_prefix='async-reads')
+
+        def run():
+            with self.app.app_context():
+                return func(*args)
+
+        return await asyncio.get_running_loop().run_in_executor(
+            self._threads, run)
+
+    async def profile(self, user_id):
+        """Return the `Profile` of `user_id`, or None."""
+
+        if self.dsn is None:
+            return await self._call(readmodels.profile, user_id)
+
+        rows = await self._fetch(PROFILE, user_id)
+        return Profile(*rows[0]) if rows else None
+
+    async def following_ids(self, user_id):
+        """Return the ids of the users `user_id` follows."""
+
+        if self.dsn is None:
+            return await self._call(readmodels.following_ids, user_id)
+
+        return {uid for uid, in await self._fetch(FOLLOWING_IDS, user_id)}
+
+    async def liked_ids(self, user_id):
+        """Return the ids of the messages `user_id` liked (written ones)."""
+
+        if self.dsn is None:
+            return await self._call(readmodels.liked_ids, user_id)
+
+        return {msg_id for msg_id, in await self._fetch(LIKED_IDS, user_id)}
+
+    async def user_stats(self, user_id):
+        """Return the `UserStats` of `user_id`'s rows in the hot tables."""
+
+        if self.dsn is None:
+            return await self._call(readmodels.user_stats, user_id)
+
+        rows = await self._fetch(USER_STATS, user_id)
+        return UserStats(*rows[0])
+
+    async def home_feed(self, user_id, limit=PAGE_SIZE, since=None):
+        """Return the newest messages of `user_id` and the users they
+        follow, posted from `since` on if that fills the page."""
+
+        if self.dsn is None or self.engine == 'merge':
+            return await self._call(_home_feed, user_id, limit, self.engine,
+                                    since)
+
+        where, args = FEED_AUTHORS, [user_id, limit]
+        if since is not None:
+            if message_ids.enabled:
+                where += " AND m.id >= $3"
+                args.append(min_id_for(since))
+            else:
+                where += " AND m.timestamp >= $3"
+                args.append(since)
+
+        messages = _message_rows(await self._fetch(
+            MESSAGES.format(where=where, order=_newest_first(), limit='$2'),
+            *args))
+        if since is not None and len(messages) < limit:
+            # as feeds.feed_messages: fill the page from before `since`
+            return await self.home_feed(user_id, limit)
+        return messages
+
+    async def user_messages(self, user_id, before=None, limit=PAGE_SIZE,
+                            since=None):
+        """Return the newest messages of `user_id`, older than `before` if
+        set and posted from `since` on if given."""
+
+        if self.dsn is None:
+            return await self._call(readmodels.user_messages, user_id,
+                                    before, limit, since)
+
+        where, args = "m.user_id = $1", [user_id, limit]
+        if before:
+            args.append(before)
+            where += f" AND m.id < ${len(args)}"
+        if since is not None:
+            if message_ids.enabled:
+                args.append(min_id_for(since))
+                where += f" AND m.id >= ${len(args)}"
+            else:
+                args.append(since)
+                where += f" AND m.timestamp >= ${len(args)}"
+
+        return _message_rows(await self._fetch(
+            MESSAGES.format(where=where, order=_newest_first(), limit='$2'),
+            *args))
+
+
+class ReadPath:
+    """ASGI app serving the home and profile pages with `AsyncReads`.
+
+    Every other request goes to `fallback`, the ASGI app wrapping the
+    Flask app.
+    """
+
+    def __init__(self, app, fallback):
+        self.app = app
+        self.fallback = fallback
+        self.reads = AsyncReads(app)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+
+        if scope['type'] == 'http' and scope['method'] == 'GET':
+            response = await self._page(scope)
+            if response is not None:
+                return await self._send(response, send)
+
+        await self.fallback(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.reads.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _page(self, scope):
+        """Return the response for an async page, or None to fall back."""
+
+        if scope['path'] == '/':
+            handler, args = self.home, ()
+        else:
+            match = PROFILE_PATH.fullmatch(scope['path'])
+            if not match:
+                return None
+            handler, args = self.profile, (int(match.group(1)),)
+
+        with self._context(scope):
+            if handler == self.home and CURR_USER_KEY not in session:
+                return None
+
+            # as Flask's wsgi_app and full_dispatch_request: the app's
+            # request hooks (page cache, admission, access log...) and
+            # error handlers apply to these pages too. The sync parts run
+            # on a thread so they never block the event loop.
+            try:
+                try:
+                    rv = await asyncio.to_thread(self.app.preprocess_request)
+                    if rv is None:
+                        rv = await handler(*args)
+                    if rv is None:
+                        rv = await asyncio.to_thread(
+                            self.app.dispatch_request)
+                except Exception as err:
+                    rv = self.app.handle_user_exception(err)
+                return self.app.finalize_request(rv)
+            except Exception as err:
+                return self.app.handle_exception(err)
+
+    def _context(self, scope):
+        """Return a Flask request context for the ASGI `scope`."""
+
+        headers = [(name.decode('latin-1'), value.decode('latin-1'))
+                   for name, value in scope['headers']]
+        host = dict(headers).get('host')
+        if host is None:
+            server = scope.get('server') or ('localhost', None)
+            host = f"{server[0]}:{server[1]}" if server[1] else server[0]
+
+        return self.app.test_request_context(
+            scope['path'],
+            base_url=f"{scope['scheme']}://{host}{scope.get('root_path', '')}",
+            query_string=scope['query_string'],
+            headers=headers)
+
+    def _render(self, viewer, following, template, **context):
+        """Render `template` for `viewer` the way the sync routes do."""
+
+        g.user = viewer
+        g.following_ids = {viewer.id: following} if viewer else {}
+        return render_template(template, **context)
+
+    async def home(self):
+        """The logged-in homepage; see app.homepage. Returns None when the
+        sync view should answer instead."""
+
+        user_id = session[CURR_USER_KEY]
+        since = feed_window_start()
+
+        viewer, following, liked, stats, messages = await asyncio.gather(
+            self.reads.profile(user_id),
+            self.reads.following_ids(user_id),
+            self.reads.liked_ids(user_id),
+            self.reads.user_stats(user_id),
+            self.reads.home_feed(user_id, PAGE_SIZE, since))
+
+        if viewer is None:
+            return None
+
+        stats = await asyncio.to_thread(add_archived, user_id, stats)
+
+        return self._render(viewer, following, 'home.html',
+                            messages=messages,
+                            likes=like_buffer.liked_ids(user_id, liked),
+                            stats=stats)
+
+    async def profile(self, user_id):
+        """A user's profile; see app.users_show. Returns None when the sync
+        view should answer instead."""
+
+        viewer_id = session.get(CURR_USER_KEY)
+        before = request.args.get('before', type=int)
+        since = feed_window_start()
+
+        viewer_reads = (self.reads.profile(viewer_id),
+                        self.reads.following_ids(viewer_id)) \
+            if viewer_id is not None else ()
+
+        user, messages, stats, *viewer = await asyncio.gather(
+            self.reads.profile(user_id),
+            self.reads.user_messages(user_id, before, PAGE_SIZE, since),
+            self.reads.user_stats(user_id),
+            *viewer_reads)
+
+        if user is None:
+            return None
+
+        viewer, following = viewer or (None, None)
+        if since is not None and len(messages) < PAGE_SIZE:
+            # see app.profile_messages
+            messages += await self.reads.user_messages(
+                user_id, messages[-1].id if messages else before,
+                PAGE_SIZE - len(messages))
+        # the archive reads map and decompress segment files
+        messages, stats = await asyncio.gather(
+            asyncio.to_thread(read_through_archive, user, messages, before,
+                              PAGE_SIZE),
+            asyncio.to_thread(add_archived, user_id, stats))
+
+        return self._render(viewer, following, 'users/show.html',
+                            user=user, messages=messages, stats=stats)
+
+    async def _send(self, response, send):
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': [(name.lower().encode('latin-1'),
+                         value.encode('latin-1'))
+                        for name, value in response.headers],
+        })
+        await send({'type': 'http.response.body',
+                    'body': response.get_data()})
+
+
+class WsgiFallback:
+    """ASGI app running a WSGI app on a thread pool.
+
+    The request body is read in full first, as the WSGI server would;
+    the response is sent chunk by chunk as the app yields it, and a
+    streaming response stops at the next chunk once the client has gone.
+    """
+
+    def __init__(self, wsgi_app, threads=32):
+        self.wsgi_app = wsgi_app
+        self._threads = ThreadPoolExecutor(threads,
+                                           thread_name_prefix='wsgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            raise ValueError(f"Unsupported ASGI scope {scope['type']!r}")
+
+        body = io.BytesIO()
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body.write(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        body.seek(0)
+
+        gone = threading.Event()
+
+        async def watch():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            gone.set()
+
+        watcher = asyncio.ensure_future(watch())
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                self._threads, self._run, _environ(scope, body), send,
+                asyncio.get_running_loop(), gone)
+        finally:
+            watcher.cancel()
+
+    def _run(self, environ, send, loop, gone):
+        """Call the app on this pool thread, sending its response."""
+
+        def call(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        head = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and head.get('sent'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            head.update(status=int(status.split(' ', 1)[0]), headers=[
+                (name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in headers])
+            return write
+
+        def write(data):
+            if not head.get('sent'):
+                call({'type': 'http.response.start',
+                      'status': head['status'], 'headers': head['headers']})
+                head['sent'] = True
+            if data:
+                call({'type': 'http.response.body', 'body': bytes(data),
+                      'more_body': True})
+
+        result = self.wsgi_app(environ, start_response)
+        try:
+            for chunk in result:
+                if gone.is_set():
+                    return
+                write(chunk)
+            write(b'')
+            call({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+
+def _environ(scope, body):
+    """Return the WSGI environ of the ASGI http `scope`."""
+
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        value = value.decode('latin-1')
+        environ[name] = f"{environ[name]},{value}" if name in environ \
+            else value
+    return environ
@@ -0,0 +1,208 @@
+"""Username and email availability, prechecked in memory.
+
+Each worker keeps a Bloom filter of every username and email in use. A
+name the filter has never seen is certainly free and is answered without
+touching the database; only possible matches (real ones, or about
+NAME_FILTER_ERROR_RATE of free names) are looked up. Signup checks this
+before paying for a bcrypt hash, and /api/username-available answers
+usernames from it. Emails are only checked inside signup, whose answer
+doesn't say which of the two is taken, so nobody can probe whether an
+address has an account.
+
+The filter is built from the users table in a background thread on
+first use; until it is ready, every check goes to the database. It is
+sized for NAME_FILTER_CAPACITY users or twice the current count,
+whichever is more. New names are added as USER_CHANGED events arrive (see
+invalidation.py), from this worker or any other. Bloom filters can't
+forget, so renamed and deleted users leave stale entries behind; these
+only cost a database lookup. After NAME_FILTER_REBUILD_AFTER stale
+entries, or once the filter is over capacity, it is rebuilt in a
+background thread while the old one keeps answering.
+"""
+
+import hashlib
+import logging
+import math
+import threading
+
+from accesslog import cache_result
+from models import db, user_by_username, User
+
+logger = logging.getLogger(__name__)
+
+# Users read per round trip while building.
+BUILD_BATCH = 10000
+
+
+class BloomFilter:
+    """A fixed-size Bloom filter of strings."""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(8, math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        # double hashing: two 64-bit halves of one digest give every probe
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return ((first + n * second) % self.size
+                for n in range(self.hashes))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self._bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(key))
+
+
+def _username_key(username):
+    return 'u:' + username
+
+
+def _email_key(email):
+    return 'e:' + email
+
+
+class NameAvailability:
+    """Answer "is this username / email free?" mostly from memory."""
+
+    def __init__(self):
+        self.app = None
+        self.capacity = 1_000_000
+        self.error_rate = 0.01
+        self.rebuild_after = 10_000
+        self._filter = None
+        self._stale = 0
+        self._pending = None
+        self._rebuilding = False
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Read the NAME_FILTER_* settings."""
+
+        self.app = app
+        self.capacity = app.config.get('NAME_FILTER_CAPACITY', self.capacity)
+        self.error_rate = app.config.get('NAME_FILTER_ERROR_RATE',
+                                         self.error_rate)
+        self.rebuild_after = app.config.get('NAME_FILTER_REBUILD_AFTER',
+                                            self.rebuild_after)
+        self._filter = None
+
+    # Building #############################################################
+
+    def build(self):
+        """Read every username and email into a new filter and use it."""
+
+        with self._lock:
+            # names added while we read are replayed into the new filter
+            self._pending = []
+            stale = self._stale
+
+        try:
+            users = db.session.query(db.func.count(User.id)).scalar()
+            # a username and an email per user
+            bloom = BloomFilter(2 * max(self.capacity, 2 * users),
+                                self.error_rate)
+            for username, email in (db.session
+                                    .query(User.username, User.email)
+                                    .yield_per(BUILD_BATCH)):
+                bloom.add(_username_key(username))
+                bloom.add(_email_key(email))
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+
+        with self._lock:
+            for key in self._pending:
+                bloom.add(key)
+            self._pending = None
+            self._stale -= stale
+            self._filter = bloom
+
+        return bloom
+
+    def _current(self):
+        """Return the filter, or None while the first one is built."""
+
+        bloom = self._filter
+        if (bloom is None or self._stale > self.rebuild_after
+                or bloom.count > bloom.capacity) and not self._rebuilding:
+            self._rebuild_later()
+        return bloom
+
+    def _rebuild_later(self):
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+
+        def rebuild():
+            try:
+                with self.app.app_context():
+                    self.build()
+            except Exception:
+                logger.exception("Could not rebuild the name filter")
+            finally:
+                self._rebuilding = False
+
+        threading.Thread(target=rebuild, daemon=True,
+                         name='name-filter-rebuild').start()
+
+    # Updates ##############################################################
+
+    def add(self, username=None, email=None):
+        """Record names now in use."""
+
+        keys = []
+        if username:
+            keys.append(_username_key(username))
+        if email:
+            keys.append(_email_key(email))
+
+        with self._lock:
+            if self._filter is not None:
+                for key in keys:
+                    self._filter.add(key)
+            if self._pending is not None:
+                self._pending.extend(keys)
+
+    def discard(self):
+        """Note that a user's old names may have been freed."""
+
+        with self._lock:
+            self._stale += 1
+
+    # Checks ###############################################################
+
+    def _surely_free(self, key):
+        bloom = self._current()
+        free = bloom is not None and key not in bloom
+        cache_result('names', free)
+        return free
+
+    def username_available(self, username):
+        """Return whether no user is named `username`."""
+
+        if self._surely_free(_username_key(username)):
+            return True
+        return user_by_username(username) is None
+
+    def email_available(self, email):
+        """Return whether no user has the address `email`."""
+
+        if self._surely_free(_email_key(email)):
+            return True
+        return db.session.query(User.id).filter(User.email == email) \
+            .first() is None
+
+
+availability = NameAvailability()
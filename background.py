@@ -0,0 +1,41 @@
+"""Periodic background work for a worker process."""
+
+import logging
+import threading
+
+from models import db
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTask(threading.Thread):
+    """Call `func` every `interval` seconds inside an app context.
+
+    Threads don't survive fork, so callers start these on first use in
+    each worker instead of when the app is built.
+    """
+
+    def __init__(self, app, func, interval, name):
+        super().__init__(daemon=True, name=name)
+        self.app = app
+        self.func = func
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.run_once()
+
+    def run_once(self):
+        """Call `func` now; errors are logged, never raised."""
+
+        with self.app.app_context():
+            try:
+                self.func()
+            except Exception:
+                logger.exception("Background task %s failed", self.name)
+            finally:
+                db.session.remove()
+
+    def stop(self):
+        self._stopped.set()
@@ -0,0 +1,86 @@
+"""Compare startup time and per-request overhead of the app profiles.
+
+    python -m benchmarks.app_profiles
+
+Startup is measured in a fresh interpreter per run (import + create_app),
+so module import costs are included. Per-request overhead is the mean
+time for the test client to serve GET /login, which renders a template
+but doesn't touch the database.
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+STARTUP = """
+import time
+start = time.perf_counter()
+from app import create_app
+create_app({profile!r})
+print(time.perf_counter() - start)
+"""
+
+
+def startup(profile, runs):
+    """Return the median cold start time in ms for `profile`."""
+
+    times = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, '-c', STARTUP.format(profile=profile)],
+            check=True, capture_output=True, text=True).stdout
+        times.append(float(out.strip().splitlines()[-1]) * 1000)
+    return statistics.median(times)
+
+
+def per_request(profile, requests):
+    """Return the mean time in µs to serve one request under `profile`."""
+
+    from app import create_app
+
+    app = create_app(profile)
+    # Show the toolbar's cost in dev the way developers actually run it.
+    app.debug = profile == 'dev'
+    client = app.test_client()
+
+    for _ in range(50):
+        client.get('/login')
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        client.get('/login')
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--profiles', nargs='+',
+                        default=['dev', 'test', 'prod'])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    results = {
+        profile: {
+            'startup_ms': startup(profile, args.runs),
+            'request_us': per_request(profile, args.requests),
+        }
+        for profile in args.profiles
+    }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'profile':>8} {'startup ms':>12} {'request us':>12}")
+    for profile, result in results.items():
+        print(f"{profile:>8} {result['startup_ms']:>12.1f} "
+              f"{result['request_us']:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""Measure page latency against the number of concurrent clients.
+
+    python -m benchmarks.async_reads http://127.0.0.1:8000/ --user-id 1
+    ... --concurrency 1,10,50,100,200 --requests 2000
+
+Start the servers to compare first, on the same database, e.g. the sync
+workers and the async read path (see asyncreads.py):
+
+    gunicorn -c gunicorn.conf.py -b 127.0.0.1:8000 wsgi:app
+    uvicorn asgi:application --workers 4 --port 8001
+
+and run once per URL. At each concurrency level that many keep-alive
+HTTP/1.1 connections fetch the URL back to back, logged in as
+--user-id, until --requests responses are in. --delay-ms holds each
+connection idle between requests, like a slow client would. Reports
+throughput and latency percentiles per level.
+
+The session cookie is signed with this app's SECRET_KEY, so run with the
+same SECRET_KEY as the server.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from urllib.parse import urlsplit
+
+os.environ.setdefault('DATABASE_URL', 'postgresql:///warbler-bench')
+
+from app import create_app, CURR_USER_KEY  # noqa: E402
+
+
+def session_cookie(app, user_id):
+    serializer = app.session_interface.get_signing_serializer(app)
+    return (f"{app.config['SESSION_COOKIE_NAME']}="
+            f"{serializer.dumps({CURR_USER_KEY: user_id})}")
+
+
+async def fetch(reader, writer, request):
+    """Send one request on an open connection; return the status code."""
+
+    writer.write(request)
+    await writer.drain()
+
+    head = await reader.readuntil(b'\r\n\r\n')
+    status_line, *header_lines = head.decode('latin-1').split('\r\n')
+    headers = dict(line.split(':', 1) for line in header_lines if line)
+    headers = {name.lower(): value.strip() for name, value in headers.items()}
+    if 'content-length' not in headers:
+        raise RuntimeError("responses need a Content-Length")
+
+    await reader.readexactly(int(headers['content-length']))
+    return int(status_line.split()[1])
+
+
+async def client(url, request, remaining, timings, delay):
+    reader, writer = await asyncio.open_connection(url.hostname,
+                                                   url.port or 80)
+    try:
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            start = time.perf_counter()
+            status = await fetch(reader, writer, request)
+            if status != 200:
+                raise RuntimeError(f"got HTTP {status}")
+            timings.append((time.perf_counter() - start) * 1000)
+            if delay:
+                await asyncio.sleep(delay)
+    finally:
+        writer.close()
+
+
+async def level(url, request, concurrency, requests, delay):
+    """Return (requests/s, p50, p95, p99 ms) at one concurrency level."""
+
+    remaining, timings = [requests], []
+    start = time.perf_counter()
+    await asyncio.gather(*(client(url, request, remaining, timings, delay)
+                           for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    timings.sort()
+    return (len(timings) / elapsed,
+            statistics.median(timings),
+            timings[int(len(timings) * 0.95) - 1],
+            timings[int(len(timings) * 0.99) - 1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('url')
+    parser.add_argument('--user-id', type=int)
+    parser.add_argument('--concurrency', default='1,10,50,100,200')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--delay-ms', type=float, default=0)
+    args = parser.parse_args()
+
+    url = urlsplit(args.url)
+    path = url.path or '/'
+    if url.query:
+        path += '?' + url.query
+
+    headers = [f"GET {path} HTTP/1.1", f"Host: {url.netloc}"]
+    if args.user_id is not None:
+        cookie = session_cookie(create_app('prod'), args.user_id)
+        headers.append(f"Cookie: {cookie}")
+    request = ('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1')
+
+    print(f"{'clients':>8} {'req/s':>10} {'p50 ms':>10} {'p95 ms':>10} "
+          f"{'p99 ms':>10}")
+    for concurrency in map(int, args.concurrency.split(',')):
+        rate, p50, p95, p99 = asyncio.run(level(
+            url, request, concurrency, args.requests, args.delay_ms / 1000))
+        print(f"{concurrency:>8} {rate:>10.0f} {p50:>10.2f} {p95:>10.2f} "
+              f"{p99:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
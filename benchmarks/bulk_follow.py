@@ -0,0 +1,100 @@
+"""Measure bulk follow imports against one follow per request.
+
+    DATABASE_URL=postgresql:///warbler-bench python -m benchmarks.bulk_follow
+    ... --sizes 1000,10000 --single 1000
+
+Fills a scratch database with --users users, then, logged in as user 1
+through the test client with admission limits off:
+
+- posts /api/follows once per size, half the entries ids and half
+  usernames, with a few unknown names mixed in
+- follows --single users one POST /users/follow/<id> at a time, the way
+  the UI does
+
+and reports entries per second for each. Follows are cleared between
+runs.
+"""
+
+import argparse
+import os
+import time
+
+os.environ.setdefault('DATABASE_URL', 'postgresql:///warbler-bench')
+
+from admission import admission  # noqa: E402
+from app import create_app, CURR_USER_KEY  # noqa: E402
+from models import db, Follows, User  # noqa: E402
+
+
+def seed(users):
+    db.drop_all()
+    db.create_all()
+
+    db.session.bulk_insert_mappings(User, [
+        dict(id=i, username=f"user{i}", email=f"user{i}@example.com",
+             password="$2b$12$" + "x" * 53)
+        for i in range(1, users + 1)])
+    db.session.commit()
+
+
+def entries(size):
+    """Ids and usernames of users 2..size+1, with one unknown name in 100."""
+
+    return [f"nobody{i}" if i % 100 == 0
+            else i if i % 2 else f"user{i}"
+            for i in range(2, size + 2)]
+
+
+def clear_follows():
+    Follows.query.delete()
+    db.session.commit()
+
+
+def bulk(client, size):
+    clear_follows()
+    body = {'users': entries(size)}
+    start = time.perf_counter()
+    resp = client.post('/api/follows', json=body)
+    elapsed = time.perf_counter() - start
+    assert resp.status_code == 200, resp.data
+    return elapsed
+
+
+def one_by_one(client, size):
+    clear_follows()
+    start = time.perf_counter()
+    for user_id in range(2, size + 2):
+        resp = client.post(f'/users/follow/{user_id}')
+        assert resp.status_code == 302, resp.data
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--sizes', default='1000,10000')
+    parser.add_argument('--single', type=int, default=1000)
+    args = parser.parse_args()
+
+    app = create_app('prod')
+    admission.configure({}, admission.path)
+    seed(args.users)
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session[CURR_USER_KEY] = 1
+
+    cases = [(f"bulk / {size}", size, lambda size=size: bulk(client, size))
+             for size in map(int, args.sizes.split(','))]
+    if args.single:
+        cases.append((f"one by one / {args.single}", args.single,
+                      lambda: one_by_one(client, args.single)))
+
+    print(f"{'case':<24} {'seconds':>10} {'entries/s':>12}")
+    for name, size, func in cases:
+        seconds = func()
+        print(f"{name:<24} {seconds:>10.3f} {size / seconds:>12.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""CPU cost of response compression per level against bytes saved.
+
+    DATABASE_URL=postgresql:///warbler-bench python -m benchmarks.compression
+    ... --levels gzip:1,6,9 br:1,4,11
+
+Fills a scratch database with --users users who each posted --messages
+warbles, then renders two pages uncompressed through the test client:
+
+- the home feed of a user following everyone (home.html)
+- the user directory (users/index.html)
+
+and compresses each body --repeat times per encoding and level. For
+every case it reports the compressed size, the share of bytes saved, the
+CPU milliseconds per page and the throughput. Brotli levels are skipped
+when the Brotli package isn't installed.
+"""
+
+import argparse
+import os
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault('DATABASE_URL', 'postgresql:///warbler-bench')
+
+from admission import admission  # noqa: E402
+from app import create_app, CURR_USER_KEY  # noqa: E402
+from compression import available_encodings, compress  # noqa: E402
+from models import db, Follows, Message, User  # noqa: E402
+
+
+def seed(users, messages):
+    db.drop_all()
+    db.create_all()
+
+    db.session.bulk_insert_mappings(User, [
+        dict(id=i, username=f"user{i}", email=f"user{i}@example.com",
+             password="$2b$12$" + "x" * 53, bio=f"Bio of user {i}")
+        for i in range(1, users + 1)])
+    db.session.bulk_insert_mappings(Follows, [
+        dict(user_following_id=1, user_being_followed_id=i)
+        for i in range(2, users + 1)])
+
+    now = datetime.utcnow()
+    db.session.bulk_insert_mappings(Message, [
+        dict(user_id=user_id, text=f"Warble number {n} from user{user_id}",
+             timestamp=now - timedelta(minutes=n * users + user_id))
+        for user_id in range(1, users + 1) for n in range(messages)])
+    db.session.commit()
+
+
+def pages(app):
+    """Return {name: uncompressed body} of the pages to compress."""
+
+    client = app.test_client()
+    directory = client.get('/users').data
+    with client.session_transaction() as session:
+        session[CURR_USER_KEY] = 1
+    home = client.get('/').data
+    return {'home feed': home, 'directory': directory}
+
+
+def parse_levels(specs):
+    """Turn ['gzip:1,6,9', 'br:4'] into [('gzip', 1), ...]."""
+
+    levels = []
+    for spec in specs:
+        encoding, _, numbers = spec.partition(':')
+        levels.extend((encoding, int(n)) for n in numbers.split(','))
+    return levels
+
+
+def run(body, encoding, level, repeat):
+    """Return (compressed bytes, CPU ms per compression)."""
+
+    start = time.process_time()
+    for _ in range(repeat):
+        size = len(compress(body, encoding, level))
+    return size, (time.process_time() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--messages', type=int, default=5)
+    parser.add_argument('--levels', nargs='+',
+                        default=['gzip:1,3,6,9', 'br:1,4,6,9,11'])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    app = create_app('prod')
+    admission.configure({}, admission.path)
+    seed(args.users, args.messages)
+
+    cases = [(encoding, level) for encoding, level in parse_levels(args.levels)
+             if encoding in available_encodings()]
+
+    print(f"{'page':<10} {'encoding':>8} {'level':>5} {'bytes':>9} "
+          f"{'saved':>6} {'cpu ms':>8} {'MB/s':>8}")
+    for name, body in pages(app).items():
+        print(f"{name:<10} {'-':>8} {'-':>5} {len(body):>9}")
+        for encoding, level in cases:
+            size, ms = run(body, encoding, level, args.repeat)
+            print(f"{name:<10} {encoding:>8} {level:>5} {size:>9} "
+                  f"{1 - size / len(body):>6.1%} {ms:>8.2f} "
+                  f"{len(body) / ms / 1000:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
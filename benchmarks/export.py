@@ -0,0 +1,96 @@
+"""Measure the streaming export on one heavy account.
+
+    DATABASE_URL=postgresql:///warbler-bench python -m benchmarks.export
+
+Fills a scratch database with a user who has many messages, likes and
+followers, then times `export_zip` in each format and reports rows per
+second, output size and peak Python memory (tracemalloc). For contrast
+it also builds the same NDJSON in memory through the model
+relationships.
+"""
+
+import argparse
+import json
+import os
+import time
+import tracemalloc
+
+os.environ.setdefault('DATABASE_URL', 'postgresql:///warbler-bench')
+
+from app import create_app  # noqa: E402
+from export import FORMATS, export_zip  # noqa: E402
+from models import db, Follows, Likes, Message, User  # noqa: E402
+
+
+def seed(messages, likes, followers):
+    db.drop_all()
+    db.create_all()
+
+    db.session.bulk_insert_mappings(User, [
+        dict(id=i, username=f"user{i}", email=f"user{i}@example.com",
+             password="$2b$12$" + "x" * 53)
+        for i in range(1, followers + 2)])
+    db.session.bulk_insert_mappings(Message, [
+        dict(id=i, user_id=1 if i <= messages else 2,
+             text=f"warble number {i} " * 5)
+        for i in range(1, messages + likes + 1)])
+    db.session.bulk_insert_mappings(Likes, [
+        dict(user_id=1, message_id=messages + i)
+        for i in range(1, likes + 1)])
+    db.session.bulk_insert_mappings(Follows, [
+        dict(user_being_followed_id=1, user_following_id=i)
+        for i in range(2, followers + 2)])
+    db.session.commit()
+
+
+def relationship_export():
+    """The naive version: load every related entity, then serialize."""
+
+    user = User.query.get(1)
+    return [json.dumps(dict(id=m.id, text=m.text,
+                            timestamp=m.timestamp.isoformat()))
+            for m in user.messages] + \
+        [json.dumps(dict(message_id=m.id)) for m in user.likes] + \
+        [json.dumps(dict(id=u.id, username=u.username))
+         for u in user.followers]
+
+
+def measure(func):
+    """Return (seconds, output bytes, peak KiB) for one run of `func`."""
+
+    db.session.expunge_all()
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = func()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, size, peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--likes', type=int, default=100000)
+    parser.add_argument('--followers', type=int, default=20000)
+    args = parser.parse_args()
+
+    create_app('prod')
+    seed(args.messages, args.likes, args.followers)
+    rows = args.messages + args.likes + args.followers + 1
+
+    cases = [(f"stream / {fmt}",
+              lambda fmt=fmt: sum(len(chunk) for chunk in export_zip(1, fmt)))
+             for fmt in FORMATS]
+    cases.append(("relationships / ndjson",
+                  lambda: sum(len(line) + 1 for line in relationship_export())))
+
+    print(f"{'case':<24} {'rows/s':>10} {'MiB out':>10} {'peak KiB':>10}")
+    for name, func in cases:
+        seconds, size, kib = measure(func)
+        print(f"{name:<24} {rows / seconds:>10.0f} "
+              f"{size / 2 ** 20:>10.2f} {kib:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
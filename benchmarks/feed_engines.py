@@ -0,0 +1,81 @@
+"""Compare the 'sql' and 'merge' home feed engines.
+
+Run from the project root against a scratch database:
+
+    DATABASE_URL=postgresql:///warbler-bench python -m benchmarks.feed_engines
+
+The database is dropped and re-created, then filled with `--authors`
+users who each posted `--messages` warbles. A reader following
+`--follows` of them has their feed built by both engines.
+"""
+
+import argparse
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault('DATABASE_URL', 'postgresql:///warbler-bench')
+
+from app import app  # noqa: E402,F401
+from feeds import timelines, feed_messages  # noqa: E402
+from models import db, User, Message  # noqa: E402
+
+
+def seed(authors, messages):
+    """Create `authors` users with `messages` warbles each."""
+
+    db.drop_all()
+    db.create_all()
+
+    db.session.bulk_insert_mappings(User, [
+        dict(id=i, username=f"user{i}", email=f"user{i}@example.com",
+             password="x")
+        for i in range(1, authors + 1)])
+
+    start = datetime(2020, 1, 1)
+    rows = []
+    for user_id in range(1, authors + 1):
+        for _ in range(messages):
+            rows.append(dict(
+                user_id=user_id, text="warble",
+                timestamp=start + timedelta(
+                    seconds=random.randrange(365 * 24 * 3600))))
+    db.session.bulk_insert_mappings(Message, rows)
+    db.session.commit()
+
+
+def run(engine, user_ids, repeat):
+    """Return the mean time in ms to build one feed with `engine`."""
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        feed_messages(user_ids, limit=100, engine=engine)
+        db.session.expunge_all()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--authors', type=int, default=2000)
+    parser.add_argument('--messages', type=int, default=50)
+    parser.add_argument('--follows', type=int, nargs='+',
+                        default=[10, 100, 500, 2000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    seed(args.authors, args.messages)
+
+    print(f"{'follows':>8} {'sql ms':>10} {'merge ms':>10}")
+    for follows in args.follows:
+        user_ids = random.sample(range(1, args.authors + 1),
+                                 min(follows, args.authors))
+        timelines.clear()
+        # warm the author lists once; steady state is what we compare
+        feed_messages(user_ids, engine='merge')
+        print(f"{follows:>8} {run('sql', user_ids, args.repeat):>10.2f} "
+              f"{run('merge', user_ids, args.repeat):>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
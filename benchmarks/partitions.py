@@ -0,0 +1,147 @@
+"""Compare feed latency on a partitioned and a plain messages table.
+
+    DATABASE_URL=postgresql:///warbler-bench python -m benchmarks.partitions
+    ... --skip-seed    # reuse the tables of an earlier run
+
+PostgreSQL only. Builds two scratch tables with the same rows, spread
+evenly over --months months up to now with snowflake ids:
+
+- bench_messages_plain: one heap, index on (user_id, id)
+- bench_messages_part: RANGE (id) partitioned by month, as partitions.py
+  lays out `messages`, with the same index on every partition
+
+then runs the bounded home feed query (followed authors, newest first,
+FEED_WINDOW_DAYS back) on each with random follow lists and reports the
+latency percentiles and how many partitions the plan touched. The
+default of 100M rows takes a while to load; --rows scales it down.
+"""
+
+import argparse
+import os
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault('DATABASE_URL', 'postgresql:///warbler-bench')
+
+from sqlalchemy import text  # noqa: E402
+
+from app import create_app  # noqa: E402
+from models import db  # noqa: E402
+from partitions import month_start  # noqa: E402
+from snowflake import min_id_for  # noqa: E402
+
+PLAIN = 'bench_messages_plain'
+PARTITIONED = 'bench_messages_part'
+
+COLUMNS = """
+    id BIGINT NOT NULL,
+    user_id INTEGER NOT NULL,
+    text VARCHAR(140) NOT NULL,
+    PRIMARY KEY (id)
+"""
+
+FEED = """
+    SELECT id, user_id, text FROM {table}
+    WHERE user_id = ANY(:user_ids) AND id >= :since
+    ORDER BY id DESC LIMIT 100
+"""
+
+# Rows per INSERT ... SELECT while loading.
+LOAD_BATCH = 5_000_000
+
+
+def seed(conn, rows, users, months):
+    now = datetime.utcnow()
+    first = month_start(now, -months + 1)
+    first_id, last_id = min_id_for(first), min_id_for(now)
+    step = max((last_id - first_id) // rows, 1)
+
+    for table in (PLAIN, PARTITIONED):
+        conn.execute(text(f"DROP TABLE IF EXISTS {table} CASCADE"))
+
+    conn.execute(text(f"CREATE TABLE {PLAIN} ({COLUMNS})"))
+    conn.execute(text(f"CREATE TABLE {PARTITIONED} ({COLUMNS}) "
+                      f"PARTITION BY RANGE (id)"))
+    for offset in range(months + 1):
+        start = month_start(first, offset)
+        conn.execute(text(
+            f"CREATE TABLE {PARTITIONED}_{start:%Y%m} "
+            f"PARTITION OF {PARTITIONED} FOR VALUES "
+            f"FROM ({min_id_for(start)}) "
+            f"TO ({min_id_for(month_start(start, 1))})"))
+
+    for start in range(0, rows, LOAD_BATCH):
+        stop = min(start + LOAD_BATCH, rows)
+        conn.execute(text(
+            f"INSERT INTO {PLAIN} "
+            f"SELECT :first_id + g * :step, 1 + (g * 7919) % :users, "
+            f"'warble ' || g "
+            f"FROM generate_series(:start, :stop - 1) AS g"),
+            first_id=first_id, step=step, users=users,
+            start=start, stop=stop)
+        print(f"  loaded {stop:,} / {rows:,} rows", flush=True)
+
+    conn.execute(text(f"INSERT INTO {PARTITIONED} SELECT * FROM {PLAIN}"))
+    for table in (PLAIN, PARTITIONED):
+        conn.execute(text(f"CREATE INDEX ON {table} (user_id, id)"))
+        conn.execute(text(f"ANALYZE {table}"))
+
+
+def partitions_scanned(conn, table, params):
+    plan = conn.execute(text("EXPLAIN " + FEED.format(table=table)),
+                        params).fetchall()
+    return sum(f" on {table}_" in row[0] for row in plan) or 1
+
+
+def measure(conn, table, users, following, since, repeat):
+    """Return (p50 ms, p95 ms, partitions scanned) of the feed query."""
+
+    timings = []
+    for _ in range(repeat):
+        params = dict(user_ids=random.sample(range(1, users + 1), following),
+                      since=since)
+        start = time.perf_counter()
+        conn.execute(text(FEED.format(table=table)), params).fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    timings.sort()
+    return (statistics.median(timings),
+            timings[int(len(timings) * 0.95) - 1],
+            partitions_scanned(conn, table, params))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100_000_000)
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--months', type=int, default=36)
+    parser.add_argument('--following', type=int, default=200)
+    parser.add_argument('--window-days', type=int, default=90)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--skip-seed', action='store_true')
+    args = parser.parse_args()
+
+    app = create_app('prod')
+    engine = db.get_engine(app)
+    if engine.dialect.name != 'postgresql':
+        parser.error("this benchmark needs PostgreSQL")
+
+    if not args.skip_seed:
+        print(f"Loading {args.rows:,} rows over {args.months} months...")
+        with engine.begin() as conn:
+            seed(conn, args.rows, args.users, args.months)
+
+    since = min_id_for(datetime.utcnow() - timedelta(days=args.window_days))
+    with engine.connect() as conn:
+        print(f"{'table':<24} {'p50 ms':>10} {'p95 ms':>10} "
+              f"{'partitions':>11}")
+        for table in (PLAIN, PARTITIONED):
+            p50, p95, scanned = measure(conn, table, args.users,
+                                        args.following, since, args.repeat)
+            print(f"{table:<24} {p50:>10.2f} {p95:>10.2f} {scanned:>11}")
+
+
+if __name__ == '__main__':
+    main()
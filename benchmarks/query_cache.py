@@ -0,0 +1,93 @@
+"""Python-side cost of the hot queries, with and without the query cache.
+
+    DATABASE_URL=postgresql:///warbler-bench python -m benchmarks.query_cache
+
+Runs the queries of one typical request (current user, feed, profile
+messages, login lookup, like lookup, profile counts) many times. SQL
+execution time, as measured by sqlstats, is subtracted from the wall
+time, leaving the time spent building, compiling and processing queries
+in Python.
+"""
+
+import argparse
+import os
+import time
+
+os.environ.setdefault('DATABASE_URL', 'postgresql:///warbler-bench')
+
+from app import create_app  # noqa: E402
+import querycache  # noqa: E402
+import readmodels  # noqa: E402
+import sqlstats  # noqa: E402
+from likes import like_buffer  # noqa: E402
+from models import (  # noqa: E402
+    db, user_by_id, user_by_username, Follows, Message, User)
+
+
+def seed():
+    db.drop_all()
+    db.create_all()
+
+    db.session.bulk_insert_mappings(User, [
+        dict(id=i, username=f"user{i}", email=f"user{i}@example.com",
+             password="x")
+        for i in range(1, 51)])
+    db.session.bulk_insert_mappings(Follows, [
+        dict(user_following_id=1, user_being_followed_id=i)
+        for i in range(2, 51)])
+    db.session.bulk_insert_mappings(Message, [
+        dict(user_id=i % 50 + 1, text="warble") for i in range(2000)])
+    db.session.commit()
+
+
+def one_request(following):
+    user_by_id(1)
+    readmodels.feed(following)
+    readmodels.user_messages(2)
+    user_by_username('user3')
+    like_buffer.is_liked(1, 10)
+    readmodels.user_stats(1)
+    db.session.remove()
+
+
+def measure(requests):
+    """Return (wall µs, python µs) per request."""
+
+    following = list(range(1, 51))
+    for _ in range(20):
+        one_request(following)
+
+    stats = sqlstats.current()
+    stats.count, stats.seconds = 0, 0.0
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        one_request(following)
+    wall = time.perf_counter() - start
+
+    return (wall / requests * 1e6,
+            (wall - stats.seconds) / requests * 1e6)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    app = create_app('prod')
+    with app.app_context():
+        seed()
+
+        print(f"{'query cache':>12} {'wall us':>10} {'python us':>10}")
+        for enabled in (False, True):
+            querycache.enabled = enabled
+            wall, python = measure(args.requests)
+            print(f"{'on' if enabled else 'off':>12} "
+                  f"{wall:>10.1f} {python:>10.1f}")
+
+        print(f"hot queries: {len(querycache.HOT_QUERIES)}, "
+              f"cached SQL forms: {querycache.stats()['cached']}")
+
+
+if __name__ == '__main__':
+    main()
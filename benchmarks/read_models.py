@@ -0,0 +1,93 @@
+"""Compare ORM entity loading with the column-only read models.
+
+    DATABASE_URL=postgresql:///warbler-bench python -m benchmarks.read_models
+
+Fills a scratch database, then times the feed and user directory both
+ways and reports the peak Python memory of one call (tracemalloc).
+"""
+
+import argparse
+import os
+import time
+import tracemalloc
+
+os.environ.setdefault('DATABASE_URL', 'postgresql:///warbler-bench')
+
+from app import create_app  # noqa: E402
+import readmodels  # noqa: E402
+from models import db, User, Message  # noqa: E402
+
+
+def seed(users, messages):
+    db.drop_all()
+    db.create_all()
+
+    db.session.bulk_insert_mappings(User, [
+        dict(id=i, username=f"user{i}", email=f"user{i}@example.com",
+             password="$2b$12$" + "x" * 53, bio="bio " * 30,
+             location="Somewhere")
+        for i in range(1, users + 1)])
+    db.session.bulk_insert_mappings(Message, [
+        dict(user_id=i % users + 1, text="warble " * 20)
+        for i in range(messages)])
+    db.session.commit()
+
+
+def entity_feed(user_ids):
+    return (Message.query
+            .filter(Message.user_id.in_(user_ids))
+            .order_by(*Message.newest_first())
+            .limit(100)
+            .all())
+
+
+def entity_directory():
+    return User.query.all()
+
+
+def measure(func, repeat):
+    """Return (mean ms, peak KiB) for `func`."""
+
+    db.session.expunge_all()
+    tracemalloc.start()
+    result = func()
+    # the feed template touches msg.user for every row
+    for item in result:
+        getattr(item, 'user', None)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for item in func():
+            getattr(item, 'user', None)
+        db.session.expunge_all()
+    return (time.perf_counter() - start) / repeat * 1000, peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    create_app('prod')
+    seed(args.users, args.messages)
+    user_ids = list(range(1, min(args.users, 500) + 1))
+
+    cases = [
+        ('feed / entities', lambda: entity_feed(user_ids)),
+        ('feed / read model', lambda: readmodels.feed(user_ids)),
+        ('directory / entities', entity_directory),
+        ('directory / read model', readmodels.directory),
+    ]
+
+    print(f"{'case':<24} {'ms':>10} {'peak KiB':>10}")
+    for name, func in cases:
+        ms, kib = measure(func, args.repeat)
+        print(f"{name:<24} {ms:>10.2f} {kib:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+"""Notification channels between worker processes.
+
+`publish` queues a JSON payload on a named channel as part of the current
+transaction; it is delivered only if that transaction commits. Every
+worker runs one listener thread that hands each delivered payload to the
+callbacks `subscribe`d to its channel in that process. The publishing
+worker gets its own notifications too.
+
+Transport:
+
+- PostgreSQL: `pg_notify` on a single LISTEN channel, with the channel
+  name inside the payload. The listener holds one dedicated connection
+  and wakes up as soon as a notification arrives.
+- Anything else (SQLite): rows in the `notifications` table, which the
+  listener polls every CHANNEL_POLL_SECONDS. Rows older than
+  CHANNEL_RETENTION_SECONDS are pruned.
+
+The listener starts on the first request each process serves (or an
+explicit `listen()`); a forked child forgets its parent's thread and
+starts its own. With CHANNEL_LISTENER off (the
+test profile) nothing is started and `poll()` delivers on demand.
+"""
+
+import json
+import logging
+import os
+import selectors
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from models import db, Notification
+
+logger = logging.getLogger(__name__)
+
+# The one PostgreSQL channel all notifications travel on.
+PG_CHANNEL = 'warbler_events'
+
+
+class NotificationChannels:
+    """Publish to and listen on named channels across workers."""
+
+    def __init__(self):
+        self.app = None
+        self.poll_interval = 1.0
+        self.retention = timedelta(minutes=5)
+        self.listener = True
+        self._callbacks = defaultdict(list)
+        self._last_id = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._forget_listener)
+
+    def init_app(self, app):
+        """Read the CHANNEL_* settings."""
+
+        self.app = app
+        self.poll_interval = app.config.get('CHANNEL_POLL_SECONDS', 1.0)
+        self.retention = timedelta(
+            seconds=app.config.get('CHANNEL_RETENTION_SECONDS', 300))
+        self.listener = app.config.get('CHANNEL_LISTENER', True)
+        app.before_request(self.listen)
+
+    def _postgres(self):
+        return db.get_engine(self.app).dialect.name == 'postgresql'
+
+    def publish(self, channel, payload):
+        """Send `payload` on `channel` when the current transaction commits."""
+
+        if self._postgres():
+            message = json.dumps({'c': channel, 'p': payload})
+            db.session.execute(func.pg_notify(PG_CHANNEL, message).select())
+        else:
+            db.session.add(Notification(channel=channel,
+                                        payload=json.dumps(payload)))
+
+    def subscribe(self, channel, callback):
+        """Call `callback(payload)` for every notification on `channel`."""
+
+        with self._lock:
+            self._callbacks[channel].append(callback)
+
+    def unsubscribe(self, channel, callback):
+        with self._lock:
+            self._callbacks[channel].remove(callback)
+
+    def deliver(self, channel, payload):
+        """Hand `payload` to this process's subscribers of `channel`."""
+
+        with self._lock:
+            callbacks = list(self._callbacks.get(channel, ()))
+        for callback in callbacks:
+            try:
+                callback(payload)
+            except Exception:
+                logger.exception("Subscriber of %s failed", channel)
+
+    # Polling transport ####################################################
+
+    def poll(self):
+        """Deliver notifications published since the last poll.
+
+        The first poll in a process only notes where the table ends.
+        """
+
+        if self._last_id is None:
+            self._mark()
+            return
+
+        rows = (db.session
+                .query(Notification.id, Notification.channel,
+                       Notification.payload)
+                .filter(Notification.id > self._last_id)
+                .order_by(Notification.id)
+                .all())
+        db.session.commit()
+
+        for row_id, channel, data in rows:
+            self._last_id = row_id
+            self.deliver(channel, json.loads(data))
+
+    def _mark(self):
+        # on its own connection: this may run inside a request
+        if self._last_id is None:
+            with db.get_engine(self.app).connect() as conn:
+                self._last_id = conn.execute(select([
+                    func.coalesce(func.max(Notification.id), 0)])).scalar()
+
+    def prune(self):
+        """Delete polled notifications older than the retention period."""
+
+        cutoff = datetime.utcnow() - self.retention
+        Notification.query.filter(Notification.created_at < cutoff).delete()
+        db.session.commit()
+
+    def _poll_forever(self):
+        polls_per_prune = max(1, int(60 / (self.poll_interval or 1)))
+        polls = 0
+        while not self._stopped.wait(self.poll_interval):
+            with self.app.app_context():
+                try:
+                    self.poll()
+                    polls += 1
+                    if polls % polls_per_prune == 0:
+                        self.prune()
+                except Exception:
+                    logger.exception("Polling notifications failed")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+    # LISTEN/NOTIFY transport ##############################################
+
+    def _listen_forever(self):
+        while not self._stopped.is_set():
+            try:
+                self._listen()
+            except Exception:
+                logger.exception("Notification listener lost its connection")
+                self._stopped.wait(self.poll_interval)
+
+    def _listen(self):
+        conn = db.get_engine(self.app).raw_connection()
+        try:
+            dbapi_conn = conn.connection
+            dbapi_conn.autocommit = True
+            cursor = dbapi_conn.cursor()
+            cursor.execute(f'LISTEN "{PG_CHANNEL}"')
+
+            waiter = selectors.DefaultSelector()
+            waiter.register(dbapi_conn, selectors.EVENT_READ)
+            while not self._stopped.is_set():
+                if not waiter.select(timeout=5.0):
+                    continue
+                dbapi_conn.poll()
+                while dbapi_conn.notifies:
+                    notify = dbapi_conn.notifies.pop(0)
+                    message = json.loads(notify.payload)
+                    self.deliver(message['c'], message['p'])
+        finally:
+            conn.invalidate()
+
+    def listen(self):
+        """Start this process's listener thread unless it is running."""
+
+        if not self.listener or self._thread is not None:
+            return
+
+        with self._lock:
+            if self._thread is None:
+                if self._postgres():
+                    target = self._listen_forever
+                else:
+                    # mark where the table ends before anything is
+                    # published for our subscribers
+                    self._mark()
+                    target = self._poll_forever
+                self._thread = threading.Thread(
+                    target=target, daemon=True, name='channel-listener')
+                self._thread.start()
+
+    def _forget_listener(self):
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def stop(self):
+        self._stopped.set()
+
+
+channels = NotificationChannels()
@@ -0,0 +1,257 @@
+"""Response compression.
+
+Feed and directory pages are large, repetitive HTML; they shrink by
+90% or more compressed. Every response of a COMPRESSIBLE type is
+compressed with the best encoding the client's Accept-Encoding allows:
+brotli (`br`, when the Brotli package is installed) before gzip.
+
+- bodies already in memory (rendered templates, JSON) are compressed in
+  one go and keep an exact Content-Length
+- streamed bodies (files, generators) are compressed chunk by chunk as
+  the server sends them; nothing is buffered. When the length isn't
+  known up front each chunk is flushed, so streams like the live feed
+  still arrive as they are produced
+- responses known to be shorter than COMPRESS_MIN_BYTES, responses that
+  are already encoded and `Cache-Control: no-transform` ones are sent
+  as they are
+
+Compressible responses carry `Vary: Accept-Encoding`, and their strong
+ETags become weak ones since the bytes now depend on the encoding.
+
+Static files are served precompressed when `<file>.br` or `<file>.gz`
+sits next to them and is no older; `flask compress-static` writes those
+at the highest levels at build time.
+"""
+
+import mimetypes
+import os
+import zlib
+
+import click
+from flask import current_app, request, send_from_directory
+from flask.cli import with_appcontext
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+# Encodings in order of preference, with the suffix of static variants.
+SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+COMPRESSIBLE = frozenset((
+    'application/javascript',
+    'application/json',
+    'application/xml',
+    'image/svg+xml',
+    'image/x-icon',
+    'text/css',
+    'text/event-stream',
+    'text/html',
+    'text/javascript',
+    'text/plain',
+    'text/xml',
+))
+
+
+def available_encodings():
+    """The encodings this process can produce, best first."""
+
+    return [name for name in SUFFIXES if name != 'br' or brotli]
+
+
+def compressor(encoding, level):
+    """Return a (compress, flush, finish) triple for `encoding`.
+
+    `compress(data)` and `flush()` return what is ready to send so far;
+    `finish()` returns the rest of the stream.
+    """
+
+    if encoding == 'br':
+        stream = brotli.Compressor(quality=level)
+        return stream.process, stream.flush, stream.finish
+
+    # wbits 31: a gzip header and trailer around the deflate stream
+    stream = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return (stream.compress, lambda: stream.flush(zlib.Z_SYNC_FLUSH),
+            stream.flush)
+
+
+def compress(data, encoding, level):
+    """Compress all of `data` with `encoding` at `level`."""
+
+    compress_chunk, _, finish = compressor(encoding, level)
+    return compress_chunk(data) + finish()
+
+
+def _compress_chunks(body, encoding, level, flush_each):
+    compress_chunk, flush, finish = compressor(encoding, level)
+    try:
+        for chunk in body:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            data = compress_chunk(chunk)
+            if flush_each:
+                data += flush()
+            if data:
+                yield data
+        yield finish()
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+
+
+class Compression:
+    """Compress responses in an after_request hook."""
+
+    def __init__(self):
+        self.enabled = False
+        self.min_bytes = 1024
+        self.mimetypes = COMPRESSIBLE
+        self.levels = {'br': 4, 'gzip': 6}
+        self.static_levels = {'br': 11, 'gzip': 9}
+
+    def init_app(self, app):
+        """Read the COMPRESS_* settings and install the hooks."""
+
+        self.enabled = app.config.get('COMPRESS_ENABLED', False)
+        self.min_bytes = app.config.get('COMPRESS_MIN_BYTES', self.min_bytes)
+        self.mimetypes = frozenset(app.config.get('COMPRESS_MIMETYPES',
+                                                  self.mimetypes))
+        self.levels = {'br': app.config.get('COMPRESS_BROTLI_QUALITY', 4),
+                       'gzip': app.config.get('COMPRESS_GZIP_LEVEL', 6)}
+
+        app.cli.add_command(compress_static_command)
+
+        if not self.enabled:
+            return
+
+        app.after_request(self.compress_response)
+        if app.static_folder and 'static' in app.view_functions:
+            app.view_functions['static'] = self.send_static_file
+
+    def accepted(self, encodings):
+        """Return the `encodings` the client accepts, best first."""
+
+        quality = request.accept_encodings.quality
+        return sorted((encoding for encoding in encodings
+                       if quality(encoding) > 0),
+                      key=quality, reverse=True)
+
+    def negotiate(self):
+        """Return the encoding `compress_response` would use for this
+        request, or None."""
+
+        if not self.enabled:
+            return None
+        encodings = self.accepted(available_encodings())
+        return encodings[0] if encodings else None
+
+    # Dynamic compression ##################################################
+
+    def compress_response(self, response):
+        if response.mimetype not in self.mimetypes:
+            return response
+
+        response.vary.add('Accept-Encoding')
+
+        length = response.content_length
+        if (response.status_code < 200
+                or response.status_code in (204, 206, 304)
+                or 'Content-Encoding' in response.headers
+                or response.cache_control.no_transform
+                or (length is not None and length < self.min_bytes)):
+            return response
+
+        encoding = self.negotiate()
+        if encoding is None:
+            return response
+        level = self.levels[encoding]
+
+        if response.is_sequence:
+            response.set_data(compress(response.get_data(), encoding, level))
+        else:
+            response.response = _compress_chunks(
+                response.response, encoding, level, flush_each=length is None)
+            response.direct_passthrough = False
+            response.headers.pop('Content-Length', None)
+
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    # Precompressed static files ###########################################
+
+    def send_static_file(self, filename):
+        """The app's static view, preferring precompressed variants."""
+
+        app = current_app
+        path = safe_join(app.static_folder, filename)
+        # serving a .br file needs no Brotli package
+        encoding = next((encoding for encoding in self.accepted(SUFFIXES)
+                         if _is_fresh(path + SUFFIXES[encoding], path)),
+                        None) if path else None
+
+        if encoding is None:
+            return app.send_static_file(filename)
+
+        mimetype = mimetypes.guess_type(filename)[0] \
+            or 'application/octet-stream'
+        response = send_from_directory(
+            app.static_folder, filename + SUFFIXES[encoding],
+            mimetype=mimetype,
+            cache_timeout=app.get_send_file_max_age(filename))
+        response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        return response
+
+    def precompress(self, directory, force=False):
+        """Write `.gz` (and `.br`) variants of the compressible files in
+        `directory`; return how many were written."""
+
+        written = 0
+        for root, _, names in os.walk(directory):
+            for name in names:
+                path = os.path.join(root, name)
+                if (name.endswith(tuple(SUFFIXES.values()))
+                        or mimetypes.guess_type(name)[0] not in self.mimetypes
+                        or os.path.getsize(path) < self.min_bytes):
+                    continue
+
+                with open(path, 'rb') as f:
+                    data = None
+                    for encoding in available_encodings():
+                        variant = path + SUFFIXES[encoding]
+                        if not force and _is_fresh(variant, path):
+                            continue
+                        data = data if data is not None else f.read()
+                        with open(variant, 'wb') as out:
+                            out.write(compress(
+                                data, encoding, self.static_levels[encoding]))
+                        written += 1
+        return written
+
+
+def _is_fresh(variant, path):
+    try:
+        return os.path.getmtime(variant) >= os.path.getmtime(path)
+    except OSError:
+        return False
+
+
+compression = Compression()
+
+
+@click.command('compress-static')
+@click.option('--force', is_flag=True,
+              help="Rewrite variants that are already up to date.")
+@with_appcontext
+def compress_static_command(force):
+    """Write precompressed variants of the static files."""
+
+    written = compression.precompress(current_app.static_folder, force)
+    click.echo(f"Wrote {written} compressed static files "
+               f"({', '.join(available_encodings())}).")
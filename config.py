@@ -0,0 +1,212 @@
+"""Configuration profiles for the Warbler app factory.
+
+Pick one with `create_app(profile)` or the WARBLER_PROFILE environment
+variable: 'dev' (the default), 'test' or 'prod'.
+"""
+
+import os
+
+
+class Config:
+    """Settings shared by every profile."""
+
+    # Get DB_URI from environ variable (useful for production/testing) or,
+    # if not set there, use development local db.
+    SQLALCHEMY_DATABASE_URI = os.environ.get(
+        'DATABASE_URL', 'postgres:///warbler')
+
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = False
+    SECRET_KEY = os.environ.get('SECRET_KEY', "it's a secret")
+
+    # How the home feed is assembled: 'sql' (IN-list query) or 'merge'
+    # (heap merge of per-author recent lists, see feeds.py).
+    FEED_ENGINE = os.environ.get('FEED_ENGINE', 'sql')
+    FEED_AUTHOR_LIST_SIZE = 100
+    # With MESSAGE_PARTITIONS, the home feed and profile pages read
+    # messages this recent first, and older ones only to fill the page;
+    # None reads them all at once.
+    FEED_WINDOW_DAYS = 90
+
+    # Partition messages by month on PostgreSQL; needs snowflake ids
+    # (see partitions.py).
+    MESSAGE_PARTITIONS = os.environ.get('MESSAGE_PARTITIONS') == '1'
+    MESSAGE_PARTITIONS_AHEAD = 3
+
+    # Move messages this old to compressed segment files (see archive.py).
+    ARCHIVE_AFTER_DAYS = 365
+    ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR')
+
+    # Issue time-sortable 64-bit message ids (see snowflake.py).
+    MESSAGE_SNOWFLAKE_IDS = os.environ.get('MESSAGE_SNOWFLAKE_IDS') == '1'
+    # Worker id of this process, or under gunicorn the first of the host's
+    # range of worker ids (see gunicorn.conf.py)
+    SNOWFLAKE_WORKER_ID = os.environ.get('SNOWFLAKE_WORKER_ID')
+
+    # Local thumbnail cache for user images (see images.py).
+    IMAGE_CACHE = True
+    IMAGE_CACHE_DIR = os.environ.get('IMAGE_CACHE_DIR')
+    IMAGE_SOURCE = 'http'
+    IMAGE_WORKERS = 2
+    IMAGE_QUEUE_SIZE = 256
+
+    # Coalesce like toggles for this long before writing them (see likes.py).
+    LIKE_WRITE_BEHIND_SECONDS = 1.0
+
+    # Request profiler (see profiler.py); 0 profiles only on request.
+    PROFILER_SAMPLE_RATE = float(os.environ.get('PROFILER_SAMPLE_RATE', 0))
+    PROFILER_DIR = os.environ.get('PROFILER_DIR')
+    PROFILER_KEEP = 200
+    PROFILER_FORMAT = 'pstats'
+
+    # Slow-query log (see slowlog.py); None turns it off.
+    SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+    SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG')
+    SLOW_QUERY_RING = 500
+    SLOW_QUERY_EXPLAIN = True
+
+    # Build and compile hot-path queries once (see querycache.py).
+    QUERY_CACHE = True
+
+    # Keep compiled templates on disk (see jinjacache.py).
+    JINJA_BYTECODE_CACHE = False
+    JINJA_CACHE_DIR = os.environ.get('JINJA_CACHE_DIR')
+
+    # Trending tags window and how often counts are written (see tags.py).
+    TRENDING_WINDOW_MINUTES = 60
+    TRENDING_FLUSH_SECONDS = 60
+
+    # Popular feed ranking and refresh intervals (see popular.py).
+    POPULAR_HALF_LIFE_HOURS = 6
+    POPULAR_WINDOW_HOURS = 48
+    POPULAR_SIZE = 100
+    POPULAR_REFRESH_SECONDS = 30
+    POPULAR_RECOMPUTE_SECONDS = 3600
+
+    # Rate and concurrency limits shared by all workers (see admission.py).
+    ADMISSION_LIMITS = {
+        'warbler.login': dict(rate=10, burst=20, concurrency=4,
+                              methods=('POST',)),
+        'warbler.signup': dict(rate=2, burst=10, concurrency=2,
+                               methods=('POST',)),
+        'warbler.profile': dict(rate=5, burst=10, concurrency=2,
+                                methods=('POST',)),
+        'warbler.list_users': dict(rate=20, burst=40, concurrency=4),
+        # exports stream for as long as the download takes
+        'warbler.export_user': dict(rate=0.5, burst=2, concurrency=2,
+                                    lease=3600),
+        'warbler.username_available': dict(rate=10, burst=30,
+                                           concurrency=4),
+        'warbler.bulk_follow': dict(rate=0.2, burst=3, concurrency=2),
+    }
+    ADMISSION_FILE = os.environ.get('ADMISSION_FILE')
+
+    # Notifications between workers (see channels.py).
+    CHANNEL_LISTENER = True
+    CHANNEL_POLL_SECONDS = 1.0
+    CHANNEL_RETENTION_SECONDS = 300
+
+    # Warn when cache invalidations arrive this late (see invalidation.py).
+    INVALIDATION_LAG_WARN_SECONDS = 5.0
+
+    # Live feed streams per worker (see livefeed.py).
+    LIVE_MAX_CONNECTIONS = 24
+    LIVE_HEARTBEAT_SECONDS = 15
+
+    # Hard-deleting deleted messages in the background (see purger.py).
+    PURGE_INTERVAL_SECONDS = 60
+    PURGE_BATCH = 500
+    PURGE_PAUSE_SECONDS = 0.2
+    PURGE_MAX_BATCHES = 50
+    PURGE_BUSY_REQUESTS = 4
+
+    # Entries accepted by one bulk follow request (see follows.py).
+    BULK_FOLLOW_MAX = 10_000
+
+    # In-memory filter of the usernames and emails in use
+    # (see availability.py).
+    NAME_FILTER_CAPACITY = 1_000_000
+    NAME_FILTER_ERROR_RATE = 0.01
+    NAME_FILTER_REBUILD_AFTER = 10_000
+
+    # JSON lines access log, written from a background thread
+    # (see accesslog.py). Defaults to instance/access.log.
+    ACCESS_LOG_ENABLED = True
+    ACCESS_LOG = os.environ.get('ACCESS_LOG')
+    ACCESS_LOG_QUEUE = 10_000
+    ACCESS_LOG_BATCH = 500
+    ACCESS_LOG_FLUSH_SECONDS = 1.0
+    ACCESS_LOG_MAX_BYTES = 100 * 2 ** 20
+    ACCESS_LOG_BACKUPS = 5
+
+    # gzip/brotli response compression (see compression.py). Turn it off
+    # when a proxy in front compresses instead.
+    COMPRESS_ENABLED = True
+    COMPRESS_MIN_BYTES = 1024
+    COMPRESS_GZIP_LEVEL = 6
+    COMPRESS_BROTLI_QUALITY = 4
+
+    # Anonymous full-page cache (see pagecache.py).
+    PAGE_CACHE_ENABLED = True
+    PAGE_CACHE_TTL_SECONDS = 5.0
+    PAGE_CACHE_STALE_SECONDS = 60.0
+    PAGE_CACHE_WAIT_SECONDS = 5.0
+    PAGE_CACHE_MAX_BYTES = 64 * 2 ** 20
+    PAGE_CACHE_DIR = os.environ.get('PAGE_CACHE_DIR')
+
+    # Database connections (asyncpg) or threads per process for the async
+    # read path (see asyncreads.py).
+    ASYNC_POOL_SIZE = int(os.environ.get('ASYNC_POOL_SIZE', 10))
+    # Threads per process running every other request under ASGI; live
+    # feed streams each hold one while open, as under gunicorn.
+    ASGI_WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', 32))
+
+    # Optional extensions, imported only when listed (see app.EXTENSIONS).
+    EXTENSIONS = ()
+
+    # Send no-cache headers on every response.
+    NO_CACHE_HEADERS = False
+
+
+class DevConfig(Config):
+    """Local development: debug toolbar and no HTTP caching."""
+
+    DEBUG_TB_INTERCEPT_REDIRECTS = True
+    EXTENSIONS = ('debug_toolbar',)
+    NO_CACHE_HEADERS = True
+
+
+class TestConfig(Config):
+    """Unit tests: separate database, no CSRF."""
+
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    SQLALCHEMY_DATABASE_URI = os.environ.get(
+        'DATABASE_URL', 'postgresql:///warbler-test')
+
+    # Read every image URL from the static folder; tests stay offline.
+    IMAGE_SOURCE = 'local'
+
+    # Write likes and tag counts as soon as they happen.
+    LIKE_WRITE_BEHIND_SECONDS = 0
+    TRENDING_FLUSH_SECONDS = 0
+    POPULAR_REFRESH_SECONDS = 0
+    POPULAR_RECOMPUTE_SECONDS = 0
+    ADMISSION_LIMITS = {}
+    CHANNEL_LISTENER = False
+    PURGE_INTERVAL_SECONDS = 0
+    ACCESS_LOG_ENABLED = False
+    PAGE_CACHE_ENABLED = False
+
+
+class ProdConfig(Config):
+    """Production: no debug extensions or per-request dev hooks."""
+
+    JINJA_BYTECODE_CACHE = True
+
+
+PROFILES = {
+    'dev': DevConfig,
+    'test': TestConfig,
+    'prod': ProdConfig,
+}
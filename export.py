@@ -0,0 +1,174 @@
+"""Streaming export of a user's data.
+
+The export is a zip of one file per section (profile, messages, likes,
+following, followers), as NDJSON or CSV. Rows are read with server-side
+cursors (`yield_per`) as plain column tuples, encoded, compressed and
+handed out in chunks as they are produced; messages start with the
+user's archived ones (see archive.py), read a block at a time. Memory
+stays flat however large the account is: at most one batch of rows and
+one chunk of compressed output are held at a time, plus the ids of the
+archived messages, to skip copies still in the hot table.
+"""
+
+import csv
+import io
+import json
+import zipfile
+from datetime import datetime
+from itertools import chain
+
+import click
+
+from archive import archive as message_archive
+from models import db, Follows, Likes, Message, User
+
+FORMATS = ('ndjson', 'csv')
+
+# Rows fetched per round trip.
+BATCH = 1000
+
+# Compressed bytes to collect before handing out a chunk.
+CHUNK = 64 * 1024
+
+
+class _Chunks:
+    """Write-only sink that collects what zipfile writes to it."""
+
+    def __init__(self):
+        self._chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        self.size = 0
+        return data
+
+
+def _sections(user_id):
+    """Yield (name, column names, rows) for each part of the export."""
+
+    followed = db.aliased(User)
+    follower = db.aliased(User)
+
+    yield 'profile', ('id', 'username', 'email', 'bio', 'location',
+                      'image_url', 'header_image_url'), (
+        db.session
+        .query(User.id, User.username, User.email, User.bio, User.location,
+               User.image_url, User.header_image_url)
+        .filter(User.id == user_id)
+        .yield_per(BATCH))
+
+    archived = set()
+
+    def archived_messages():
+        for row in message_archive.user_records(user_id):
+            archived.add(row[0])
+            yield row
+
+    # a run that died before deleting leaves messages in both places
+    yield 'messages', ('id', 'text', 'timestamp'), chain(
+        archived_messages(),
+        (row for row in (db.session
+                         .query(Message.id, Message.text, Message.timestamp)
+                         .filter(Message.user_id == user_id,
+                                 Message.not_deleted())
+                         .order_by(Message.id)
+                         .yield_per(BATCH))
+         if row[0] not in archived))
+
+    yield 'likes', ('message_id', 'timestamp'), (
+        db.session
+        .query(Likes.message_id, Likes.timestamp)
+        .filter(Likes.user_id == user_id)
+        .order_by(Likes.id)
+        .yield_per(BATCH))
+
+    yield 'following', ('id', 'username'), (
+        db.session
+        .query(followed.id, followed.username)
+        .join(Follows, Follows.user_being_followed_id == followed.id)
+        .filter(Follows.user_following_id == user_id)
+        .order_by(followed.id)
+        .yield_per(BATCH))
+
+    yield 'followers', ('id', 'username'), (
+        db.session
+        .query(follower.id, follower.username)
+        .join(Follows, Follows.user_following_id == follower.id)
+        .filter(Follows.user_being_followed_id == user_id)
+        .order_by(follower.id)
+        .yield_per(BATCH))
+
+
+def _plain(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _row_writer(out, fmt, columns):
+    """Return a function writing one row to `out` in `fmt`."""
+
+    if fmt == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(columns)
+        return lambda row: writer.writerow([_plain(value) for value in row])
+
+    def write(row):
+        out.write(json.dumps(dict(zip(columns, map(_plain, row)))) + '\n')
+    return write
+
+
+def export_zip(user_id, fmt='ndjson'):
+    """Yield the bytes of a zip with `user_id`'s data, chunk by chunk."""
+
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}")
+
+    sink = _Chunks()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, columns, rows in _sections(user_id):
+            with archive.open(f'{name}.{fmt}', 'w', force_zip64=True) as f:
+                out = io.TextIOWrapper(f, encoding='utf-8', newline='')
+                write = _row_writer(out, fmt, columns)
+                for count, row in enumerate(rows, 1):
+                    write(row)
+                    if count % BATCH == 0 and sink.size >= CHUNK:
+                        yield sink.drain()
+                out.close()
+
+    yield sink.drain()
+
+
+def init_app(app):
+    """Register the `flask export-user` command."""
+
+    app.cli.add_command(export_user_command)
+
+
+@click.command('export-user')
+@click.argument('username')
+@click.option('-o', '--output', type=click.File('wb'), default='-',
+              help="Where to write the zip (default: stdout).")
+@click.option('--format', 'fmt', type=click.Choice(FORMATS),
+              default='ndjson', show_default=True)
+def export_user_command(username, output, fmt):
+    """Write USERNAME's data export as a zip."""
+
+    user_id = (db.session.query(User.id)
+               .filter(User.username == username)
+               .scalar())
+    if user_id is None:
+        raise click.ClickException(f"No user named {username!r}")
+
+    for chunk in export_zip(user_id, fmt):
+        output.write(chunk)
@@ -0,0 +1,162 @@
+"""Pull-model home feed built from per-author recent message lists."""
+
+import heapq
+from collections import deque
+from itertools import islice, takewhile
+from operator import itemgetter
+from threading import Lock
+
+import readmodels
+from accesslog import cache_result
+from models import db, message_ids, Message
+
+
+def _order_key():
+    """Sort key of `(timestamp, message_id)` entries, matching
+    `Message.newest_first`."""
+
+    # snowflake ids are time-ordered on their own
+    return itemgetter(1) if message_ids.enabled else tuple
+
+
+class AuthorTimelines:
+    """Bounded, newest-first lists of recent message ids, one per author.
+
+    Each list holds `(timestamp, message_id)` pairs for the `size` most
+    recent messages of one author. Lists are loaded from the database the
+    first time an author is needed and kept current with `push` and
+    `remove` from the message routes.
+    """
+
+    def __init__(self, size=100):
+        self.size = size
+        self._lists = {}
+        self._lock = Lock()
+
+    def init_app(self, app):
+        """Size the author lists from the app config."""
+
+        self.size = app.config.get('FEED_AUTHOR_LIST_SIZE', self.size)
+        self.clear()
+
+    def clear(self):
+        """Forget every loaded author list."""
+
+        with self._lock:
+            self._lists = {}
+
+    def _load(self, user_id):
+        """Read the most recent messages of `user_id` from the database."""
+
+        rows = (db.session
+                .query(Message.timestamp, Message.id)
+                .filter(Message.user_id == user_id, Message.not_deleted())
+                .order_by(*Message.newest_first())
+                .limit(self.size)
+                .all())
+
+        return deque(((ts, msg_id) for ts, msg_id in rows), maxlen=self.size)
+
+    def get(self, user_id):
+        """Return the newest-first list for `user_id`, loading it if needed."""
+
+        entries = self._lists.get(user_id)
+        cache_result('timelines', entries is not None)
+
+        if entries is None:
+            entries = self._load(user_id)
+            with self._lock:
+                entries = self._lists.setdefault(user_id, entries)
+
+        return entries
+
+    def push(self, user_id, timestamp, message_id):
+        """Record a new message by `user_id`.
+
+        Authors that were never loaded are skipped; their list will be read
+        in full from the database the first time a feed needs it. Every
+        worker calls this for every new message (see the MESSAGE_POSTED
+        handler in app.py), possibly twice and out of order, so messages
+        already listed are ignored and the rest are inserted in order.
+        """
+
+        entry = (timestamp, message_id)
+        with self._lock:
+            entries = self._lists.get(user_id)
+            if entries is None \
+                    or any(msg_id == message_id for _, msg_id in entries):
+                return
+
+            key = _order_key()
+            position = next((n for n, listed in enumerate(entries)
+                             if key(listed) < key(entry)), len(entries))
+            if position >= self.size:
+                return
+            if len(entries) == self.size:
+                # a full deque can't insert; its oldest entry goes
+                entries.pop()
+            entries.insert(position, entry)
+
+    def remove(self, user_id, message_id):
+        """Drop a deleted message from its author's list.
+
+        The list is reloaded on next use so it is topped back up to `size`.
+        """
+
+        with self._lock:
+            entries = self._lists.get(user_id)
+            if entries is not None and any(
+                    msg_id == message_id for _, msg_id in entries):
+                del self._lists[user_id]
+
+    def discard(self, user_id):
+        """Forget the list for `user_id` (e.g. when the user is deleted)."""
+
+        with self._lock:
+            self._lists.pop(user_id, None)
+
+    def merge(self, user_ids, limit, since=None):
+        """Return the ids of the `limit` newest messages across `user_ids`,
+        posted from `since` on if given.
+
+        Each author list is already newest-first, so a k-way heap merge
+        over iterators of the lists only touches the head of each and as
+        many entries as it returns. The lists are iterated in place under
+        the lock `push` takes, so none changes mid-merge.
+        """
+
+        lists = [self.get(user_id) for user_id in set(user_ids)]
+        with self._lock:
+            merged = heapq.merge(*lists, key=_order_key(), reverse=True)
+            if since is not None:
+                merged = takewhile(lambda entry: entry[0] >= since, merged)
+            return [msg_id for _, msg_id in islice(merged, limit)]
+
+
+timelines = AuthorTimelines()
+
+
+def feed_messages(user_ids, limit=100, engine='sql', since=None):
+    """Return the `limit` most recent messages written by `user_ids`.
+
+    Messages are `readmodels.MessageRow` tuples. `engine` picks how the
+    feed is assembled:
+
+    - 'sql': one query with an IN-list over all followed authors
+    - 'merge': heap merge of the per-author lists kept in `timelines`
+
+    Both read messages posted from `since` on first, if given, and read
+    again without the bound when those don't fill the page.
+    """
+
+    def read(since):
+        if engine == 'merge':
+            return readmodels.messages_by_ids(
+                timelines.merge(user_ids, limit, since=since))
+        return readmodels.feed(user_ids, limit, since=since)
+
+    messages = read(since)
+    if since is not None and len(messages) < limit:
+        # followed authors have been quiet; fill the page from before
+        messages = read(None)
+    return messages
@@ -0,0 +1,113 @@
+"""Follow many users in one request.
+
+People moving over from other networks bring lists of hundreds or
+thousands of accounts. `follow_many` handles such a list set-based:
+
+- one query resolves every entry (ids and usernames alike) and, through
+  an outer join on `follows`, finds the ones already followed
+- the new `follows` rows go in a few multi-row INSERTs that skip
+  conflicts, so a concurrent follow of the same user is no error
+- the caller announces the new follows in FOLLOW_CHANGED events of up to
+  EVENT_IDS ids each (a PostgreSQL notification holds 8000 bytes)
+
+There are no follower counters to update: profile counts are index-only
+counts (see readmodels.user_stats). Home feeds are read per request, so
+the new authors show up on the next page load; open live streams learn
+about them from the events.
+"""
+
+from typing import NamedTuple, Optional, Union
+
+from sqlalchemy import and_, or_
+
+from models import db, insert_ignore, Follows, User
+
+FOLLOWED = 'followed'
+ALREADY_FOLLOWING = 'already_following'
+NOT_FOUND = 'not_found'
+SELF = 'self'
+
+STATUSES = (FOLLOWED, ALREADY_FOLLOWING, NOT_FOUND, SELF)
+
+# Rows per INSERT statement.
+INSERT_CHUNK = 1000
+
+# Followed ids per FOLLOW_CHANGED event.
+EVENT_IDS = 500
+
+
+class FollowResult(NamedTuple):
+    """What became of one entry of a bulk follow."""
+
+    user: Union[int, str]
+    id: Optional[int]
+    status: str
+
+
+def valid_entry(entry):
+    """Return whether `entry` can name a user: an id or a username."""
+
+    return (isinstance(entry, int) and not isinstance(entry, bool)) \
+        or (isinstance(entry, str) and entry != '')
+
+
+def _resolve(follower_id, entries):
+    """Return {id or username: (user id, already followed)} for the
+    entries that name a user."""
+
+    ids = {entry for entry in entries if isinstance(entry, int)}
+    names = {entry for entry in entries if isinstance(entry, str)}
+
+    rows = (db.session
+            .query(User.id, User.username, Follows.user_following_id)
+            .outerjoin(Follows, and_(
+                Follows.user_being_followed_id == User.id,
+                Follows.user_following_id == follower_id))
+            .filter(or_(User.id.in_(ids), User.username.in_(names))))
+
+    found = {}
+    for user_id, username, follower in rows:
+        found[user_id] = found[username] = (user_id, follower is not None)
+    return found
+
+
+def follow_many(follower_id, entries):
+    """Make `follower_id` follow every user named in `entries`.
+
+    Entries are user ids or usernames (see `valid_entry`). Adds the rows
+    to the current session without committing. Returns a `FollowResult`
+    per entry, in order, and the set of newly followed ids.
+    """
+
+    found = _resolve(follower_id, entries)
+    results = []
+    new_ids = set()
+
+    for entry in entries:
+        user_id, following = found.get(entry, (None, False))
+        if user_id is None:
+            status = NOT_FOUND
+        elif user_id == follower_id:
+            status = SELF
+        elif following or user_id in new_ids:
+            status = ALREADY_FOLLOWING
+        else:
+            status = FOLLOWED
+            new_ids.add(user_id)
+        results.append(FollowResult(entry, user_id, status))
+
+    insert_ignore(Follows.__table__,
+                  [dict(user_being_followed_id=user_id,
+                        user_following_id=follower_id)
+                   for user_id in sorted(new_ids)],
+                  chunk=INSERT_CHUNK)
+
+    return results, new_ids
+
+
+def event_batches(ids):
+    """Split `ids` into lists small enough for one FOLLOW_CHANGED event."""
+
+    ids = sorted(ids)
+    return [ids[start:start + EVENT_IDS]
+            for start in range(0, len(ids), EVENT_IDS)]
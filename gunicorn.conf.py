@@ -0,0 +1,55 @@
+"""Gunicorn settings for running Warbler in production.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+
+import itertools
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY',
+                             multiprocessing.cpu_count() * 2 + 1))
+
+# Live feed streams each hold a thread while open (see livefeed.py), so
+# workers are threaded with room beyond LIVE_MAX_CONNECTIONS.
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+
+# Import wsgi.py (and build the app) once in the master, then fork.
+preload_app = True
+
+
+def pre_fork(server, worker):
+    """Pick the snowflake slot of the worker about to be forked.
+
+    Each live worker holds a distinct slot, the lowest one free, so a
+    worker replacing a dead one reuses its slot and slots stay below the
+    worker count. Worker ids are SNOWFLAKE_WORKER_ID + slot: give every
+    host a base at least `workers` apart from the others.
+    """
+
+    taken = {getattr(other, 'snowflake_slot', None)
+             for other in server.WORKERS.values()}
+    worker.snowflake_slot = next(slot for slot in itertools.count()
+                                 if slot not in taken)
+
+
+def post_fork(server, worker):
+    """Give each worker its own database connections and snowflake
+    worker id, then warm its routes.
+
+    Connections opened by the master while preloading must not be shared
+    across the fork.
+    """
+
+    from jinjacache import warm_routes
+    from models import db, message_ids
+
+    # The preloaded callable: the Flask app itself for wsgi:app, or the
+    # asyncreads.ReadPath wrapping it for asgi:application.
+    loaded = server.app.wsgi()
+    app = getattr(loaded, 'app', loaded)
+
+    db.get_engine(app).dispose()
+    message_ids.assign_slot(worker.snowflake_slot)
+    warm_routes(app)
@@ -0,0 +1,461 @@
+"""Local thumbnail cache for user avatars and header images.
+
+`User.image_url` and `User.header_image_url` can point anywhere. Each
+source image is fetched once, resized into the variants in `VARIANTS`
+and stored in a content-addressed directory tree:
+
+    IMAGE_CACHE_DIR/
+        refs/<sha1 of source url>          -> sha256 of the image bytes
+        <digest[:2]>/<digest>/<variant>.<ext>
+
+Templates ask for a variant with the `thumbnail` filter, which falls back
+to the original URL (and queues ingestion) until the variant exists.
+
+Needs Pillow; without it the filter always returns the original URL.
+"""
+
+import hashlib
+import http.client
+import ipaddress
+import logging
+import os
+import queue
+import re
+import shutil
+import socket
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from io import BytesIO
+from urllib.parse import urlparse
+
+from accesslog import cache_result
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - optional dependency
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# name -> (width, height or None to keep the aspect ratio, format)
+VARIANTS = {
+    'avatar48': (48, 48, 'PNG'),
+    'avatar96': (96, 96, 'PNG'),
+    'avatar200': (200, 200, 'PNG'),
+    'header600': (600, None, 'JPEG'),
+}
+
+EXTENSIONS = {'PNG': 'png', 'JPEG': 'jpg'}
+
+DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+
+# Largest source image we are willing to download.
+MAX_SOURCE_BYTES = 10 * 1024 * 1024
+
+# URL -> digest lookups kept in memory per worker.
+DIGEST_CACHE_SIZE = 10000
+
+# Failed URLs are retried after this long; at most this many are held.
+FAILED_RETRY_SECONDS = 3600
+FAILED_CACHE_SIZE = 10000
+
+
+class ImageSourceError(Exception):
+    """The source image could not be read."""
+
+
+def is_public_address(address):
+    """Return whether the IP `address` is on the public internet."""
+
+    ip = ipaddress.ip_address(address.split('%')[0])
+    return ip.is_global and not ip.is_multicast
+
+
+def _connect_public(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT,
+                    source_address=None):
+    """socket.create_connection for public hosts only.
+
+    Connects to the address that was checked, so a DNS answer that
+    changes between the check and the connection can't get through.
+    """
+
+    host, port = address
+    found = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    addresses = [info[4][0] for info in found]
+    if not addresses or not all(map(is_public_address, addresses)):
+        raise OSError(f"{host} is not a public address")
+    return socket.create_connection((addresses[0], port), timeout,
+                                    source_address)
+
+
+class _PublicHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = _connect_public
+
+
+class _PublicHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = _connect_public
+
+
+class _PublicHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(_PublicHTTPConnection, req)
+
+
+class _PublicHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(_PublicHTTPSConnection, req,
+                            context=self._context)
+
+
+def _public_opener():
+    """An opener that only speaks http(s) to public addresses.
+
+    No proxies, no other schemes; redirects are followed, and every hop
+    connects through the same check.
+    """
+
+    opener = urllib.request.OpenerDirector()
+    for handler in (urllib.request.ProxyHandler({}), _PublicHTTPHandler(),
+                    _PublicHTTPSHandler(),
+                    urllib.request.HTTPDefaultErrorHandler(),
+                    urllib.request.HTTPRedirectHandler(),
+                    urllib.request.HTTPErrorProcessor()):
+        opener.add_handler(handler)
+    return opener
+
+
+class HttpSource:
+    """Read images from http(s) URLs, and local paths from `static_dir`.
+
+    User-supplied URLs must not reach the server's own network: hosts
+    that resolve to loopback, private, link-local or other non-public
+    addresses are refused, on every redirect hop too. Only `image/*`
+    responses are accepted.
+    """
+
+    def __init__(self, static_dir, timeout=10):
+        self.local = LocalFileSource(static_dir)
+        self.timeout = timeout
+        self.opener = _public_opener()
+
+    def read(self, url):
+        if url.startswith('/static/'):
+            return self.local.read(url)
+
+        if not url.startswith(('http://', 'https://')):
+            raise ImageSourceError(f"Unsupported image URL: {url}")
+
+        try:
+            with self.opener.open(url, timeout=self.timeout) as resp:
+                content_type = resp.headers.get_content_type()
+                if not content_type.startswith('image/'):
+                    raise ImageSourceError(
+                        f"Not an image: {url} ({content_type})")
+                data = resp.read(MAX_SOURCE_BYTES + 1)
+        except (OSError, ValueError, http.client.HTTPException) as err:
+            raise ImageSourceError(f"Could not fetch {url}: {err}")
+
+        if len(data) > MAX_SOURCE_BYTES:
+            raise ImageSourceError(f"Image too large: {url}")
+        return data
+
+
+class LocalFileSource:
+    """Read images from files under `root`, ignoring the URL's host.
+
+    '/static/images/a.png' and 'https://host/images/a.png' both map to
+    `root`/images/a.png. Used for the app's own static images and for
+    offline tests.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.realpath(root)
+
+    def read(self, url):
+        path = urlparse(url).path
+        if path.startswith('/static/'):
+            path = path[len('/static'):]
+
+        full = os.path.realpath(os.path.join(self.root, path.lstrip('/')))
+        if not full.startswith(self.root + os.sep):
+            raise ImageSourceError(f"Image path escapes source root: {url}")
+
+        try:
+            with open(full, 'rb') as f:
+                return f.read()
+        except OSError as err:
+            raise ImageSourceError(f"Could not read {url}: {err}")
+
+
+class ImageCache:
+    """Content-addressed store of resized user images.
+
+    Ingestion runs on a small pool of worker threads fed by a bounded
+    queue; when the queue is full new requests are dropped and retried
+    the next time the image is shown.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.root = None
+        self.source = None
+        self.workers = 2
+        self._queue = None
+        self._threads = []
+        self._pending = set()
+        # url -> when it failed, oldest first
+        self._failed = OrderedDict()
+        # url -> digest, least recently used first
+        self._digests = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Configure from IMAGE_CACHE_* settings and add the template filter.
+
+        - IMAGE_CACHE_DIR: cache root (default: <instance path>/images)
+        - IMAGE_SOURCE: 'http' (default) or 'local' to read every URL from
+          IMAGE_SOURCE_DIR (default: the static folder)
+        - IMAGE_WORKERS / IMAGE_QUEUE_SIZE: ingestion pool size and backlog
+        """
+
+        self.enabled = (Image is not None
+                        and app.config.get('IMAGE_CACHE', True))
+        self.root = app.config.get('IMAGE_CACHE_DIR') or os.path.join(
+            app.instance_path, 'images')
+        self.workers = app.config.get('IMAGE_WORKERS', 2)
+        self._queue = queue.Queue(app.config.get('IMAGE_QUEUE_SIZE', 256))
+        self._digests = OrderedDict()
+        self._failed = OrderedDict()
+
+        source_dir = app.config.get('IMAGE_SOURCE_DIR') or app.static_folder
+        if app.config.get('IMAGE_SOURCE') == 'local':
+            self.source = LocalFileSource(source_dir)
+        else:
+            self.source = HttpSource(source_dir)
+
+        app.add_template_filter(self.thumbnail_url, 'thumbnail')
+
+    # Lookup ###############################################################
+
+    def _ref_path(self, url):
+        name = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.root, 'refs', name)
+
+    def variant_dir(self, digest):
+        if not DIGEST_RE.match(digest):
+            raise ValueError(f"Not an image digest: {digest!r}")
+        return os.path.join(self.root, digest[:2], digest)
+
+    @staticmethod
+    def variant_filename(variant):
+        return f"{variant}.{EXTENSIONS[VARIANTS[variant][2]]}"
+
+    def digest_for(self, url):
+        """Return the content digest of an ingested `url`, or None."""
+
+        with self._lock:
+            digest = self._digests.get(url)
+            if digest is not None:
+                self._digests.move_to_end(url)
+        cache_result('images', digest is not None)
+        if digest is None:
+            try:
+                with open(self._ref_path(url)) as f:
+                    digest = f.read().strip()
+            except OSError:
+                return None
+            if not DIGEST_RE.match(digest) \
+                    or self._missing_variants(digest):
+                # stored before VARIANTS gained some: ingest it again
+                return None
+            self._remember(url, digest)
+        return digest
+
+    def _missing_variants(self, digest):
+        directory = self.variant_dir(digest)
+        return [variant for variant in VARIANTS
+                if not os.path.exists(os.path.join(
+                    directory, self.variant_filename(variant)))]
+
+    def _remember(self, url, digest):
+        with self._lock:
+            self._digests[url] = digest
+            self._digests.move_to_end(url)
+            while len(self._digests) > DIGEST_CACHE_SIZE:
+                self._digests.popitem(last=False)
+
+    def failed_recently(self, url):
+        """Return whether ingesting `url` failed within
+        FAILED_RETRY_SECONDS."""
+
+        with self._lock:
+            failed_at = self._failed.get(url)
+            if failed_at is None:
+                return False
+            if time.monotonic() - failed_at < FAILED_RETRY_SECONDS:
+                return True
+            del self._failed[url]
+            return False
+
+    def _record_failure(self, url):
+        with self._lock:
+            self._failed.pop(url, None)
+            self._failed[url] = time.monotonic()
+            while len(self._failed) > FAILED_CACHE_SIZE:
+                self._failed.popitem(last=False)
+
+    def thumbnail_url(self, url, variant):
+        """Return the URL of `variant` for `url`, or `url` itself.
+
+        Images that haven't been ingested yet are queued for ingestion.
+        """
+
+        if not url or not self.enabled:
+            return url
+
+        digest = self.digest_for(url)
+        if digest is None:
+            if not self.failed_recently(url):
+                self.submit(url)
+            return url
+
+        return f"/images/{digest}/{self.variant_filename(variant)}"
+
+    # Ingestion ############################################################
+
+    def ingest(self, url):
+        """Fetch `url`, store all its variants and return the digest."""
+
+        data = self.source.read(url)
+        digest = hashlib.sha256(data).hexdigest()
+        directory = self.variant_dir(digest)
+
+        missing = self._missing_variants(digest)
+        if missing:
+            try:
+                original = Image.open(BytesIO(data))
+                original.load()
+            except Exception as err:
+                raise ImageSourceError(f"Not an image: {url} ({err})")
+
+        if missing and os.path.isdir(directory):
+            # a set stored before VARIANTS gained these: add them one by one
+            for variant in missing:
+                _write_atomic(
+                    os.path.join(directory, self.variant_filename(variant)),
+                    resize(original, variant))
+        elif missing:
+            # Build every variant in a scratch directory and rename it into
+            # place, so readers never see a half-written set.
+            scratch = f"{directory}.{os.getpid()}.{threading.get_ident()}"
+            os.makedirs(scratch)
+            for variant in VARIANTS:
+                with open(os.path.join(scratch,
+                                       self.variant_filename(variant)),
+                          'wb') as f:
+                    f.write(resize(original, variant))
+            try:
+                os.rename(scratch, directory)
+            except OSError:
+                # another worker stored the same image first
+                shutil.rmtree(scratch, ignore_errors=True)
+
+        ref = self._ref_path(url)
+        os.makedirs(os.path.dirname(ref), exist_ok=True)
+        _write_atomic(ref, digest.encode('ascii'))
+        self._remember(url, digest)
+        return digest
+
+    def submit(self, url):
+        """Queue `url` for ingestion; return False if the queue is full."""
+
+        if not self.enabled or not url:
+            return False
+
+        with self._lock:
+            if url in self._pending:
+                return True
+            try:
+                self._queue.put_nowait(url)
+            except queue.Full:
+                return False
+            self._pending.add(url)
+            # Threads don't survive fork, so start the pool on first use
+            # in each worker rather than when the app is built.
+            if not self._threads:
+                self._start_workers()
+        return True
+
+    def submit_user(self, user):
+        """Queue both of `user`'s images for ingestion."""
+
+        for url in (user.image_url, user.header_image_url):
+            if url and self.digest_for(url) is None:
+                self.submit(url)
+
+    def _start_workers(self):
+        for n in range(self.workers):
+            thread = threading.Thread(target=self._work, daemon=True,
+                                      name=f"image-ingest-{n}")
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            url = self._queue.get()
+            try:
+                self.ingest(url)
+            except Exception:
+                self._record_failure(url)
+                logger.warning("Image ingestion failed for %s", url,
+                               exc_info=True)
+            finally:
+                with self._lock:
+                    self._pending.discard(url)
+                self._queue.task_done()
+
+    def join(self):
+        """Wait until every queued image has been processed."""
+
+        if self._queue is not None:
+            self._queue.join()
+
+
+def resize(image, variant):
+    """Return `image` resized to `variant`, encoded as bytes."""
+
+    width, height, fmt = VARIANTS[variant]
+
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA')
+
+    if height is None:
+        height = max(1, round(image.height * width / image.width))
+        resized = image.resize((width, height), Image.LANCZOS)
+    else:
+        resized = ImageOps.fit(image, (width, height), Image.LANCZOS)
+
+    if fmt == 'JPEG' and resized.mode == 'RGBA':
+        background = Image.new('RGB', resized.size, (255, 255, 255))
+        background.paste(resized, mask=resized.split()[3])
+        resized = background
+
+    out = BytesIO()
+    resized.save(out, fmt, optimize=True)
+    return out.getvalue()
+
+
+def _write_atomic(path, data):
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+images = ImageCache()
@@ -0,0 +1,127 @@
+"""Cross-worker cache invalidation.
+
+Workers keep data in process memory (author timelines, the popular
+top-K, the followed authors of open live streams). When one worker
+changes the underlying rows, it publishes a typed event on the
+'invalidate' channel (see channels.py) in the same transaction; every
+worker, on every node, applies it to the caches registered for that
+type.
+
+Event types and their fields:
+
+- USER_CHANGED: user_id, deleted, and optionally username and email
+  (the user's names after the change) and new (set on signup)
+- MESSAGE_POSTED: message_id, user_id (the author), timestamp (ISO 8601)
+- MESSAGE_DELETED: message_id, user_id (the author)
+- FOLLOW_CHANGED: follower_id, followed_ids (a list), following
+
+Handlers are registered with the `handler` decorator and must be
+idempotent: the publishing worker usually updates its own caches right
+away and then gets its own event back.
+
+Each event carries its publish time, so every worker tracks delivery
+lag (last, max, mean) and logs a warning past
+INVALIDATION_LAG_WARN_SECONDS. Lag across nodes includes their clock
+skew.
+"""
+
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import NamedTuple
+
+from channels import channels
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'invalidate'
+
+USER_CHANGED = 'user_changed'
+MESSAGE_POSTED = 'message_posted'
+MESSAGE_DELETED = 'message_deleted'
+FOLLOW_CHANGED = 'follow_changed'
+
+EVENT_TYPES = (USER_CHANGED, MESSAGE_POSTED, MESSAGE_DELETED,
+               FOLLOW_CHANGED)
+
+
+class LagStats(NamedTuple):
+    """Delivery lag of the events this worker applied, in seconds."""
+
+    events: int
+    last: float
+    max: float
+    mean: float
+
+
+class InvalidationBus:
+    """Publish invalidation events and apply them to registered caches."""
+
+    def __init__(self):
+        self.warn_after = 5.0
+        self._handlers = defaultdict(list)
+        self._lock = threading.Lock()
+        self._events = 0
+        self._last = self._max = self._total = 0.0
+        self._subscribed = False
+
+    def init_app(self, app):
+        """Read INVALIDATION_LAG_WARN_SECONDS and subscribe to the channel."""
+
+        self.warn_after = app.config.get('INVALIDATION_LAG_WARN_SECONDS',
+                                         self.warn_after)
+        if not self._subscribed:
+            channels.subscribe(CHANNEL, self.apply)
+            self._subscribed = True
+
+    def handler(self, event_type):
+        """Decorator: call the function with the fields of each event."""
+
+        if event_type not in EVENT_TYPES:
+            raise ValueError(f"Unknown invalidation event {event_type!r}")
+
+        def register(func):
+            self._handlers[event_type].append(func)
+            return func
+        return register
+
+    def publish(self, event_type, **fields):
+        """Announce a change; sent when the current transaction commits."""
+
+        if event_type not in EVENT_TYPES:
+            raise ValueError(f"Unknown invalidation event {event_type!r}")
+        channels.publish(CHANNEL, dict(fields, type=event_type,
+                                       at=time.time()))
+
+    def apply(self, payload):
+        """Run the handlers of one delivered event and record its lag."""
+
+        payload = dict(payload)
+        event_type = payload.pop('type')
+        lag = max(0.0, time.time() - payload.pop('at'))
+
+        with self._lock:
+            self._events += 1
+            self._last = lag
+            self._max = max(self._max, lag)
+            self._total += lag
+        if lag > self.warn_after:
+            logger.warning("Invalidation %s arrived %.1fs late",
+                           event_type, lag)
+
+        for handler in self._handlers.get(event_type, ()):
+            try:
+                handler(**payload)
+            except Exception:
+                logger.exception("Invalidation handler %r failed", handler)
+
+    def lag(self):
+        """Return this worker's `LagStats`."""
+
+        with self._lock:
+            mean = self._total / self._events if self._events else 0.0
+            return LagStats(self._events, self._last, self._max, mean)
+
+
+invalidation = InvalidationBus()
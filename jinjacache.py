@@ -0,0 +1,96 @@
+"""Persistent Jinja bytecode cache, template precompilation and warmup.
+
+Jinja compiles every template to Python code the first time it is used,
+so each fresh worker serves its first pages slowly. With
+JINJA_BYTECODE_CACHE on, compiled templates are stored in JINJA_CACHE_DIR
+and shared by every worker and every deploy of the same templates:
+
+- `flask precompile-templates` fills the cache at build time
+- `warmup(app)` loads the hot templates; wsgi.py calls it in the
+  gunicorn master, so every forked worker inherits them
+- `warm_routes(app)` renders the anonymous pages once; gunicorn's
+  `post_fork` calls it in each worker, after its connections are reset
+"""
+
+import os
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from jinja2 import FileSystemBytecodeCache
+
+# Templates on the hot path, loaded by `warmup`.
+HOT_TEMPLATES = (
+    'base.html',
+    'home.html',
+    'home-anon.html',
+    'messages/_feed_item.html',
+    'users/detail.html',
+    'users/show.html',
+    'users/index.html',
+    'users/login.html',
+    'users/signup.html',
+    'messages/show.html',
+)
+
+# Pages that render without a user or database rows, by `warm_routes`.
+WARMUP_URLS = ('/', '/login', '/signup')
+
+
+def init_app(app):
+    """Install the bytecode cache when JINJA_BYTECODE_CACHE is on."""
+
+    app.cli.add_command(precompile_command)
+
+    if not app.config.get('JINJA_BYTECODE_CACHE'):
+        return
+
+    directory = app.config.get('JINJA_CACHE_DIR') or os.path.join(
+        app.instance_path, 'jinja-cache')
+    os.makedirs(directory, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+
+def precompile(app):
+    """Compile every template of `app`; return how many there are."""
+
+    names = app.jinja_env.list_templates(extensions=('html',))
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+def warmup(app):
+    """Load the hot templates into the environment's in-memory cache.
+
+    Touches no database, sockets or request hooks, so it is safe to run
+    before forking.
+    """
+
+    for name in HOT_TEMPLATES:
+        app.jinja_env.get_template(name)
+
+
+def warm_routes(app):
+    """Render the anonymous pages once through the full request stack.
+
+    Opens database connections and runs the request hooks: call it in
+    the process that will serve, never in a master about to fork.
+    """
+
+    with app.test_client() as client:
+        for url in WARMUP_URLS:
+            client.get(url)
+
+
+@click.command('precompile-templates')
+@with_appcontext
+def precompile_command():
+    """Compile all templates into the Jinja bytecode cache."""
+
+    app = current_app._get_current_object()
+    if app.jinja_env.bytecode_cache is None:
+        raise click.ClickException(
+            "JINJA_BYTECODE_CACHE is off for this profile.")
+
+    click.echo(f"Compiled {precompile(app)} templates.")
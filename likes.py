@@ -0,0 +1,191 @@
+"""Write-behind buffer for like toggles.
+
+Clicking the like button only records the user's intent in memory.
+Intents for the same (user, message) pair coalesce, so a burst of toggles
+ends up as at most one row change. Every `LIKE_WRITE_BEHIND_SECONDS` the
+buffer is flushed in one transaction: one batched insert for new likes,
+one batched delete for removed ones, and a recount of `like_count` for
+the messages touched. Their popularity scores are updated in the same
+transaction (see popular.py).
+
+With a window of 0 (the test profile) every toggle is flushed at once.
+
+Pending intents are absolute states (liked or not), and the like buttons
+post the state they ask for, so an unlike stays an unlike even when the
+like it undoes is still pending in another worker. Each worker still
+keeps its own buffer: intents for the same pair in two workers are
+written in the order the workers flush, and the last write wins.
+
+Likes of messages that are gone by flush time (purged or archived) are
+dropped. A batch that fails on a transient database error goes back in
+the buffer for the next flush; any other error drops it and is logged,
+so one bad row can't hold up every like behind it.
+"""
+
+import atexit
+import logging
+import threading
+
+from sqlalchemy import and_, bindparam, or_, select, func
+from sqlalchemy.exc import OperationalError, TimeoutError
+
+from background import PeriodicTask
+from models import db, insert_ignore, Likes, Message
+from popular import popular
+from querycache import bake, hot_query
+
+logger = logging.getLogger(__name__)
+
+# Pairs per DELETE statement; keeps the OR-list a sane size.
+DELETE_CHUNK = 500
+
+# Errors worth retrying the batch for: lost connections, pool timeouts,
+# deadlocks and serialization failures.
+TRANSIENT_ERRORS = (OperationalError, TimeoutError)
+
+
+class LikeBuffer:
+    """Pending like/unlike intents, keyed by (user_id, message_id)."""
+
+    def __init__(self):
+        self.app = None
+        self.window = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    def init_app(self, app):
+        """Read LIKE_WRITE_BEHIND_SECONDS from the app config."""
+
+        self.app = app
+        self.window = app.config.get('LIKE_WRITE_BEHIND_SECONDS', 0)
+
+    def is_liked(self, user_id, message_id):
+        """Return whether `user_id` likes `message_id`, pending state first."""
+
+        with self._lock:
+            pending = self._pending.get((user_id, message_id))
+        if pending is not None:
+            return pending
+
+        return _like_exists(user_id, message_id)
+
+    def toggle(self, user_id, message_id):
+        """Flip the like state of `message_id` for `user_id`.
+
+        Returns the new state.
+        """
+
+        return self.set(user_id, message_id,
+                        not self.is_liked(user_id, message_id))
+
+    def set(self, user_id, message_id, liked):
+        """Record that `user_id` likes (or no longer likes) `message_id`.
+
+        Returns `liked`.
+        """
+
+        with self._lock:
+            self._pending[(user_id, message_id)] = liked
+
+        if not self.window:
+            self.flush()
+        else:
+            self._start_flusher()
+
+        return liked
+
+    def pending_for(self, user_id):
+        """Return {message_id: liked} for `user_id`'s unflushed intents."""
+
+        with self._lock:
+            return {msg_id: liked
+                    for (uid, msg_id), liked in self._pending.items()
+                    if uid == user_id}
+
+    def liked_ids(self, user_id, stored_ids):
+        """Overlay `user_id`'s pending intents on liked ids from the DB."""
+
+        liked = set(stored_ids)
+        for msg_id, state in self.pending_for(user_id).items():
+            if state:
+                liked.add(msg_id)
+            else:
+                liked.discard(msg_id)
+        return liked
+
+    def flush(self):
+        """Write all pending intents in one transaction."""
+
+        with self._lock:
+            batch, self._pending = self._pending, {}
+
+        if not batch:
+            return
+
+        try:
+            # a like of a message purged or archived meanwhile would break
+            # the foreign key
+            message_ids = {msg_id for msg_id, in db.session
+                           .query(Message.id)
+                           .filter(Message.id.in_(
+                               {msg_id for _, msg_id in batch}))}
+            adds = [dict(user_id=uid, message_id=msg_id)
+                    for (uid, msg_id), liked in batch.items()
+                    if liked and msg_id in message_ids]
+            removes = [key for key, liked in batch.items() if not liked]
+
+            insert_ignore(Likes.__table__, adds)
+
+            for start in range(0, len(removes), DELETE_CHUNK):
+                chunk = removes[start:start + DELETE_CHUNK]
+                db.session.execute(Likes.__table__.delete().where(or_(*(
+                    and_(Likes.user_id == uid, Likes.message_id == msg_id)
+                    for uid, msg_id in chunk))))
+
+            like_count = (select([func.count()])
+                          .where(Likes.message_id == Message.id)
+                          .as_scalar())
+            db.session.execute(Message.__table__.update()
+                               .where(Message.id.in_(message_ids))
+                               .values(like_count=like_count))
+            popular.rescore(message_ids)
+
+            db.session.commit()
+
+        except TRANSIENT_ERRORS:
+            db.session.rollback()
+            # Put the batch back, unless newer intents arrived meanwhile.
+            with self._lock:
+                for key, liked in batch.items():
+                    self._pending.setdefault(key, liked)
+            raise
+
+        except Exception:
+            db.session.rollback()
+            logger.exception("Dropped a batch of %d like changes",
+                             len(batch))
+
+    def _start_flusher(self):
+        if self._flusher is not None:
+            return
+
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = PeriodicTask(self.app, self.flush,
+                                             self.window, 'like-flusher')
+                self._flusher.start()
+                atexit.register(self._flusher.run_once)
+
+
+@hot_query
+def _like_exists(user_id, message_id):
+    bq = bake(lambda s: s.query(Likes.id))
+    bq += lambda q: q.filter(Likes.user_id == bindparam('user_id'),
+                             Likes.message_id == bindparam('message_id'))
+
+    return bq(db.session()).params(user_id=user_id,
+                                   message_id=message_id).first() is not None
+
+
+like_buffer = LikeBuffer()
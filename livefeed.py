@@ -0,0 +1,119 @@
+"""Live feed updates over server-sent events.
+
+`messages_add` publishes each new message's id and author on the
+'messages' channel (see channels.py), which reaches every worker. Each
+worker's `LiveHub` fans the notification out to its open `/live`
+streams whose user follows the author.
+
+A stream only carries message ids. The page then asks
+`/feed/since?after=<newest id shown>` for the rendered delta, so a client
+that missed events (a full queue, a reconnect) catches up on its next
+fetch instead of reloading the whole feed.
+
+Every stream holds a worker thread for as long as it is open, so each
+worker accepts at most LIVE_MAX_CONNECTIONS of them and answers 503
+beyond that. Quiet streams get a comment line every
+LIVE_HEARTBEAT_SECONDS so proxies don't time them out.
+"""
+
+import queue
+import threading
+
+from channels import channels
+
+CHANNEL = 'messages'
+
+# Ids buffered per stream before new ones are dropped.
+QUEUE_SIZE = 100
+
+
+class LiveHub:
+    """This worker's open live streams, and who they listen to."""
+
+    def __init__(self):
+        self.max_connections = 50
+        self.heartbeat = 15.0
+        self._streams = {}
+        self._lock = threading.Lock()
+        self._subscribed = False
+
+    def init_app(self, app):
+        """Read LIVE_MAX_CONNECTIONS and LIVE_HEARTBEAT_SECONDS."""
+
+        self.max_connections = app.config.get('LIVE_MAX_CONNECTIONS',
+                                              self.max_connections)
+        self.heartbeat = app.config.get('LIVE_HEARTBEAT_SECONDS',
+                                        self.heartbeat)
+
+    def __len__(self):
+        return len(self._streams)
+
+    def publish(self, message_id, user_id):
+        """Announce a new message; sent when the transaction commits."""
+
+        channels.publish(CHANNEL, {'id': message_id, 'user_id': user_id})
+
+    def connect(self, user_id, author_ids):
+        """Open a stream for `user_id`, carrying messages by `author_ids`.
+
+        Returns its queue, or None when this worker is full.
+        """
+
+        with self._lock:
+            if len(self._streams) >= self.max_connections:
+                return None
+            stream = queue.Queue(QUEUE_SIZE)
+            self._streams[stream] = (user_id, set(author_ids))
+            subscribe, self._subscribed = not self._subscribed, True
+
+        if subscribe:
+            channels.subscribe(CHANNEL, self._on_message)
+        return stream
+
+    def follow_changed(self, follower_id, followed_ids, following):
+        """Start or stop sending the messages of `followed_ids` to the
+        open streams of `follower_id`."""
+
+        with self._lock:
+            for user_id, authors in self._streams.values():
+                if user_id != follower_id:
+                    continue
+                if following:
+                    authors.update(followed_ids)
+                else:
+                    authors.difference_update(followed_ids)
+
+    def disconnect(self, stream):
+        with self._lock:
+            self._streams.pop(stream, None)
+
+    def _on_message(self, payload):
+        with self._lock:
+            streams = [stream
+                       for stream, (_, authors) in self._streams.items()
+                       if payload['user_id'] in authors]
+
+        for stream in streams:
+            try:
+                stream.put_nowait(payload['id'])
+            except queue.Full:
+                pass
+
+    def events(self, stream):
+        """Yield server-sent events for `stream` until the client leaves."""
+
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    message_id = stream.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield (f"event: message\nid: {message_id}\n"
+                       f"data: {message_id}\n\n")
+        finally:
+            self.disconnect(stream)
+
+
+live_hub = LiveHub()
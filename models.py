@@ -1,12 +1,40 @@
 """SQLAlchemy models for Warbler."""
 
-from datetime import datetime
-
 from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import bindparam, event
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+
+from querycache import bake, hot_query
+from snowflake import SnowflakeIds
 
 bcrypt = Bcrypt()
 db = SQLAlchemy()
+message_ids = SnowflakeIds()
+
+# Message ids may be 64-bit snowflakes (see snowflake.py). SQLite only
+# autoincrements a plain INTEGER primary key, which is 64-bit there anyway.
+MessageId = db.BigInteger().with_variant(db.Integer, 'sqlite')
+
+
+class utcnow(FunctionElement):
+    """Current UTC time, evaluated by the database for each row."""
+
+    type = db.DateTime()
+
+
+@compiles(utcnow)
+def _utcnow_default(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
+
+
+@compiles(utcnow, 'postgresql')
+def _utcnow_postgresql(element, compiler, **kw):
+    # clock_timestamp() rather than now() so rows written in one
+    # transaction still get distinct, ordered times.
+    return "TIMEZONE('utc', clock_timestamp())"
 
 
 class Follows(db.Model):
@@ -31,6 +59,9 @@ class Likes(db.Model):
     """Mapping user likes to warbles."""
 
     __tablename__ = 'likes'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'message_id'),
+    )
 
     id = db.Column(
         db.Integer,
@@ -43,9 +74,16 @@ class Likes(db.Model):
     )
 
     message_id = db.Column(
-        db.Integer,
+        MessageId,
         db.ForeignKey('messages.id', ondelete='cascade'),
-        unique=True
+        index=True,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+        server_default=utcnow(),
+        index=True,
     )
 
 
@@ -177,7 +215,7 @@ class User(db.Model):
         If can't find matching user (or if password is wrong), returns False.
         """
 
-        user = cls.query.filter_by(username=username).first()
+        user = user_by_username(username)
 
         if user:
             is_auth = bcrypt.check_password_hash(user.password, password)
@@ -191,9 +229,24 @@ class Message(db.Model):
     """An individual message ("warble")."""
 
     __tablename__ = 'messages'
+    __table_args__ = (
+        # Partial indexes: soft-deleted messages drop out of the read
+        # indexes as soon as they are marked, before they are purged.
+        db.Index('ix_messages_user_id_id', 'user_id', 'id',
+                 postgresql_where=db.text('deleted_at IS NULL'),
+                 sqlite_where=db.text('deleted_at IS NULL')),
+        db.Index('ix_messages_user_id_timestamp', 'user_id', 'timestamp',
+                 'id',
+                 postgresql_where=db.text('deleted_at IS NULL'),
+                 sqlite_where=db.text('deleted_at IS NULL')),
+        # only the messages waiting for the purger (see purger.py)
+        db.Index('ix_messages_deleted_at', 'deleted_at',
+                 postgresql_where=db.text('deleted_at IS NOT NULL'),
+                 sqlite_where=db.text('deleted_at IS NOT NULL')),
+    )
 
     id = db.Column(
-        db.Integer,
+        MessageId,
         primary_key=True,
     )
 
@@ -205,7 +258,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        server_default=utcnow(),
     )
 
     user_id = db.Column(
@@ -214,8 +267,230 @@ class Message(db.Model):
         nullable=False,
     )
 
+    like_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # Set when the author deletes the message; purger.py removes the row
+    # and everything referencing it later.
+    deleted_at = db.Column(
+        db.DateTime,
+        nullable=True,
+    )
+
     user = db.relationship('User')
 
+    @classmethod
+    def not_deleted(cls):
+        """Filter for messages that haven't been deleted.
+
+        Every read of messages carries it, which also lets the planner use
+        the partial indexes above.
+        """
+
+        return cls.deleted_at.is_(None)
+
+    @classmethod
+    def newest_first(cls):
+        """Ordering for "most recent messages" queries.
+
+        With snowflake ids the primary key alone is time-ordered, so no
+        timestamp index is needed; otherwise order on the timestamp and
+        break ties on the id.
+        """
+
+        if message_ids.enabled:
+            return (cls.id.desc(),)
+        return (cls.timestamp.desc(), cls.id.desc())
+
+
+class MessageTag(db.Model):
+    """A #tag used in a message.
+
+    The (tag, message_id) key doubles as the index for tag timelines.
+    """
+
+    __tablename__ = 'message_tags'
+
+    tag = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        MessageId,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+
+class Mention(db.Model):
+    """An @mention of a user in a message."""
+
+    __tablename__ = 'mentions'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        MessageId,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+
+class TagBucket(db.Model):
+    """How often a tag was used in one minute, as counted by one worker."""
+
+    __tablename__ = 'tag_buckets'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    minute = db.Column(
+        db.DateTime,
+        nullable=False,
+        index=True,
+    )
+
+    tag = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    count = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+
+class MessageScore(db.Model):
+    """Time-decayed like score of a message (see popular.py)."""
+
+    __tablename__ = 'message_scores'
+
+    message_id = db.Column(
+        MessageId,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    score = db.Column(
+        db.Float,
+        nullable=False,
+        index=True,
+    )
+
+
+class Notification(db.Model):
+    """A published notification, for channels without LISTEN/NOTIFY."""
+
+    __tablename__ = 'notifications'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    channel = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    payload = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        server_default=utcnow(),
+        index=True,
+    )
+
+
+@hot_query
+def user_by_id(user_id):
+    """Return the `User` with `user_id`, or None."""
+
+    bq = bake(lambda s: s.query(User))
+    bq += lambda q: q.filter(User.id == bindparam('user_id'))
+
+    return bq(db.session()).params(user_id=user_id).first()
+
+
+@hot_query
+def user_by_username(username):
+    """Return the `User` named `username`, or None."""
+
+    bq = bake(lambda s: s.query(User))
+    bq += lambda q: q.filter(User.username == bindparam('username'))
+
+    return bq(db.session()).params(username=username).first()
+
+
+@event.listens_for(Message, 'before_insert')
+def _assign_message_id(mapper, connection, target):
+    """Give new messages a snowflake id when those are enabled."""
+
+    if message_ids.enabled and target.id is None:
+        target.id = message_ids.next_id()
+
+
+def insert_ignore(table, rows, chunk=None):
+    """Insert `rows` into `table`, skipping rows that violate a unique key.
+
+    One statement for the whole batch: ON CONFLICT DO NOTHING on
+    PostgreSQL, INSERT OR IGNORE on SQLite. With `chunk`, the rows go in
+    multi-row VALUES statements of up to that many rows instead, which
+    saves a round trip per row on drivers that run executemany row by row.
+    """
+
+    if not rows:
+        return
+
+    if db.session.get_bind().dialect.name == 'postgresql':
+        stmt = postgresql.insert(table).on_conflict_do_nothing()
+    else:
+        stmt = table.insert().prefix_with('OR IGNORE')
+
+    if chunk is None:
+        db.session.execute(stmt, rows)
+        return
+
+    for start in range(0, len(rows), chunk):
+        db.session.execute(stmt.values(rows[start:start + chunk]))
+
+
+def upsert(table, rows):
+    """Insert `rows` into `table`, replacing rows with the same primary key.
+
+    ON CONFLICT DO UPDATE on PostgreSQL, INSERT OR REPLACE on SQLite.
+    """
+
+    if not rows:
+        return
+
+    if db.session.get_bind().dialect.name == 'postgresql':
+        stmt = postgresql.insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(table.primary_key.columns),
+            set_={col.name: stmt.excluded[col.name]
+                  for col in table.columns if not col.primary_key})
+    else:
+        stmt = table.insert().prefix_with('OR REPLACE')
+
+    db.session.execute(stmt, rows)
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
@@ -225,3 +500,4 @@ def connect_db(app):
 
     db.app = app
     db.init_app(app)
+    message_ids.init_app(app)
@@ -0,0 +1,346 @@
+"""Full-page microcache for anonymous visitors.
+
+Logged-out visitors all see the same home, profile, message and
+directory pages, so a worker renders each of them at most once per
+PAGE_CACHE_TTL_SECONDS and answers everyone else from memory:
+
+- only GET and HEAD requests of the endpoints in PAGES are cached, and
+  only for visitors with an empty session (no user, no flashed
+  messages). A render that writes to the session isn't stored
+- the key is the endpoint, its view arguments and the query arguments
+  the view reads, as the view parses them: `/users?q=` and `/users`, or
+  `/users/1?before=x&utm_source=y` and `/users/1` share an entry. The
+  response encoding is part of the key, so entries are stored
+  compressed (see compression.py)
+- single flight: while one request renders a page, other requests for
+  it wait for that render (up to PAGE_CACHE_WAIT_SECONDS) instead of
+  rendering it too. Once an entry expires, one request re-renders it
+  while the others get the stale copy, for at most
+  PAGE_CACHE_STALE_SECONDS past expiry
+- the flight spans worker processes: a render holds an flock on one of
+  FLIGHT_STRIPES files in PAGE_CACHE_DIR (default
+  <instance>/page-cache), picked by the hash of the key, and leaves the
+  page there. A worker missing the page takes it from that file while
+  it's fresh, or waits for the worker rendering it, so a hot page costs
+  one render per TTL across all workers
+- entries are kept in LRU order within PAGE_CACHE_MAX_BYTES of bodies
+
+The async read path (asyncreads.py) runs the same request hooks, so
+profiles it serves share these entries with the sync routes.
+
+Deleted messages and changed users are dropped from the cache right
+away through the invalidation handlers in app.py; a worker ignores the
+pages other workers rendered before its last invalidation. Anything else
+is at most a TTL old.
+"""
+
+import fcntl
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+from flask import current_app, g, request, session
+
+from accesslog import cache_result
+from compression import compression
+
+# endpoint -> {query argument: type} for the pages that are cached
+PAGES = {
+    'warbler.homepage': {},
+    'warbler.users_show': {'before': int},
+    'warbler.messages_show': {},
+    'warbler.list_users': {'q': str},
+}
+
+# Headers not replayed from the cache.
+SKIP_HEADERS = frozenset(('content-length', 'date', 'set-cookie'))
+
+# Flight files shared by the workers; keys hashing alike share one.
+FLIGHT_STRIPES = 256
+
+# How often a worker checks whether another one is done rendering.
+FLIGHT_POLL_SECONDS = 0.01
+
+
+class Page(NamedTuple):
+    """A cached response."""
+
+    status: int
+    headers: list
+    body: bytes
+    created: float
+    fresh_until: float
+    stale_until: float
+
+
+class PageCache:
+    """Serve anonymous pages from memory in a before_request hook."""
+
+    def __init__(self):
+        self.enabled = False
+        self.ttl = 5.0
+        self.stale = 60.0
+        self.wait = 5.0
+        self.max_bytes = 64 * 2 ** 20
+        self.directory = None
+        self.size = 0
+        self._pages = OrderedDict()
+        self._flights = {}
+        self._lock = threading.Lock()
+        # wall clock time of the last invalidation seen by this process
+        self._forgotten_at = 0.0
+
+    def init_app(self, app):
+        """Read the PAGE_CACHE_* settings and install the request hooks.
+
+        Call before compression.init_app: after_request hooks run in
+        reverse, and pages are stored once compressed.
+        """
+
+        self.enabled = app.config.get('PAGE_CACHE_ENABLED', False)
+        self.ttl = app.config.get('PAGE_CACHE_TTL_SECONDS', self.ttl)
+        self.stale = app.config.get('PAGE_CACHE_STALE_SECONDS', self.stale)
+        self.wait = app.config.get('PAGE_CACHE_WAIT_SECONDS', self.wait)
+        self.max_bytes = app.config.get('PAGE_CACHE_MAX_BYTES',
+                                        self.max_bytes)
+        self.directory = app.config.get('PAGE_CACHE_DIR') or os.path.join(
+            app.instance_path, 'page-cache')
+        os.makedirs(self.directory, exist_ok=True)
+        self._forgotten_at = time.time()
+
+        app.before_request(self.serve)
+        app.after_request(self.store)
+        app.teardown_request(self.release)
+
+    def key(self):
+        """Return the cache key of this request, or None if it can't be
+        served from the cache."""
+
+        arg_types = PAGES.get(request.endpoint)
+        if not self.enabled or arg_types is None \
+                or request.method not in ('GET', 'HEAD') or session:
+            return None
+
+        args = tuple((name, value) for name, value in (
+            (name, request.args.get(name, type=type_))
+            for name, type_ in arg_types.items())
+            if value not in (None, ''))
+        return (request.endpoint, tuple(sorted(request.view_args.items())),
+                args, compression.negotiate())
+
+    # Request hooks ########################################################
+
+    def serve(self):
+        key = self.key()
+        if key is None:
+            return None
+        g.page_cache_key = key
+
+        page, flight = self._lookup(key)
+        if flight is not None:
+            # someone else is rendering this page; take theirs
+            flight.wait(self.wait)
+            with self._lock:
+                page = self._pages.get(key)
+            if page is not None and time.monotonic() >= page.stale_until:
+                page = None
+        elif g.get('page_cache_flight'):
+            page = self._fly(key)
+
+        cache_result('pages', page is not None)
+        if page is None:
+            return None
+
+        g.page_cache_hit = True
+        response = current_app.response_class(
+            page.body, status=page.status, headers=page.headers)
+        response.headers['Age'] = str(int(time.monotonic() - page.created))
+        return response
+
+    def _lookup(self, key):
+        """Return (page to serve, flight to wait for); (None, None) means
+        this request renders the page."""
+
+        now = time.monotonic()
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None and now >= page.stale_until:
+                page = None
+
+            if page is not None:
+                self._pages.move_to_end(key)
+                if now < page.fresh_until or key in self._flights:
+                    return page, None
+            elif key in self._flights:
+                return None, self._flights[key]
+
+            self._flights[key] = threading.Event()
+            g.page_cache_flight = True
+            return None, None
+
+    def store(self, response):
+        key = g.get('page_cache_key')
+        if key is None or g.get('page_cache_hit') \
+                or response.status_code != 200 \
+                or response.direct_passthrough \
+                or not response.is_sequence \
+                or session.modified \
+                or response.cache_control.no_store \
+                or response.cache_control.private:
+            return response
+
+        body = response.get_data()
+        if len(body) > self.max_bytes:
+            return response
+
+        headers = [(name, value) for name, value in response.headers
+                   if name.lower() not in SKIP_HEADERS]
+        self._remember(key, self._page(response.status_code, headers, body))
+
+        fd = g.get('page_cache_fd')
+        if fd is not None:
+            _write_flight(fd, (key, time.time(), response.status_code,
+                               headers, body))
+        return response
+
+    def release(self, exc=None):
+        """Wake the requests waiting for this request's render, in this
+        worker and in the others."""
+
+        fd = g.pop('page_cache_fd', None)
+        if fd is not None:
+            os.close(fd)  # drops the flock
+
+        if g.get('page_cache_flight'):
+            g.page_cache_flight = False
+            with self._lock:
+                flight = self._flights.pop(g.page_cache_key, None)
+            if flight is not None:
+                flight.set()
+
+    # Flights across workers ###############################################
+
+    def _fly(self, key):
+        """Take the flight of `key` across workers, for a request that
+        leads it in this one.
+
+        Return the page to serve: the one another worker rendered or is
+        rendering, or the stale one held here while another worker
+        re-renders it. None means this request renders the page; it then
+        holds the flight file's flock (g.page_cache_fd) until released.
+        """
+
+        fd = os.open(self._flight_path(key), os.O_RDWR | os.O_CREAT, 0o600)
+
+        locked = _try_flock(fd)
+        if not locked:
+            with self._lock:
+                stale = self._pages.get(key)
+            if stale is not None and time.monotonic() < stale.stale_until:
+                os.close(fd)
+                return stale
+
+            deadline = time.monotonic() + self.wait
+            while not locked and time.monotonic() < deadline:
+                time.sleep(FLIGHT_POLL_SECONDS)
+                locked = _try_flock(fd)
+
+        page = self._shared(fd, key) if locked else None
+        if page is not None or not locked:
+            # rendered elsewhere, or a render that outlived the wait:
+            # render without the flight
+            os.close(fd)
+            if page is not None:
+                self._remember(key, page)
+            return page
+
+        g.page_cache_fd = fd
+        return None
+
+    def _flight_path(self, key):
+        digest = hashlib.sha1(repr(key).encode()).digest()
+        stripe = int.from_bytes(digest[:4], 'big') % FLIGHT_STRIPES
+        return os.path.join(self.directory, f'{stripe:03d}.page')
+
+    def _shared(self, fd, key):
+        """Return the fresh page of `key` in flight file `fd`, or None."""
+
+        record = _read_flight(fd)
+        if record is None or record[0] != key:
+            return None
+
+        _, rendered_at, status, headers, body = record
+        age = time.time() - rendered_at
+        if rendered_at < self._forgotten_at or not 0 <= age < self.ttl:
+            return None
+        return self._page(status, headers, body, age)
+
+    # Entries ##############################################################
+
+    def _page(self, status, headers, body, age=0.0):
+        created = time.monotonic() - age
+        return Page(status, headers, body, created, created + self.ttl,
+                    created + self.ttl + self.stale)
+
+    def _remember(self, key, page):
+        with self._lock:
+            old = self._pages.pop(key, None)
+            if old is not None:
+                self.size -= len(old.body)
+            self._pages[key] = page
+            self.size += len(page.body)
+            while self.size > self.max_bytes:
+                _, evicted = self._pages.popitem(last=False)
+                self.size -= len(evicted.body)
+
+    # Invalidation #########################################################
+
+    def forget(self, endpoint, **view_args):
+        """Drop the cached pages of `endpoint` (all of them, or those with
+        these view arguments)."""
+
+        view_args = tuple(sorted(view_args.items()))
+        with self._lock:
+            self._forgotten_at = time.time()
+            for key in [key for key in self._pages if key[0] == endpoint
+                        and (not view_args or key[1] == view_args)]:
+                self.size -= len(self._pages.pop(key).body)
+
+    def clear(self):
+        with self._lock:
+            self._forgotten_at = time.time()
+            self._pages.clear()
+            self.size = 0
+
+
+def _try_flock(fd):
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+def _read_flight(fd):
+    """Return the record in flight file `fd`, or None if there's none."""
+
+    data = os.pread(fd, os.fstat(fd).st_size, 0)
+    try:
+        return pickle.loads(data)
+    except Exception:
+        # empty, or cut short by a worker dying mid-write
+        return None
+
+
+def _write_flight(fd, record):
+    data = memoryview(pickle.dumps(record, pickle.HIGHEST_PROTOCOL))
+    os.ftruncate(fd, 0)
+    offset = 0
+    while offset < len(data):
+        offset += os.pwrite(fd, data[offset:], offset)
+
+page_cache = PageCache()
@@ -0,0 +1,200 @@
+"""Monthly range partitions for the messages table (PostgreSQL).
+
+With MESSAGE_PARTITIONS on, `messages` is created as a table partitioned
+by RANGE on its id. Snowflake ids start with their creation time (see
+snowflake.py), so every month is one id range. Partitioning on the id
+rather than on the timestamp keeps the primary key, and the foreign keys
+pointing at it, as they are; a timestamp key would have to join every
+unique constraint. This needs MESSAGE_SNOWFLAKE_IDS, and PostgreSQL 12+
+for foreign keys that reference a partitioned table.
+
+Partitions are named `messages_pYYYYMM`; `messages_history` takes ids
+from before the first month. `ensure` creates the current month and the
+next MESSAGE_PARTITIONS_AHEAD. It runs when the table is created, once a
+day in each worker, and from `flask partitions ensure`. An insert past
+the last partition fails, so keep a few months ahead.
+
+Only a newly created table is partitioned; an existing `messages` table
+is left alone.
+
+Home feed queries carry a lower bound on the id (FEED_WINDOW_DAYS, see
+readmodels.feed), so the planner only visits the newest partitions.
+"""
+
+import logging
+import os
+import threading
+from datetime import datetime
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import event, text
+
+from background import PeriodicTask
+from models import db, Message
+from snowflake import min_id_for
+
+logger = logging.getLogger(__name__)
+
+HISTORY = 'messages_history'
+
+# Seconds between partition checks in each worker.
+MAINTENANCE_INTERVAL = 24 * 60 * 60
+
+enabled = False
+ahead = 3
+
+_app = None
+_maintainer = None
+_maintainer_pid = None
+_lock = threading.Lock()
+
+
+def init_app(app):
+    """Read MESSAGE_PARTITIONS and MESSAGE_PARTITIONS_AHEAD."""
+
+    global enabled, ahead, _app
+
+    enabled = app.config.get('MESSAGE_PARTITIONS', False)
+    ahead = app.config.get('MESSAGE_PARTITIONS_AHEAD', ahead)
+    _app = app
+
+    if enabled and not app.config.get('MESSAGE_SNOWFLAKE_IDS'):
+        raise RuntimeError("MESSAGE_PARTITIONS needs MESSAGE_SNOWFLAKE_IDS")
+
+    app.cli.add_command(partitions_cli)
+    if enabled:
+        app.before_request(_start_maintainer)
+
+
+def month_start(when, months=0):
+    """Return the first instant of the month `months` after `when`'s."""
+
+    index = when.year * 12 + when.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(start):
+    return f"messages_p{start:%Y%m}"
+
+
+def _postgres(bind):
+    return bind.dialect.name == 'postgresql'
+
+
+@event.listens_for(Message.__table__, 'before_create')
+def _partition_by(table, connection, **kw):
+    table.dialect_options['postgresql']['partition_by'] = (
+        'RANGE (id)' if enabled and _postgres(connection) else None)
+
+
+@event.listens_for(Message.__table__, 'after_create')
+def _create_partitions(table, connection, **kw):
+    if enabled and _postgres(connection):
+        first = month_start(datetime.utcnow())
+        connection.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {HISTORY} PARTITION OF messages "
+            f"FOR VALUES FROM (MINVALUE) TO ({min_id_for(first)})"))
+        ensure(connection)
+
+
+def ensure(connection, months=None):
+    """Create missing partitions through `months` (default `ahead`) from now.
+
+    Returns the names of the partitions created.
+    """
+
+    months = ahead if months is None else months
+    existing = set(existing_partitions(connection))
+    created = []
+
+    for offset in range(months + 1):
+        start = month_start(datetime.utcnow(), offset)
+        name = partition_name(start)
+        if name in existing:
+            continue
+        connection.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF messages "
+            f"FOR VALUES FROM ({min_id_for(start)}) "
+            f"TO ({min_id_for(month_start(start, 1))})"))
+        created.append(name)
+
+    return created
+
+
+def is_partitioned(connection):
+    """Return whether `messages` was created partitioned."""
+
+    return bool(connection.execute(text(
+        "SELECT relkind = 'p' FROM pg_class WHERE relname = 'messages'"))
+        .scalar())
+
+
+def existing_partitions(connection):
+    """Return the names of the partitions of `messages`."""
+
+    rows = connection.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE parent.relname = 'messages' ORDER BY child.relname"))
+    return [name for name, in rows]
+
+
+def _ensure_now():
+    with db.engine.begin() as connection:
+        if is_partitioned(connection):
+            ensure(connection)
+
+
+def _start_maintainer():
+    # once per worker process, on its first request
+    global _maintainer, _maintainer_pid
+
+    if _maintainer_pid == os.getpid():
+        return
+
+    with _lock:
+        if _maintainer_pid != os.getpid():
+            _maintainer_pid = os.getpid()
+            try:
+                _ensure_now()
+            except Exception:
+                logger.exception("Could not create message partitions")
+            _maintainer = PeriodicTask(_app, _ensure_now,
+                                       MAINTENANCE_INTERVAL,
+                                       'message-partitions')
+            _maintainer.start()
+
+
+partitions_cli = AppGroup('partitions',
+                          help="Manage monthly messages partitions.")
+
+
+@partitions_cli.command('ensure')
+@click.option('--ahead', 'months', type=int, default=None,
+              help="Months to create beyond the current one.")
+def ensure_command(months):
+    """Create missing monthly partitions."""
+
+    if not _postgres(db.engine):
+        raise click.ClickException("Partitioning needs PostgreSQL.")
+
+    with db.engine.begin() as connection:
+        if not is_partitioned(connection):
+            raise click.ClickException("messages is not partitioned.")
+        created = ensure(connection, months)
+    click.echo(f"Created {', '.join(created)}." if created
+               else "All partitions exist.")
+
+
+@partitions_cli.command('list')
+def list_command():
+    """List the partitions of the messages table."""
+
+    if not _postgres(db.engine):
+        raise click.ClickException("Partitioning needs PostgreSQL.")
+
+    with db.engine.connect() as connection:
+        for name in existing_partitions(connection):
+            click.echo(name)
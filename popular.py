@@ -0,0 +1,220 @@
+"""Popular messages, ranked by time-decayed like velocity.
+
+A like loses half its weight every POPULAR_HALF_LIFE_HOURS, and likes
+older than POPULAR_WINDOW_HOURS don't count at all.
+
+Scores use forward decay: a like made at time t weighs
+2 ** ((t - LANDMARK) / half_life) and a message's score is the log2 of
+the sum of its weights. Dividing every sum by the same
+2 ** ((now - LANDMARK) / half_life) gives the usual decayed count, so the
+ranking doesn't drift as time passes. A score only has to change when
+its message's likes do.
+
+- `rescore` recomputes the messages touched by a like flush (see
+  likes.py), in the same transaction.
+- `recompute` rebuilds `message_scores` from the likes of the window every
+  POPULAR_RECOMPUTE_SECONDS, dropping messages whose likes all aged out.
+  Every worker schedules it, but only one runs it: on PostgreSQL the
+  worker holding a session advisory lock (RECOMPUTE_LOCK), which passes
+  to another worker when its holder exits. `flask recompute-popular`
+  runs it on demand.
+- `top` serves the top POPULAR_SIZE ids from memory and re-reads them
+  off the score index every POPULAR_REFRESH_SECONDS. The page costs the
+  same however many messages there are.
+"""
+
+import math
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import exists, func, literal, select
+from sqlalchemy.exc import DBAPIError
+
+from accesslog import cache_result
+from background import PeriodicTask
+from models import db, upsert, Likes, MessageScore
+
+LANDMARK = datetime(2020, 1, 1)
+
+# PostgreSQL advisory lock key of the worker that runs `recompute`.
+RECOMPUTE_LOCK = 0x706f70756c6172
+
+
+def decayed_score(timestamps, half_life):
+    """Return the log2 forward-decayed score of likes made at `timestamps`.
+
+    `half_life` is a timedelta.
+    """
+
+    exponents = [(when - LANDMARK) / half_life for when in timestamps]
+    top = max(exponents)
+    return top + math.log2(sum(2 ** (x - top) for x in exponents))
+
+
+class PopularFeed:
+    """Like-velocity scores and the precomputed top of the ranking."""
+
+    def __init__(self):
+        self.app = None
+        self.half_life = timedelta(hours=6)
+        self.window = timedelta(hours=48)
+        self.size = 100
+        self.refresh = 30
+        self.interval = 3600
+        self._top = []
+        self._expires = 0.0
+        self._lock = threading.Lock()
+        self._recomputer = None
+        self._leader = None
+
+    def init_app(self, app):
+        """Read the POPULAR_* settings."""
+
+        self.app = app
+        self.half_life = timedelta(
+            hours=app.config.get('POPULAR_HALF_LIFE_HOURS', 6))
+        self.window = timedelta(hours=app.config.get('POPULAR_WINDOW_HOURS',
+                                                     48))
+        self.size = app.config.get('POPULAR_SIZE', self.size)
+        self.refresh = app.config.get('POPULAR_REFRESH_SECONDS', self.refresh)
+        self.interval = app.config.get('POPULAR_RECOMPUTE_SECONDS',
+                                       self.interval)
+
+        app.cli.add_command(recompute_popular_command)
+
+    def _scores(self, message_ids=None):
+        """Return {message_id: score} from the likes of the window."""
+
+        query = (db.session
+                 .query(Likes.message_id, Likes.timestamp)
+                 .filter(Likes.timestamp >= datetime.utcnow() - self.window))
+        if message_ids is not None:
+            query = query.filter(Likes.message_id.in_(message_ids))
+
+        timestamps = defaultdict(list)
+        for msg_id, when in query:
+            timestamps[msg_id].append(when)
+
+        return {msg_id: decayed_score(times, self.half_life)
+                for msg_id, times in timestamps.items()}
+
+    def rescore(self, message_ids):
+        """Recompute the scores of `message_ids` in the current session."""
+
+        if not message_ids:
+            return
+
+        scores = self._scores(message_ids)
+        unliked = set(message_ids) - scores.keys()
+
+        upsert(MessageScore.__table__,
+               [dict(message_id=msg_id, score=score)
+                for msg_id, score in scores.items()])
+        if unliked:
+            db.session.execute(MessageScore.__table__.delete().where(
+                MessageScore.message_id.in_(unliked)))
+
+        self._start_recomputer()
+
+    def recompute(self):
+        """Rebuild every score from the likes of the window.
+
+        Scores are upserted in place, so `rescore` running meanwhile never
+        sees the table empty or collides with a re-inserted row.
+        """
+
+        cutoff = datetime.utcnow() - self.window
+        scores = self._scores()
+
+        upsert(MessageScore.__table__,
+               [dict(message_id=msg_id, score=score)
+                for msg_id, score in scores.items()])
+        db.session.execute(MessageScore.__table__.delete().where(~exists()
+            .where(Likes.message_id == MessageScore.message_id)
+            .where(Likes.timestamp >= cutoff)))
+        db.session.commit()
+        self._expires = 0.0
+
+    def leads(self):
+        """Whether this process is the one that runs the periodic
+        `recompute`.
+
+        On PostgreSQL that is the process holding RECOMPUTE_LOCK on a
+        connection of its own, kept open while it lives. Elsewhere
+        there's a single database user and it always leads.
+        """
+
+        engine = db.get_engine(self.app)
+        if engine.dialect.name != 'postgresql':
+            return True
+
+        if self._leader is not None:
+            try:
+                self._leader.scalar(select([literal(1)]))
+                return True
+            except DBAPIError:
+                # the connection, and the lock with it, is gone
+                self._leader.close()
+                self._leader = None
+
+        conn = engine.connect()
+        if conn.scalar(select([func.pg_try_advisory_lock(RECOMPUTE_LOCK)])):
+            self._leader = conn
+            return True
+        conn.close()
+        return False
+
+    def _recompute_if_leading(self):
+        if self.leads():
+            self.recompute()
+
+    def top(self):
+        """Return the ids of the most popular messages, best first."""
+
+        self._start_recomputer()
+
+        fresh = time.monotonic() < self._expires
+        cache_result('popular', fresh)
+        if not fresh:
+            ids = [msg_id for msg_id, in (db.session
+                                          .query(MessageScore.message_id)
+                                          .order_by(MessageScore.score.desc())
+                                          .limit(self.size))]
+            with self._lock:
+                self._top = ids
+                self._expires = time.monotonic() + self.refresh
+
+        return self._top
+
+    def forget(self, message_id):
+        """Drop a deleted message from the cached top."""
+
+        with self._lock:
+            self._top = [msg_id for msg_id in self._top
+                         if msg_id != message_id]
+
+    def _start_recomputer(self):
+        if not self.interval or self._recomputer is not None:
+            return
+
+        with self._lock:
+            if self._recomputer is None:
+                self._recomputer = PeriodicTask(self.app,
+                                                self._recompute_if_leading,
+                                                self.interval,
+                                                'popular-recompute')
+                self._recomputer.start()
+
+
+popular = PopularFeed()
+
+
+@click.command('recompute-popular')
+def recompute_popular_command():
+    """Rebuild the popular-message scores from recent likes."""
+
+    popular.recompute()
+    click.echo(f"Scored {MessageScore.query.count()} messages.")
@@ -0,0 +1,249 @@
+"""On-demand request profiler.
+
+A request is profiled when any of these hold:
+
+- a random draw falls under PROFILER_SAMPLE_RATE (0 disables sampling)
+- it carries an `X-Warbler-Profile` header with a token from
+  `flask profiler token`
+- an operator turned sampling on at runtime with `flask profiler on`,
+  which every worker picks up within PROFILER_RECHECK_SECONDS
+
+Each profile is written to PROFILER_DIR, named after the time, route,
+query count and user id, e.g.
+`20201019T101500-warbler.homepage-q4-u17-38ms-1234.prof`. Only the newest
+PROFILER_KEEP files are kept.
+
+PROFILER_FORMAT picks the output:
+
+- 'pstats': cProfile data, for `python -m pstats`, snakeviz or flameprof
+- 'collapsed': stacks sampled every PROFILER_INTERVAL seconds, one
+  `frame;frame;frame count` line each, ready for flamegraph.pl or
+  speedscope
+
+When no request is selected the cost is a couple of attribute checks.
+"""
+
+import cProfile
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+import click
+from flask import current_app, g, request
+from flask.cli import AppGroup
+from itsdangerous import BadSignature, TimestampSigner
+
+import sqlstats
+
+HEADER = 'X-Warbler-Profile'
+
+# Name of the runtime toggle file inside PROFILER_DIR.
+RATE_FILE = 'sample-rate'
+
+
+class RequestProfiler:
+    """Decide which requests to profile and write their profiles out."""
+
+    def __init__(self):
+        self.directory = None
+        self.rate = 0.0
+        self.keep = 200
+        self.format = 'pstats'
+        self.interval = 0.005
+        self.token_max_age = 3600
+        self.recheck = 5.0
+        self._configured_rate = 0.0
+        self._next_check = 0.0
+
+    def init_app(self, app):
+        """Read PROFILER_* settings and install the request hooks."""
+
+        self.directory = app.config.get('PROFILER_DIR') or os.path.join(
+            app.instance_path, 'profiles')
+        self._configured_rate = self.rate = app.config.get(
+            'PROFILER_SAMPLE_RATE', 0.0)
+        self.keep = app.config.get('PROFILER_KEEP', self.keep)
+        self.format = app.config.get('PROFILER_FORMAT', self.format)
+        self.interval = app.config.get('PROFILER_INTERVAL', self.interval)
+        self.recheck = app.config.get('PROFILER_RECHECK_SECONDS',
+                                      self.recheck)
+
+        app.before_request(self.start)
+        app.after_request(self.finish)
+        app.cli.add_command(profiler_cli)
+
+    # Selection ############################################################
+
+    def _current_rate(self):
+        """Return the sample rate, re-reading the toggle file now and then."""
+
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + self.recheck
+            try:
+                with open(os.path.join(self.directory, RATE_FILE)) as f:
+                    self.rate = float(f.read().strip() or 0)
+            except (OSError, ValueError):
+                self.rate = self._configured_rate
+        return self.rate
+
+    def _wanted(self):
+        token = request.headers.get(HEADER)
+        if token is not None:
+            return self.check_token(token)
+
+        rate = self._current_rate()
+        return rate > 0 and random.random() < rate
+
+    def _signer(self):
+        return TimestampSigner(current_app.config['SECRET_KEY'],
+                               salt='warbler-profiler')
+
+    def make_token(self):
+        """Return a header value that turns profiling on for a request."""
+
+        return self._signer().sign(b'profile').decode('ascii')
+
+    def check_token(self, token):
+        try:
+            self._signer().unsign(token, max_age=self.token_max_age)
+        except BadSignature:
+            return False
+        return True
+
+    # Request hooks ########################################################
+
+    def start(self):
+        if not self._wanted():
+            return
+
+        if self.format == 'collapsed':
+            g.profiler = StackSampler(threading.get_ident(), self.interval)
+        else:
+            g.profiler = cProfile.Profile()
+        g.profiler_start = time.perf_counter()
+        g.profiler.enable()
+
+    def finish(self, response):
+        profile = g.pop('profiler', None)
+        if profile is None:
+            return response
+
+        profile.disable()
+        elapsed_ms = (time.perf_counter() - g.profiler_start) * 1000
+        user = getattr(g, 'user', None)
+
+        name = "{when}-{route}-q{queries}-u{user}-{ms:.0f}ms-{pid}".format(
+            when=datetime.utcnow().strftime('%Y%m%dT%H%M%S'),
+            route=request.endpoint or 'none',
+            queries=sqlstats.current().count,
+            user=user.id if user else 'anon',
+            ms=elapsed_ms,
+            pid=os.getpid())
+
+        os.makedirs(self.directory, exist_ok=True)
+        if self.format == 'collapsed':
+            path = os.path.join(self.directory, name + '.collapsed')
+            profile.dump(path)
+        else:
+            path = os.path.join(self.directory, name + '.prof')
+            profile.dump_stats(path)
+
+        self._rotate()
+        return response
+
+    def _rotate(self):
+        """Delete all but the newest `keep` profiles."""
+
+        entries = [entry for entry in os.scandir(self.directory)
+                   if entry.name.endswith(('.prof', '.collapsed'))]
+        if len(entries) <= self.keep:
+            return
+
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - self.keep]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+
+class StackSampler:
+    """Sample one thread's Python stack at a fixed interval.
+
+    Has the same enable/disable interface as `cProfile.Profile`.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='stack-sampler')
+
+    def enable(self):
+        self._thread.start()
+
+    def disable(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} "
+                             f"({os.path.basename(code.co_filename)}"
+                             f":{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def dump(self, path):
+        """Write the samples in collapsed-stack format."""
+
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+profiler = RequestProfiler()
+
+profiler_cli = AppGroup('profiler', help="Control the request profiler.")
+
+
+@profiler_cli.command('token')
+def token_command():
+    """Print a token for the X-Warbler-Profile header."""
+
+    click.echo(profiler.make_token())
+
+
+@profiler_cli.command('on')
+@click.option('--rate', default=1.0, show_default=True,
+              help="Fraction of requests to profile.")
+def on_command(rate):
+    """Profile a fraction of requests in every worker."""
+
+    os.makedirs(profiler.directory, exist_ok=True)
+    with open(os.path.join(profiler.directory, RATE_FILE), 'w') as f:
+        f.write(str(rate))
+    click.echo(f"Profiling {rate:.0%} of requests.")
+
+
+@profiler_cli.command('off')
+def off_command():
+    """Go back to the configured PROFILER_SAMPLE_RATE."""
+
+    try:
+        os.remove(os.path.join(profiler.directory, RATE_FILE))
+    except FileNotFoundError:
+        pass
+    click.echo("Runtime profiling off.")
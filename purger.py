@@ -0,0 +1,163 @@
+"""Background purge of deleted messages.
+
+Deleting a message only sets its `deleted_at` (one UPDATE on the request
+path); every read filters on `Message.not_deleted()` and the read
+indexes are partial, so the message is gone from every page at once.
+The rows are removed later, along with the likes, tags, mentions and
+score that reference them:
+
+- `purge_batch` hard-deletes up to PURGE_BATCH messages per transaction,
+  oldest deletion first. On PostgreSQL the batch is claimed with
+  FOR UPDATE SKIP LOCKED, so workers purging at once never wait on each
+  other.
+- `run` purges batch after batch, PURGE_PAUSE_SECONDS apart, at most
+  PURGE_MAX_BATCHES per run. It stops as soon as this worker is serving
+  more than PURGE_BUSY_REQUESTS requests, so purging only uses the quiet
+  moments. A mass deletion is worked off a bounded batch at a time
+  instead of in one long transaction holding locks on millions of rows.
+
+Each worker runs the purger every PURGE_INTERVAL_SECONDS; 0 turns that
+off. `flask purge-messages` purges everything right away.
+"""
+
+import os
+import threading
+import time
+
+import click
+from flask import g
+
+from background import PeriodicTask
+from models import db, Likes, Mention, Message, MessageScore, MessageTag
+
+# Rows referencing messages, deleted before the messages themselves.
+REFERENCES = (Likes.message_id, MessageTag.message_id, Mention.message_id,
+              MessageScore.message_id)
+
+
+class MessagePurger:
+    """Hard-delete soft-deleted messages in bounded batches."""
+
+    def __init__(self):
+        self.app = None
+        self.batch = 500
+        self.interval = 60
+        self.pause = 0.2
+        self.max_batches = 50
+        self.busy_requests = 4
+        self._active = 0
+        self._lock = threading.Lock()
+        self._task = None
+        self._task_pid = None
+
+    def init_app(self, app):
+        """Read the PURGE_* settings and count the requests in flight."""
+
+        self.app = app
+        self.batch = app.config.get('PURGE_BATCH', self.batch)
+        self.interval = app.config.get('PURGE_INTERVAL_SECONDS',
+                                       self.interval)
+        self.pause = app.config.get('PURGE_PAUSE_SECONDS', self.pause)
+        self.max_batches = app.config.get('PURGE_MAX_BATCHES',
+                                          self.max_batches)
+        self.busy_requests = app.config.get('PURGE_BUSY_REQUESTS',
+                                            self.busy_requests)
+
+        app.before_request(self._started)
+        app.teardown_request(self._finished)
+        app.cli.add_command(purge_messages_command)
+
+    # Request hooks ########################################################
+
+    def _started(self):
+        with self._lock:
+            self._active += 1
+        # requests answered by an earlier hook never get here, but still
+        # reach teardown
+        g.purger_counted = True
+        self._start_task()
+
+    def _finished(self, exc):
+        if g.pop('purger_counted', False):
+            with self._lock:
+                self._active -= 1
+
+    def busy(self):
+        """Return whether this worker has too many requests in flight."""
+
+        return self._active > self.busy_requests
+
+    # Purging ##############################################################
+
+    def purge_batch(self):
+        """Hard-delete one batch of deleted messages; return how many."""
+
+        query = (db.session
+                 .query(Message.id)
+                 .filter(Message.deleted_at.isnot(None))
+                 .order_by(Message.deleted_at)
+                 .limit(self.batch))
+        if db.engine.dialect.name == 'postgresql':
+            query = query.with_for_update(skip_locked=True)
+
+        ids = [msg_id for msg_id, in query]
+        if not ids:
+            db.session.commit()
+            return 0
+
+        for column in REFERENCES:
+            db.session.execute(column.table.delete().where(column.in_(ids)))
+        db.session.execute(Message.__table__.delete().where(
+            Message.id.in_(ids)))
+        db.session.commit()
+
+        return len(ids)
+
+    def run(self, max_batches=None, yield_to_requests=True):
+        """Purge batches until none are left; return how many messages.
+
+        Stops after `max_batches` (default PURGE_MAX_BATCHES, 0 for no
+        limit) and, with `yield_to_requests`, when the worker gets busy.
+        """
+
+        if max_batches is None:
+            max_batches = self.max_batches
+        purged = batches = 0
+
+        while not max_batches or batches < max_batches:
+            if yield_to_requests and self.busy():
+                break
+            if batches and self.pause:
+                time.sleep(self.pause)
+
+            count = self.purge_batch()
+            purged += count
+            batches += 1
+            if count < self.batch:
+                break
+
+        return purged
+
+    def _start_task(self):
+        # once per process: warmup requests reach the master before it
+        # forks, and threads don't survive the fork
+        if not self.interval or self._task_pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._task_pid != os.getpid():
+                self._task_pid = os.getpid()
+                self._task = PeriodicTask(self.app, self.run, self.interval,
+                                          'message-purger')
+                self._task.start()
+
+
+purger = MessagePurger()
+
+
+@click.command('purge-messages')
+def purge_messages_command():
+    """Hard-delete every deleted message now."""
+
+    purged = purger.run(max_batches=0, yield_to_requests=False)
+    click.echo(f"Purged {purged} messages.")
@@ -0,0 +1,57 @@
+"""Cache of compiled hot-path queries.
+
+The handful of queries every request runs (current user, feed, profile
+messages, login lookup, like lookup) are written as SQLAlchemy baked
+queries: the Query object is built and compiled to SQL once per process,
+then reused with new bound parameters, instead of being rebuilt from
+scratch each time.
+
+Functions that run such queries are marked with `@hot_query`, which
+lists them in `HOT_QUERIES`. Setting QUERY_CACHE = False rebuilds every
+query on each call, for comparison (see benchmarks/query_cache.py).
+"""
+
+from sqlalchemy.ext import baked
+
+bakery = baked.bakery(size=500)
+
+enabled = True
+
+# '<module>.<function>' -> function, for every registered hot query
+HOT_QUERIES = {}
+
+
+def init_app(app):
+    """Read QUERY_CACHE from the app config."""
+
+    global enabled
+    enabled = app.config.get('QUERY_CACHE', True)
+
+
+def bake(build):
+    """Start a baked query from `build(session)`.
+
+    With the cache disabled the query is spoiled, so it is built and
+    compiled on every call like a plain Query.
+    """
+
+    bq = bakery(build)
+    if not enabled:
+        bq.spoil(full=True)
+    return bq
+
+
+def hot_query(func):
+    """Register `func` as a hot-path query function."""
+
+    HOT_QUERIES[f"{func.__module__}.{func.__qualname__}"] = func
+    return func
+
+
+def stats():
+    """Return the registered query names and how many SQL forms are cached."""
+
+    return {
+        'queries': sorted(HOT_QUERIES),
+        'cached': len(bakery.cache),
+    }
@@ -0,0 +1,327 @@
+"""Lightweight read models for list views.
+
+The feed, profile, likes, follow lists and user directory only show a
+handful of columns. These helpers select just those columns and return
+named tuples instead of `User`/`Message` entities, so list pages don't
+load passwords, emails and bios they never display or pay for ORM
+identity-map bookkeeping on every row.
+
+Field names match the entity attributes the templates already use
+(`msg.user.username`, `user.image_url`, ...).
+
+The per-request queries are baked (see querycache.py).
+"""
+
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+from sqlalchemy import and_, bindparam, func, select
+
+from models import (
+    db, message_ids, Follows, Likes, Mention, Message, MessageTag, User)
+from snowflake import min_id_for
+from querycache import bake, hot_query
+
+
+class Author(NamedTuple):
+    """The part of a user shown next to their messages."""
+
+    id: int
+    username: str
+    image_url: Optional[str]
+
+
+class MessageRow(NamedTuple):
+    """A message as shown in timelines."""
+
+    id: int
+    text: str
+    timestamp: datetime
+    user: Author
+
+
+class UserCard(NamedTuple):
+    """A user as shown in the directory and follow lists."""
+
+    id: int
+    username: str
+    image_url: Optional[str]
+    header_image_url: Optional[str]
+    bio: Optional[str]
+
+
+class Profile(NamedTuple):
+    """A user as shown in the profile sidebar and the navigation bar."""
+
+    id: int
+    username: str
+    image_url: Optional[str]
+    header_image_url: Optional[str]
+    bio: Optional[str]
+    location: Optional[str]
+
+
+class UserStats(NamedTuple):
+    """Counts shown in the profile header and home sidebar."""
+
+    messages: int
+    following: int
+    followers: int
+    likes: int
+
+
+MESSAGE_COLUMNS = (Message.id, Message.text, Message.timestamp,
+                   User.id, User.username, User.image_url)
+
+CARD_COLUMNS = (User.id, User.username, User.image_url,
+                User.header_image_url, User.bio)
+
+PROFILE_COLUMNS = CARD_COLUMNS + (User.location,)
+
+
+def _message_query():
+    return (db.session
+            .query(*MESSAGE_COLUMNS)
+            .join(User, Message.user_id == User.id)
+            .filter(Message.not_deleted()))
+
+
+def _baked_message_query():
+    return bake(lambda s: s.query(*MESSAGE_COLUMNS)
+                .join(User, Message.user_id == User.id)
+                .filter(Message.not_deleted()))
+
+
+def _newest_first(bq):
+    # the ordering depends on whether snowflake ids are on, so that
+    # setting is part of the cache key
+    return bq.add_criteria(lambda q: q.order_by(*Message.newest_first()),
+                           message_ids.enabled)
+
+
+def _posted_since(bq):
+    # a bound on the primary key with snowflake ids, which lets PostgreSQL
+    # skip older monthly partitions (see partitions.py)
+    if message_ids.enabled:
+        bq += lambda q: q.filter(Message.id >= bindparam('since'))
+    else:
+        bq += lambda q: q.filter(Message.timestamp >= bindparam('since'))
+
+
+def _since_param(since):
+    if since is not None and message_ids.enabled:
+        return min_id_for(since)
+    return since
+
+
+def _message_rows(rows):
+    return [MessageRow(msg_id, text, timestamp,
+                       Author(user_id, username, image_url))
+            for msg_id, text, timestamp, user_id, username, image_url
+            in rows]
+
+
+def _cards(query):
+    return [UserCard(*row) for row in query]
+
+
+@hot_query
+def feed(user_ids, limit=100, since=None):
+    """Return the `limit` newest messages written by `user_ids`.
+
+    With `since` (a datetime) only messages posted from then on are read.
+    """
+
+    bq = _baked_message_query()
+    bq += lambda q: q.filter(
+        Message.user_id.in_(bindparam('user_ids', expanding=True)))
+    if since is not None:
+        _posted_since(bq)
+    _newest_first(bq)
+    bq += lambda q: q.limit(bindparam('limit'))
+
+    return _message_rows(bq(db.session()).params(user_ids=list(user_ids),
+                                                  since=_since_param(since),
+                                                  limit=limit))
+
+
+@hot_query
+def feed_since(user_ids, after, limit=100):
+    """Return messages by `user_ids` newer than the id `after`, newest first."""
+
+    bq = _baked_message_query()
+    bq += lambda q: q.filter(
+        Message.user_id.in_(bindparam('user_ids', expanding=True)),
+        Message.id > bindparam('after'))
+    _newest_first(bq)
+    bq += lambda q: q.limit(bindparam('limit'))
+
+    return _message_rows(bq(db.session()).params(user_ids=list(user_ids),
+                                                  after=after, limit=limit))
+
+
+def messages_by_ids(ids):
+    """Return rows for the message `ids`, in the order given."""
+
+    if not ids:
+        return []
+
+    by_id = {row.id: row for row in _message_rows(
+        _message_query().filter(Message.id.in_(ids)))}
+
+    return [by_id[msg_id] for msg_id in ids if msg_id in by_id]
+
+
+@hot_query
+def user_messages(user_id, before=None, limit=100, since=None):
+    """Return the newest messages of `user_id`, older than `before` if set.
+
+    With `since` (a datetime) only messages posted from then on are read.
+    """
+
+    bq = _baked_message_query()
+    bq += lambda q: q.filter(Message.user_id == bindparam('user_id'))
+    if before:
+        bq += lambda q: q.filter(Message.id < bindparam('before'))
+    if since is not None:
+        _posted_since(bq)
+    _newest_first(bq)
+    bq += lambda q: q.limit(bindparam('limit'))
+
+    return _message_rows(bq(db.session()).params(user_id=user_id,
+                                                  before=before,
+                                                  since=_since_param(since),
+                                                  limit=limit))
+
+
+@hot_query
+def message_author_id(message_id):
+    """Return the id of the author of `message_id`, or None."""
+
+    bq = bake(lambda s: s.query(Message.user_id))
+    bq += lambda q: q.filter(Message.id == bindparam('message_id'),
+                             Message.not_deleted())
+
+    return bq(db.session()).params(message_id=message_id).scalar()
+
+
+def tag_messages(tag, before=None, limit=100):
+    """Return the newest messages tagged `tag`, older than `before` if set.
+
+    Keyset pagination on the message id: each page starts below the last
+    id of the previous one, walking the (tag, message_id) key.
+    """
+
+    query = (_message_query()
+             .join(MessageTag, MessageTag.message_id == Message.id)
+             .filter(MessageTag.tag == tag))
+    if before:
+        query = query.filter(MessageTag.message_id < before)
+
+    return _message_rows(query.order_by(MessageTag.message_id.desc())
+                         .limit(limit))
+
+
+def mention_messages(user_id, before=None, limit=100):
+    """Return the newest messages mentioning `user_id`, like `tag_messages`."""
+
+    query = (_message_query()
+             .join(Mention, Mention.message_id == Message.id)
+             .filter(Mention.user_id == user_id))
+    if before:
+        query = query.filter(Mention.message_id < before)
+
+    return _message_rows(query.order_by(Mention.message_id.desc())
+                         .limit(limit))
+
+
+def liked_messages(user_id):
+    """Return the messages `user_id` liked, most recent like first."""
+
+    return _message_rows(_message_query()
+                         .join(Likes, Likes.message_id == Message.id)
+                         .filter(Likes.user_id == user_id)
+                         .order_by(Likes.id.desc()))
+
+
+@hot_query
+def liked_ids(user_id):
+    """Return the ids of the messages `user_id` liked."""
+
+    bq = bake(lambda s: s.query(Likes.message_id))
+    bq += lambda q: q.filter(Likes.user_id == bindparam('user_id'))
+
+    return {msg_id for msg_id, in bq(db.session()).params(user_id=user_id)}
+
+
+@hot_query
+def following_ids(user_id):
+    """Return the ids of the users `user_id` follows."""
+
+    bq = bake(lambda s: s.query(Follows.user_being_followed_id))
+    bq += lambda q: q.filter(
+        Follows.user_following_id == bindparam('user_id'))
+
+    return {uid for uid, in bq(db.session()).params(user_id=user_id)}
+
+
+@hot_query
+def profile(user_id):
+    """Return the `Profile` of `user_id`, or None."""
+
+    bq = bake(lambda s: s.query(*PROFILE_COLUMNS))
+    bq += lambda q: q.filter(User.id == bindparam('user_id'))
+
+    row = bq(db.session()).params(user_id=user_id).first()
+    return Profile(*row) if row else None
+
+
+def directory(search=None):
+    """Return user cards, optionally matching `search` in the username."""
+
+    query = db.session.query(*CARD_COLUMNS)
+    if search:
+        query = query.filter(User.username.like(f"%{search}%"))
+
+    return _cards(query)
+
+
+def following(user_id):
+    """Return cards for the users `user_id` follows."""
+
+    return _cards(db.session
+                  .query(*CARD_COLUMNS)
+                  .join(Follows, Follows.user_being_followed_id == User.id)
+                  .filter(Follows.user_following_id == user_id))
+
+
+def followers(user_id):
+    """Return cards for the users following `user_id`."""
+
+    return _cards(db.session
+                  .query(*CARD_COLUMNS)
+                  .join(Follows, Follows.user_following_id == User.id)
+                  .filter(Follows.user_being_followed_id == user_id))
+
+
+def _count(column, *criteria):
+    return (select([func.count()])
+            .where(and_(column == bindparam('user_id'), *criteria))
+            .as_scalar())
+
+
+@hot_query
+def user_stats(user_id):
+    """Return the message/following/followers/likes counts of `user_id`.
+
+    One round trip of four index-only counts, instead of loading every
+    related entity just to take its length.
+    """
+
+    bq = bake(lambda s: s.query(
+        _count(Message.user_id, Message.not_deleted()),
+        _count(Follows.user_following_id),
+        _count(Follows.user_being_followed_id),
+        _count(Likes.user_id)))
+
+    return UserStats(*bq(db.session()).params(user_id=user_id).one())
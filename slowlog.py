@@ -0,0 +1,270 @@
+"""Slow-query recorder.
+
+Every statement that takes longer than SLOW_QUERY_MS is recorded with
+its normalized SQL, its bound parameters (sensitive ones redacted), the
+route that ran it and, on PostgreSQL, an `EXPLAIN (ANALYZE, BUFFERS)`
+plan. Plans are captured on a background thread with its own connection
+so the request never waits for them.
+
+Records are kept in an in-memory ring of the last SLOW_QUERY_RING entries
+and appended as JSON lines to SLOW_QUERY_LOG; `flask slow-queries` prints
+the tail of that file.
+"""
+
+import json
+import logging
+import os
+import queue
+import re
+import threading
+from collections import deque
+from datetime import datetime
+from time import perf_counter
+
+import click
+from flask import has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Bind parameter names whose values never leave the process.
+SENSITIVE = re.compile(r'password|email|secret|token', re.IGNORECASE)
+REDACTED = '***'
+
+_WHITESPACE = re.compile(r'\s+')
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN \((?:[^()]*)\)', re.IGNORECASE)
+_WRITES = re.compile(r'\b(?:INSERT|UPDATE|DELETE)\b', re.IGNORECASE)
+_FROM = re.compile(r'\bFROM\b', re.IGNORECASE)
+# Functions EXPLAIN ANALYZE must not call again: locks, sequences, waits.
+_SIDE_EFFECTS = re.compile(
+    r'\b(?:pg_notify|pg_(?:try_)?advisory_\w+|nextval|setval|pg_sleep\w*)'
+    r'\s*\(', re.IGNORECASE)
+
+
+def normalize(statement):
+    """Collapse `statement` to a shape shared by all its executions.
+
+    Literals become `?` and IN-lists `(...)`, so the same query with
+    different values or list lengths normalizes to the same text.
+    """
+
+    sql = _WHITESPACE.sub(' ', statement).strip()
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    return _IN_LIST.sub('IN (...)', sql)
+
+
+def redact(parameters, names=None, many=False):
+    """Return `parameters` as JSON-friendly data with secrets masked.
+
+    `names` gives the bind names of positional parameters. With `many`
+    (executemany), `parameters` is a sequence of parameter sets and each
+    is masked; a sequence of mappings always is.
+    """
+
+    if isinstance(parameters, (list, tuple)) and (many or any(
+            isinstance(params, dict) for params in parameters)):
+        return [redact(params, names) for params in parameters]
+
+    if isinstance(parameters, dict):
+        return {key: REDACTED if SENSITIVE.search(key) else _plain(value)
+                for key, value in parameters.items()}
+
+    if isinstance(parameters, (list, tuple)):
+        names = names or ()
+        return [REDACTED if i < len(names) and SENSITIVE.search(names[i])
+                else _plain(value)
+                for i, value in enumerate(parameters)]
+
+    return _plain(parameters)
+
+
+def explainable(statement):
+    """Whether EXPLAIN ANALYZE may run `statement`: a SELECT that reads a
+    table and has no side effects (ANALYZE executes it).
+
+    FROM-less SELECTs only call functions, like `SELECT pg_notify(...)`
+    or `SELECT pg_try_advisory_lock(...)`; their plan is a bare Result
+    and running them again could take a lock or sleep a second time.
+    """
+
+    return (statement.lstrip()[:6].upper() == 'SELECT'
+            and _FROM.search(statement) is not None
+            and not _WRITES.search(statement)
+            and not _SIDE_EFFECTS.search(statement))
+
+
+def _plain(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+class SlowQueryLog:
+    """Record statements slower than a threshold."""
+
+    def __init__(self):
+        self.threshold = None
+        self.path = None
+        self.explain = True
+        self.ring = deque(maxlen=500)
+        self._forget_writer()
+
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._forget_writer)
+
+    def init_app(self, app):
+        """Read SLOW_QUERY_* settings and start listening.
+
+        - SLOW_QUERY_MS: threshold in ms; None turns the recorder off
+        - SLOW_QUERY_LOG: JSON lines file (default:
+          <instance>/slow-queries.log)
+        - SLOW_QUERY_RING: how many records to keep in memory
+        - SLOW_QUERY_EXPLAIN: capture plans on PostgreSQL
+        """
+
+        threshold = app.config.get('SLOW_QUERY_MS')
+        self.threshold = None if threshold is None else threshold / 1000
+        self.path = app.config.get('SLOW_QUERY_LOG') or os.path.join(
+            app.instance_path, 'slow-queries.log')
+        self.ring = deque(maxlen=app.config.get('SLOW_QUERY_RING', 500))
+        self.explain = app.config.get('SLOW_QUERY_EXPLAIN', True)
+
+        app.cli.add_command(slow_queries_command)
+
+        if not event.contains(Engine, 'after_cursor_execute',
+                              _after_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute',
+                         _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute',
+                         _after_cursor_execute)
+
+    def record(self, conn, statement, parameters, context, seconds):
+        names = getattr(getattr(context, 'compiled', None),
+                        'positiontup', None)
+        many = getattr(context, 'executemany', False)
+
+        entry = {
+            'time': datetime.utcnow().isoformat(),
+            'ms': round(seconds * 1000, 2),
+            'route': request.endpoint if has_request_context() else None,
+            'sql': normalize(statement),
+            'params': redact(parameters, names, many),
+            'plan': None,
+        }
+        self.ring.append(entry)
+
+        explain = (self.explain
+                   and conn.dialect.name == 'postgresql'
+                   and not many
+                   and explainable(statement))
+        job = (entry, conn.engine if explain else None, statement,
+               parameters)
+
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            logger.warning("Slow query log backlog full; dropping record")
+            return
+
+        self._start_writer()
+
+    def recent(self):
+        """Return the records in the ring, oldest first."""
+
+        return list(self.ring)
+
+    def _forget_writer(self):
+        # A forked child has no writer thread, and the parent's queue and
+        # lock may have been mid-use at the fork.
+        self._queue = queue.Queue(1000)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _start_writer(self):
+        # Started on first use so each forked worker gets its own.
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._write, daemon=True, name='slow-query-log')
+                self._thread.start()
+
+    def _write(self):
+        while True:
+            entry, engine, statement, parameters = self._queue.get()
+            if engine is not None:
+                entry['plan'] = _explain(engine, statement, parameters)
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(self.path, 'a') as f:
+                    f.write(json.dumps(entry) + '\n')
+            except OSError:
+                logger.exception("Could not write slow query log")
+
+
+def _explain(engine, statement, parameters):
+    """Return the EXPLAIN (ANALYZE, BUFFERS) plan of `statement` as text.
+
+    Uses a raw DBAPI connection, so the EXPLAIN itself is never timed or
+    recorded.
+    """
+
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + statement,
+                       parameters)
+        plan = '\n'.join(row[0] for row in cursor.fetchall())
+        conn.rollback()
+        return plan
+    except Exception as err:
+        conn.rollback()
+        return f"EXPLAIN failed: {err}"
+    finally:
+        conn.close()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    context._slow_query_start = perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    if slow_queries.threshold is None:
+        return
+
+    elapsed = perf_counter() - context._slow_query_start
+    if elapsed >= slow_queries.threshold:
+        slow_queries.record(conn, statement, parameters, context, elapsed)
+
+
+slow_queries = SlowQueryLog()
+
+
+@click.command('slow-queries')
+@click.option('-n', 'count', default=20, show_default=True,
+              help="How many records to show.")
+def slow_queries_command(count):
+    """Show the most recent slow queries."""
+
+    try:
+        with open(slow_queries.path) as f:
+            lines = deque(f, maxlen=count)
+    except FileNotFoundError:
+        click.echo("No slow queries recorded.")
+        return
+
+    for line in lines:
+        entry = json.loads(line)
+        click.echo(f"{entry['time']} {entry['ms']}ms "
+                   f"[{entry['route']}] {entry['sql']}")
+        click.echo(f"    params: {entry['params']}")
+        if entry['plan']:
+            for plan_line in entry['plan'].splitlines():
+                click.echo(f"    {plan_line}")
@@ -0,0 +1,150 @@
+"""Time-sortable 64-bit ids for messages.
+
+An id packs, from the most significant bit down:
+
+- 41 bits: milliseconds since `EPOCH` (good for ~69 years)
+- 10 bits: worker id
+- 12 bits: per-millisecond sequence
+
+so ids issued by any worker sort by creation time, and a feed or cursor
+can order and paginate on the primary key alone.
+"""
+
+import multiprocessing
+import os
+import time
+from datetime import datetime, timezone
+from threading import Lock
+
+# 2020-01-01T00:00:00Z
+EPOCH_MS = 1577836800000
+
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+SEQUENCE_MASK = (1 << SEQUENCE_BITS) - 1
+TIMESTAMP_SHIFT = WORKER_BITS + SEQUENCE_BITS
+
+
+class SnowflakeIds:
+    """Issue snowflake-style ids for one worker process.
+
+    Disabled until `init_app` sees `MESSAGE_SNOWFLAKE_IDS` in the config.
+    No two live processes may share a worker id:
+
+    - a standalone process uses `SNOWFLAKE_WORKER_ID`
+    - a worker process (forked, like a preloaded gunicorn worker, or
+      started by multiprocessing, like `uvicorn --workers`) would share
+      that setting with its siblings, so it forgets it and must be given
+      its own id with `assign_slot`. gunicorn.conf.py does: there
+      `SNOWFLAKE_WORKER_ID` is the base of the host's range and each live
+      worker holds a distinct slot in it
+
+    Issuing an id without a worker id raises RuntimeError rather than
+    guess one that may collide.
+    """
+
+    def __init__(self, worker_id=None, enabled=False):
+        self.enabled = enabled
+        self._configured_worker_id = worker_id
+        self._forked = False
+        self._lock = Lock()
+        self._reset()
+
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._forget_worker)
+
+    def init_app(self, app):
+        """Read `MESSAGE_SNOWFLAKE_IDS` and `SNOWFLAKE_WORKER_ID`."""
+
+        self.enabled = app.config.get('MESSAGE_SNOWFLAKE_IDS', False)
+        self._configured_worker_id = app.config.get('SNOWFLAKE_WORKER_ID')
+        self._reset()
+
+    def _reset(self):
+        self._worker_id = None
+        self._last_ms = -1
+        self._sequence = 0
+
+    def _forget_worker(self):
+        self._reset()
+        self._forked = True
+
+    def assign_slot(self, slot):
+        """Use worker id `SNOWFLAKE_WORKER_ID` (default 0) + `slot` in this
+        process; call after fork with a slot no live sibling holds."""
+
+        worker_id = int(self._configured_worker_id or 0) + slot
+        if not 0 <= worker_id <= MAX_WORKER_ID:
+            raise RuntimeError(f"Snowflake worker id {worker_id} is out of "
+                               f"range 0-{MAX_WORKER_ID}")
+        with self._lock:
+            self._reset()
+            self._worker_id = worker_id
+
+    @property
+    def worker_id(self):
+        if self._worker_id is None:
+            if self._forked or multiprocessing.parent_process():
+                raise RuntimeError(
+                    "This worker process has no snowflake worker id of its "
+                    "own; assign one with assign_slot when it starts (see "
+                    "gunicorn.conf.py)")
+            if self._configured_worker_id is None:
+                raise RuntimeError("Set SNOWFLAKE_WORKER_ID to issue "
+                                   "snowflake ids")
+            worker_id = int(self._configured_worker_id)
+            if not 0 <= worker_id <= MAX_WORKER_ID:
+                raise RuntimeError(f"SNOWFLAKE_WORKER_ID must be in range "
+                                   f"0-{MAX_WORKER_ID}")
+            self._worker_id = worker_id
+        return self._worker_id
+
+    def next_id(self):
+        """Return a new id, larger than every id this worker issued before."""
+
+        with self._lock:
+            now = _now_ms()
+
+            if now < self._last_ms:
+                # The clock stepped back; keep issuing from the last
+                # millisecond we used rather than risk duplicates.
+                now = self._last_ms
+
+            if now == self._last_ms:
+                self._sequence = (self._sequence + 1) & SEQUENCE_MASK
+                if self._sequence == 0:
+                    while now <= self._last_ms:
+                        now = _now_ms()
+            else:
+                self._sequence = 0
+
+            self._last_ms = now
+
+            return (((now - EPOCH_MS) << TIMESTAMP_SHIFT)
+                    | (self.worker_id << SEQUENCE_BITS)
+                    | self._sequence)
+
+
+def _now_ms():
+    return time.time_ns() // 1_000_000
+
+
+def timestamp_of(snowflake_id):
+    """Return the UTC creation time encoded in `snowflake_id`."""
+
+    ms = (snowflake_id >> TIMESTAMP_SHIFT) + EPOCH_MS
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+
+
+def min_id_for(when):
+    """Return the smallest id that could have been issued at `when`.
+
+    Useful as a cursor bound: `Message.id >= min_id_for(start)`.
+    """
+
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    ms = int(when.timestamp() * 1000)
+    return max(ms - EPOCH_MS, 0) << TIMESTAMP_SHIFT
@@ -0,0 +1,55 @@
+"""Per-request SQL statement counts and time.
+
+Listens on every SQLAlchemy engine and accumulates, for the current app
+context (one per request), how many statements ran and how long they
+took. Read the totals with `current()`.
+"""
+
+from time import perf_counter
+
+from flask import g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class SqlStats:
+    """Statement count and total seconds for one request."""
+
+    __slots__ = ('count', 'seconds')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+def current():
+    """Return the `SqlStats` of the current app context."""
+
+    stats = g.get('sql_stats')
+    if stats is None:
+        stats = g.sql_stats = SqlStats()
+    return stats
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    context._query_start = perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    elapsed = perf_counter() - context._query_start
+
+    if has_app_context():
+        stats = current()
+        stats.count += 1
+        stats.seconds += elapsed
+
+
+def init_app(app):
+    """Start counting statements (once per process)."""
+
+    if not event.contains(Engine, 'before_cursor_execute',
+                          _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
@@ -0,0 +1,154 @@
+"""Hashtag and mention indexing, and trending tags.
+
+`index_message` pulls `#tags` and `@mentions` out of a new message and
+writes them to the `message_tags` and `mentions` tables, which back the
+tag and mention timelines.
+
+Trending tags come from per-minute usage counts. Each worker counts tags
+in memory and every TRENDING_FLUSH_SECONDS appends its counts to the
+small `tag_buckets` table; the trending view sums the buckets of the last
+TRENDING_WINDOW_MINUTES. Old buckets are pruned on flush, so trends never
+need an aggregate over the messages table.
+"""
+
+import re
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+
+from markupsafe import Markup, escape
+from sqlalchemy import func
+
+from background import PeriodicTask
+from models import db, insert_ignore, Mention, MessageTag, TagBucket, User
+
+TAG_RE = re.compile(r'(?<![\w&#])#(\w{1,50})')
+MENTION_RE = re.compile(r'(?<![\w@])@(\w{1,50})')
+
+
+def extract(text):
+    """Return the (tags, usernames) used in `text`.
+
+    Tags are case-insensitive and returned lower-cased.
+    """
+
+    tags = {tag.lower() for tag in TAG_RE.findall(text)}
+    usernames = set(MENTION_RE.findall(text))
+    return tags, usernames
+
+
+def index_message(message):
+    """Record the tags and mentions of `message` in the current session.
+
+    `message` must have an id (flush it first). Returns the tags found.
+    """
+
+    tags, usernames = extract(message.text)
+
+    insert_ignore(MessageTag.__table__,
+                  [dict(tag=tag, message_id=message.id) for tag in tags])
+
+    if usernames:
+        user_ids = [uid for uid, in (db.session
+                                     .query(User.id)
+                                     .filter(User.username.in_(usernames)))]
+        insert_ignore(Mention.__table__,
+                      [dict(user_id=uid, message_id=message.id)
+                       for uid in user_ids])
+
+    return tags
+
+
+def linkify(text):
+    """Escape `text` and link its #tags and @mentions."""
+
+    html = str(escape(text))
+    html = TAG_RE.sub(
+        lambda m: f'<a href="/tags/{m.group(1).lower()}">#{m.group(1)}</a>',
+        html)
+    html = MENTION_RE.sub(
+        lambda m: f'<a href="/users?q={m.group(1)}">@{m.group(1)}</a>',
+        html)
+    return Markup(html)
+
+
+def _minute(when):
+    return when.replace(second=0, microsecond=0)
+
+
+class TrendingTags:
+    """Sliding-window tag counts, bucketed per minute."""
+
+    def __init__(self):
+        self.app = None
+        self.window = 60
+        self.interval = 60
+        self._counts = {}
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    def init_app(self, app):
+        """Read TRENDING_WINDOW_MINUTES and TRENDING_FLUSH_SECONDS."""
+
+        self.app = app
+        self.window = app.config.get('TRENDING_WINDOW_MINUTES', 60)
+        self.interval = app.config.get('TRENDING_FLUSH_SECONDS', 60)
+        app.add_template_filter(linkify, 'linkify')
+
+    def record(self, tags, when=None):
+        """Count one use of each of `tags`."""
+
+        if not tags:
+            return
+
+        minute = _minute(when or datetime.utcnow())
+        with self._lock:
+            self._counts.setdefault(minute, Counter()).update(tags)
+
+        if not self.interval:
+            self.flush()
+        else:
+            self._start_flusher()
+
+    def flush(self):
+        """Append the counted buckets to `tag_buckets`; prune old ones."""
+
+        with self._lock:
+            counts, self._counts = self._counts, {}
+
+        rows = [dict(minute=minute, tag=tag, count=count)
+                for minute, counter in counts.items()
+                for tag, count in counter.items()]
+        if rows:
+            db.session.bulk_insert_mappings(TagBucket, rows)
+
+        cutoff = _minute(datetime.utcnow()) - timedelta(minutes=self.window)
+        TagBucket.query.filter(TagBucket.minute < cutoff).delete()
+        db.session.commit()
+
+    def top(self, limit=10):
+        """Return [(tag, count)] for the busiest tags in the window."""
+
+        since = _minute(datetime.utcnow()) - timedelta(minutes=self.window)
+        total = func.sum(TagBucket.count).label('total')
+
+        return (db.session
+                .query(TagBucket.tag, total)
+                .filter(TagBucket.minute >= since)
+                .group_by(TagBucket.tag)
+                .order_by(total.desc(), TagBucket.tag)
+                .limit(limit)
+                .all())
+
+    def _start_flusher(self):
+        if self._flusher is not None:
+            return
+
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = PeriodicTask(self.app, self.flush,
+                                             self.interval, 'trending-flusher')
+                self._flusher.start()
+
+
+trending = TrendingTags()
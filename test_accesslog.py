@@ -0,0 +1,120 @@
+"""Access log tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_accesslog.py
+
+
+import json
+import os
+import queue
+import tempfile
+from unittest import TestCase
+
+os.environ.setdefault('DATABASE_URL', "postgresql:///warbler-test")
+
+from app import create_app, CURR_USER_KEY  # noqa: E402
+from accesslog import access_log, cache_result  # noqa: E402
+from models import db, User, Message, Follows, Notification  # noqa: E402
+
+app = create_app('test')
+db.create_all()
+
+
+class AccessLogTestCase(TestCase):
+    """Test the records, drops and rotation."""
+
+    def setUp(self):
+        Notification.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        user = User.signup('logger', 'logger@test.com', '123456', None)
+        db.session.commit()
+        self.user_id = user.id
+
+        self.dir = tempfile.TemporaryDirectory()
+        access_log.path = os.path.join(self.dir.name, 'access.log')
+        access_log.enabled = True
+        self.client = app.test_client()
+
+    def tearDown(self):
+        res = super().tearDown()
+        access_log.enabled = False
+        access_log.max_bytes = 100 * 2 ** 20
+        self.dir.cleanup()
+        db.session.rollback()
+        return res
+
+    def capture(self):
+        """Collect records here instead of queueing them."""
+
+        records = []
+        access_log.put = records.append
+        self.addCleanup(delattr, access_log, 'put')
+        return records
+
+    def lines(self, path=None):
+        with open(path or access_log.path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_record(self):
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.user_id
+
+        records = self.capture()
+        resp = self.client.get(f'/users/{self.user_id}')
+        record = records[-1]
+
+        self.assertEqual(record['method'], 'GET')
+        self.assertEqual(record['route'], 'warbler.users_show')
+        self.assertEqual(record['status'], 200)
+        self.assertEqual(record['user'], self.user_id)
+        self.assertGreater(record['queries'], 0)
+        self.assertGreater(record['ms'], 0)
+        self.assertEqual(record['bytes'], len(resp.data))
+        self.assertIn('images', record['cache'])
+
+    def test_cache_flags(self):
+        records = self.capture()
+        with app.test_request_context():
+            cache_result('a', True)
+            cache_result('b', False)
+            cache_result('c', True)
+            cache_result('c', False)
+            access_log.start()
+            access_log.finish(app.response_class(''))
+
+        self.assertEqual(records[0]['cache'],
+                         {'a': 'hit', 'b': 'miss', 'c': 'partial'})
+
+    def test_drops_when_full(self):
+        access_log._start_writer()
+        full = queue.Queue(1)
+        full.put({})
+        saved, access_log._queue = access_log._queue, full
+        dropped, access_log._unreported = access_log.dropped, 0
+        try:
+            access_log.put({'n': 1})
+            access_log.put({'n': 2})
+        finally:
+            access_log._queue = saved
+
+        self.assertEqual(access_log.dropped, dropped + 2)
+        access_log.write([{'n': 3}])
+        self.assertEqual([line.get('dropped') for line in self.lines()],
+                         [2, None])
+
+    def test_rotation(self):
+        access_log.max_bytes = 100
+        for n in range(access_log.backups + 3):
+            access_log.write([{'n': n, 'pad': 'x' * 100}])
+
+        self.assertFalse(os.path.exists(access_log.path))
+        self.assertEqual(self.lines(access_log.path + '.1'),
+                         [{'n': access_log.backups + 2, 'pad': 'x' * 100}])
+        self.assertTrue(os.path.exists(
+            f"{access_log.path}.{access_log.backups}"))
+        self.assertFalse(os.path.exists(
+            f"{access_log.path}.{access_log.backups + 1}"))
@@ -0,0 +1,139 @@
+"""Admission control tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_admission.py
+
+
+import os
+import tempfile
+import time
+from unittest import TestCase
+
+os.environ.setdefault('DATABASE_URL', "postgresql:///warbler-test")
+
+from flask import g  # noqa: E402
+
+from admission import admission  # noqa: E402
+from app import create_app  # noqa: E402
+from models import db  # noqa: E402
+
+app = create_app('test')
+db.create_all()
+
+
+class AdmissionTestCase(TestCase):
+    """Test token buckets, concurrency limits and shared counters."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        admission.configure({
+            'warbler.list_users': dict(rate=0.001, burst=2, concurrency=1),
+            'warbler.login': dict(rate=0.001, burst=1, concurrency=1,
+                                  methods=('POST',)),
+        }, os.path.join(self.tmp.name, 'admission.bin'))
+        self.client = app.test_client()
+
+    def tearDown(self):
+        admission.configure({}, None)
+        self.tmp.cleanup()
+
+    def stats(self, endpoint):
+        return next(row for row in admission.stats()
+                    if row.endpoint == endpoint)
+
+    def test_rate_limit(self):
+        """Is the request after the burst shed with a 429?"""
+
+        codes = [self.client.get('/users').status_code for _ in range(3)]
+
+        self.assertEqual(codes, [200, 200, 429])
+        resp = self.client.get('/users')
+        self.assertIn('Retry-After', resp.headers)
+
+        row = self.stats('warbler.list_users')
+        self.assertEqual((row.admitted, row.rate_limited, row.in_flight),
+                         (2, 2, 0))
+
+    def test_methods(self):
+        """Are only the listed methods limited?"""
+
+        for _ in range(3):
+            self.assertEqual(self.client.get('/login').status_code, 200)
+
+        self.client.post('/login', data={'username': 'x', 'password': 'y'})
+        resp = self.client.post('/login',
+                                data={'username': 'x', 'password': 'y'})
+        self.assertEqual(resp.status_code, 429)
+
+    def test_concurrency_limit_across_processes(self):
+        """Does a request in flight in another process cause a 503?"""
+
+        limit = admission.limits['warbler.list_users']
+        ready, done = os.pipe(), os.pipe()
+
+        pid = os.fork()
+        if pid == 0:
+            with admission._slot(limit) as (_, leases):
+                leases[0] = [os.getpid(), time.time()]
+            os.write(ready[1], b'x')
+            os.read(done[0], 1)
+            os._exit(0)
+
+        os.read(ready[0], 1)
+        self.assertEqual(self.client.get('/users').status_code, 503)
+        self.assertEqual(self.stats('warbler.list_users').overloaded, 1)
+        self.assertEqual(self.stats('warbler.list_users').in_flight, 1)
+
+        # the worker dies without releasing; its lease is reclaimed
+        os.write(done[1], b'x')
+        os.waitpid(pid, 0)
+        for fd in ready + done:
+            os.close(fd)
+
+        self.assertEqual(self.stats('warbler.list_users').in_flight, 0)
+        self.assertEqual(self.client.get('/users').status_code, 200)
+
+    def test_expired_leases_are_reclaimed(self):
+        """Does a request past its lease stop counting as in flight?"""
+
+        limit = admission.limits['warbler.list_users']
+        with admission._slot(limit) as (_, leases):
+            leases[0] = [os.getppid(), time.time() - limit.lease - 1]
+
+        self.assertEqual(self.client.get('/users').status_code, 200)
+
+        # a reclaimed lease handed out again isn't released by its old
+        # holder
+        with admission._slot(limit) as (_, leases):
+            leases[0] = [os.getppid(), time.time()]
+        with app.test_request_context('/users'):
+            g.admission_lease = (limit, 0, 1.0)
+            admission.release()
+        self.assertEqual(self.stats('warbler.list_users').in_flight, 1)
+
+    def test_layout_change_resets_file(self):
+        """Is a file laid out for other limits zeroed, not misread?"""
+
+        path = admission.path
+        self.client.get('/users')
+        self.assertEqual(self.stats('warbler.list_users').admitted, 1)
+
+        # a deploy with another concurrency moves the slots after it
+        admission.configure({
+            'warbler.list_users': dict(rate=0.001, burst=2, concurrency=3),
+            'warbler.login': dict(rate=0.001, burst=1, concurrency=1),
+        }, path)
+        self.assertEqual(self.stats('warbler.list_users').admitted, 0)
+        self.assertEqual(self.stats('warbler.login').admitted, 0)
+
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(len(admission.header)), admission.header)
+
+        # the same limits again keep their counters
+        self.client.get('/users')
+        admission.configure({
+            'warbler.list_users': dict(rate=0.001, burst=2, concurrency=3),
+            'warbler.login': dict(rate=0.001, burst=1, concurrency=1),
+        }, path)
+        self.assertEqual(self.stats('warbler.list_users').admitted, 1)
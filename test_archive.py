@@ -0,0 +1,198 @@
+"""Cold message archive tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_archive.py
+
+
+import os
+import tempfile
+from datetime import datetime, timedelta
+from unittest import TestCase, mock
+
+os.environ.setdefault('DATABASE_URL', "postgresql:///warbler-test")
+
+from app import create_app, CURR_USER_KEY  # noqa: E402
+import archive as archive_module  # noqa: E402
+from archive import archive  # noqa: E402
+from models import db, User, Message, Likes  # noqa: E402
+from readmodels import Author  # noqa: E402
+
+app = create_app('test')
+db.create_all()
+
+
+class ArchiveTestCase(TestCase):
+    """Test archiving old messages and reading through to them."""
+
+    def setUp(self):
+        Likes.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        self.tmp = tempfile.TemporaryDirectory()
+        archive.directory = self.tmp.name
+        archive._scanned = None
+        archive._segments = []
+        archive._forget_tombstones()
+
+        writer = User.signup('writer', 'writer@test.com', '123456', None)
+        other = User.signup('other', 'other@test.com', '123456', None)
+        db.session.commit()
+
+        start = datetime.utcnow() - timedelta(days=800)
+        db.session.add_all(
+            [Message(text=f"old {n}", user_id=writer.id,
+                     timestamp=start + timedelta(hours=n))
+             for n in range(300)] +
+            [Message(text=f"other old {n}", user_id=other.id,
+                     timestamp=start + timedelta(hours=n))
+             for n in range(50)] +
+            [Message(text=f"new {n}", user_id=writer.id) for n in range(5)])
+        liked = Message(text="liked old", user_id=writer.id, timestamp=start)
+        db.session.add(liked)
+        db.session.commit()
+        db.session.add(Likes(user_id=other.id, message_id=liked.id))
+        db.session.commit()
+
+        self.writer = Author(writer.id, writer.username, writer.image_url)
+        self.other_id = other.id
+        self.client = app.test_client()
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        for segment in archive._segments:
+            segment.close()
+        archive._segments = []
+        archive._scanned = None
+        self.tmp.cleanup()
+        return res
+
+    def test_run(self):
+        """Are old, unliked messages moved into one segment?"""
+
+        name, count = archive.run()
+
+        self.assertEqual(count, 350)
+        self.assertEqual(os.listdir(self.tmp.name), [name])
+        self.assertEqual(Message.query.count(), 6)
+        self.assertEqual(archive.count(self.writer.id), 300)
+
+        segment, = archive.segments()
+        self.assertEqual(len(segment.keys), 2)
+
+        self.assertEqual(archive.run(), (None, 0))
+
+    def test_keeps_rows_archivable_after_the_write(self):
+        """Is a message unliked while the segment is written left alone?"""
+
+        write_segment = archive_module._write_segment
+
+        def write_then_unlike(path, rows):
+            written = write_segment(path, rows)
+            Likes.query.delete()
+            db.session.commit()
+            return written
+
+        with mock.patch.object(archive_module, '_write_segment',
+                               write_then_unlike):
+            name, count = archive.run()
+
+        self.assertEqual(count, 350)
+        self.assertEqual(Message.query.filter_by(text="liked old").count(),
+                         1)
+
+    def test_user_messages(self):
+        """Are a user's archived messages read newest first, by cursor?"""
+
+        archive.run()
+
+        page = archive.user_messages(self.writer, limit=10)
+        self.assertEqual([m.text for m in page],
+                         [f"old {n}" for n in range(299, 289, -1)])
+        self.assertEqual({m.user for m in page}, {self.writer})
+
+        older = archive.user_messages(self.writer, before=page[-1].id,
+                                      limit=1000)
+        self.assertEqual(len(older), 290)
+        self.assertEqual(older[-1].text, "old 0")
+
+    def test_profile_reads_through(self):
+        """Does the profile page continue into the archive?"""
+
+        archive.run()
+
+        html = self.client.get(f'/users/{self.writer.id}').get_data(
+            as_text=True)
+        self.assertIn('new 4', html)
+        self.assertIn('old 299', html)
+        self.assertNotIn('other old', html)
+        self.assertIn('306', html)
+
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.other_id
+        page = archive.user_messages(self.writer, limit=100)
+        html = self.client.get(
+            f'/users/{self.writer.id}?before={page[-1].id}').get_data(
+            as_text=True)
+        self.assertIn('old 199', html)
+        self.assertNotIn('old 200<', html)
+
+    def login(self, user_id):
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = user_id
+
+    def test_delete_archived_message(self):
+        """Can an author delete an archived message, and only its
+        author?"""
+
+        archive.run()
+        newest, = archive.user_messages(self.writer, limit=1)
+
+        self.login(self.other_id)
+        resp = self.client.post(f'/messages/{newest.id}/delete')
+        self.assertEqual(resp.status_code, 404)
+
+        self.login(self.writer.id)
+        resp = self.client.post(f'/messages/{newest.id}/delete')
+        self.assertEqual(resp.status_code, 302)
+
+        self.assertEqual(archive.user_messages(self.writer, limit=1)[0].text,
+                         "old 298")
+        self.assertEqual(archive.count(self.writer.id), 299)
+        self.assertFalse(archive.holds(self.writer.id, newest.id))
+
+    def test_deleted_while_archiving(self):
+        """Does a message deleted during a run stay deleted?"""
+
+        write_segment = archive_module._write_segment
+
+        def write_then_delete(path, rows):
+            written = write_segment(path, rows)
+            Message.query.filter_by(text="old 299").update(
+                {'deleted_at': datetime.utcnow()})
+            db.session.commit()
+            return written
+
+        with mock.patch.object(archive_module, '_write_segment',
+                               write_then_delete):
+            archive.run()
+
+        self.assertEqual(Message.query.filter_by(text="old 299").count(), 0)
+        self.assertEqual(archive.user_messages(self.writer, limit=1)[0].text,
+                         "old 298")
+        self.assertEqual(archive.count(self.writer.id), 299)
+
+    def test_deleted_user(self):
+        """Are a deleted user's archived messages gone?"""
+
+        archive.run()
+        Likes.query.delete()
+        Message.query.delete()
+        db.session.commit()
+        self.login(self.writer.id)
+        self.client.post('/users/delete')
+
+        self.assertEqual(archive.user_messages(self.writer), [])
+        self.assertEqual(archive.count(self.writer.id), 0)
@@ -0,0 +1,261 @@
+"""Async read path tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_asyncreads.py
+
+
+import asyncio
+import importlib
+import os
+import time
+from unittest import TestCase, mock
+
+os.environ.setdefault('DATABASE_URL', "postgresql:///warbler-test")
+
+from accesslog import access_log  # noqa: E402
+from app import create_app, CURR_USER_KEY  # noqa: E402
+from asyncreads import ReadPath, WsgiFallback  # noqa: E402
+from models import db, User, Message, Follows, Likes  # noqa: E402
+from pagecache import page_cache  # noqa: E402
+
+app = create_app('test')
+db.create_all()
+
+
+async def fallback(scope, receive, send):
+    """Stands in for the Flask app behind the WSGI adapter."""
+
+    await send({'type': 'http.response.start', 'status': 299,
+                'headers': []})
+    await send({'type': 'http.response.body', 'body': b'fallback'})
+
+
+class AsyncReadsTestCase(TestCase):
+    """Test that the async pages match the sync ones."""
+
+    def setUp(self):
+        Likes.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+
+        author = User.signup('author', 'author@test.com', '123456', None)
+        fan = User.signup('fan', 'fan@test.com', '123456', None)
+        db.session.commit()
+        db.session.add(Follows(user_being_followed_id=author.id,
+                               user_following_id=fan.id))
+        for n in range(3):
+            db.session.add(Message(text=f"warble {n}", user_id=author.id))
+        db.session.commit()
+
+        self.author_id = author.id
+        self.fan_id = fan.id
+        self.read_path = ReadPath(app, fallback)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        return res
+
+    def cookie(self, user_id):
+        serializer = app.session_interface.get_signing_serializer(app)
+        return serializer.dumps({CURR_USER_KEY: user_id})
+
+    def get(self, path, user_id=None, query=b''):
+        """Return (status, body) of GET `path` through the ASGI app."""
+
+        headers = [(b'host', b'localhost')]
+        if user_id is not None:
+            headers.append((b'cookie', f"session={self.cookie(user_id)}"
+                            .encode()))
+        scope = {'type': 'http', 'method': 'GET', 'path': path,
+                 'query_string': query, 'headers': headers,
+                 'scheme': 'http', 'root_path': ''}
+        sent = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            sent.append(message)
+
+        async def run():
+            try:
+                await self.read_path(scope, receive, send)
+            finally:
+                await self.read_path.reads.close()
+
+        asyncio.run(run())
+        return sent[0]['status'], b''.join(message.get('body', b'')
+                                           for message in sent[1:])
+
+    def sync_get(self, path, user_id):
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = user_id
+        return self.client.get(path).data
+
+    def test_home(self):
+        status, body = self.get('/', self.fan_id)
+
+        self.assertEqual(status, 200)
+        self.assertIn(b'warble 2', body)
+        self.assertEqual(body, self.sync_get('/', self.fan_id))
+
+    def test_profile(self):
+        status, body = self.get(f'/users/{self.author_id}', self.fan_id)
+
+        self.assertEqual(status, 200)
+        self.assertIn(b'Unfollow', body)
+        self.assertEqual(body, self.sync_get(f'/users/{self.author_id}',
+                                             self.fan_id))
+
+    def test_profile_paging(self):
+        newest = Message.query.filter_by(text='warble 2').one().id
+        status, body = self.get(f'/users/{self.author_id}',
+                                query=f'before={newest}'.encode())
+
+        self.assertEqual(status, 200)
+        self.assertIn(b'warble 1', body)
+        self.assertNotIn(b'warble 2', body)
+
+    def test_fallback(self):
+        # anonymous home and other routes go to Flask
+        self.assertEqual(self.get('/'), (299, b'fallback'))
+        self.assertEqual(self.get('/users/profile', self.fan_id),
+                         (299, b'fallback'))
+
+        # unknown users get the sync view's answer
+        self.assertEqual(self.get('/users/0', self.fan_id)[0], 404)
+
+    def test_request_hooks_run(self):
+        """Is an async page logged once, like any other request?"""
+
+        records = []
+        access_log.put = records.append
+        self.addCleanup(delattr, access_log, 'put')
+        access_log.enabled = True
+        self.addCleanup(setattr, access_log, 'enabled', False)
+
+        self.get(f'/users/{self.author_id}', self.fan_id)
+
+        [record] = records
+        self.assertEqual(record['route'], 'warbler.users_show')
+        self.assertEqual(record['status'], 200)
+        self.assertEqual(record['user'], self.fan_id)
+
+    def test_page_cache(self):
+        """Are anonymous profiles served from and stored in the page
+        cache, shared with the sync path?"""
+
+        page_cache.clear()
+        page_cache.enabled = True
+        self.addCleanup(page_cache.clear)
+        self.addCleanup(setattr, page_cache, 'enabled', False)
+
+        path = f'/users/{self.author_id}'
+        sync_body = self.client.get(path).data
+        Message.query.delete()
+        db.session.commit()
+
+        self.assertEqual(self.get(path), (200, sync_body))
+
+        # and the other way round
+        page_cache.clear()
+        self.assertEqual(self.get(path)[0], 200)
+        db.session.add(Message(text="fresh warble", user_id=self.author_id))
+        db.session.commit()
+        self.assertNotIn(b'fresh warble', self.client.get(path).data)
+
+    def test_errors_render_the_500_page(self):
+        app.config['PROPAGATE_EXCEPTIONS'] = False
+        self.addCleanup(app.config.__setitem__, 'PROPAGATE_EXCEPTIONS',
+                        None)
+
+        with mock.patch.object(self.read_path.reads, 'user_stats',
+                               side_effect=RuntimeError("boom")):
+            status, body = self.get(f'/users/{self.author_id}')
+
+        self.assertEqual(status, 500)
+        self.assertIn(b'Internal Server Error', body)
+
+    def test_asgi_entry_point(self):
+        with mock.patch.dict(os.environ, WARBLER_PROFILE='test'):
+            asgi = importlib.import_module('asgi')
+
+        self.assertIsInstance(asgi.application, ReadPath)
+        self.assertIsInstance(asgi.application.fallback, WsgiFallback)
+
+
+class WsgiFallbackTestCase(TestCase):
+    """Test running the Flask app behind the ASGI read path."""
+
+    def request(self, wsgi_app, path='/', gone_after=None):
+        """Set up GET `path` to `wsgi_app` through `WsgiFallback`, with a
+        client leaving after `gone_after` seconds.
+
+        Returns (fallback, scope, receive, send, messages sent).
+        """
+
+        scope = {'type': 'http', 'method': 'GET', 'path': path,
+                 'query_string': b'', 'headers': [(b'host', b'localhost')],
+                 'scheme': 'http', 'root_path': '',
+                 'server': ('localhost', 80), 'client': ('127.0.0.1', 1)}
+        calls = []
+        sent = []
+
+        async def receive():
+            calls.append(1)
+            if len(calls) == 1:
+                return {'type': 'http.request', 'body': b''}
+            await asyncio.sleep(gone_after or 3600)
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        return WsgiFallback(wsgi_app, threads=4), scope, receive, send, sent
+
+    def test_flask_pages(self):
+        fallback, scope, receive, send, sent = self.request(app, '/login')
+        asyncio.run(fallback(scope, receive, send))
+
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn(b'Log in', b''.join(m.get('body', b'')
+                                          for m in sent[1:]))
+
+    def test_streams_run_on_their_own_thread(self):
+        closed = []
+
+        def stream(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+
+            def chunks():
+                try:
+                    while True:
+                        yield b'tick'
+                        time.sleep(0.01)
+                finally:
+                    closed.append(1)
+            return chunks()
+
+        streaming = self.request(stream, gone_after=0.5)
+        quick = self.request(app, '/login')
+        finished = []
+
+        async def run(fallback, scope, receive, send, sent, name):
+            await fallback(scope, receive, send)
+            finished.append(name)
+
+        async def both():
+            await asyncio.gather(run(*streaming, 'stream'),
+                                 run(*quick, 'quick'))
+
+        asyncio.run(both())
+
+        # the open stream didn't hold up the other request, and stopped
+        # once its client left
+        self.assertEqual(finished, ['quick', 'stream'])
+        self.assertEqual(closed, [1])
+        self.assertEqual(streaming[4][1]['body'], b'tick')
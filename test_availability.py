@@ -0,0 +1,107 @@
+"""Username availability tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_availability.py
+
+
+import os
+from unittest import TestCase
+
+os.environ.setdefault('DATABASE_URL', "postgresql:///warbler-test")
+
+from app import create_app  # noqa: E402
+import sqlstats  # noqa: E402
+from availability import availability, BloomFilter  # noqa: E402
+from models import db, User, Message, Follows, Notification  # noqa: E402
+
+app = create_app('test')
+db.create_all()
+
+
+class BloomFilterTestCase(TestCase):
+    """Test the filter itself."""
+
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(1000, 0.01)
+        for n in range(1000):
+            bloom.add(f"user{n}")
+
+        self.assertTrue(all(f"user{n}" in bloom for n in range(1000)))
+        false_hits = sum(f"other{n}" in bloom for n in range(10000))
+        self.assertLess(false_hits, 300)
+
+
+class AvailabilityTestCase(TestCase):
+    """Test the checks, the endpoint and signup."""
+
+    def setUp(self):
+        Notification.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        User.signup('taken', 'taken@test.com', '123456', None)
+        db.session.commit()
+
+        availability.build()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        return res
+
+    def queries(self, check, name):
+        """Return (result, SQL statements run) of `check(name)`."""
+
+        with app.test_request_context():
+            result = check(name)
+            return result, sqlstats.current().count
+
+    def test_checks(self):
+        self.assertEqual(
+            self.queries(availability.username_available, 'taken'),
+            (False, 1))
+        self.assertEqual(
+            self.queries(availability.email_available, 'taken@test.com'),
+            (False, 1))
+
+        # definite misses never reach the database
+        self.assertEqual(
+            self.queries(availability.username_available, 'free'), (True, 0))
+        self.assertEqual(
+            self.queries(availability.email_available, 'free@test.com'),
+            (True, 0))
+
+    def test_endpoint(self):
+        resp = self.client.get('/api/username-available?username=taken'
+                               '&email=taken@test.com')
+        self.assertEqual(resp.json, {'username': False})
+
+        resp = self.client.get('/api/username-available')
+        self.assertEqual(resp.status_code, 400)
+
+    def test_signup_updates_filter(self):
+        resp = self.client.post('/signup', data={
+            'username': 'newbie', 'email': 'newbie@test.com',
+            'password': '123456'})
+        self.assertEqual(resp.status_code, 302)
+
+        self.assertEqual(
+            self.queries(availability.username_available, 'newbie'),
+            (False, 1))
+
+    def test_signup_taken(self):
+        resp = self.client.post('/signup', data={
+            'username': 'taken', 'email': 'other@test.com',
+            'password': '123456'})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b'Username already taken', resp.data)
+        self.assertEqual(User.query.count(), 1)
+
+        resp = self.client.post('/signup', data={
+            'username': 'fresh', 'email': 'taken@test.com',
+            'password': '123456'})
+        self.assertIn(b'Username or email already taken', resp.data)
@@ -0,0 +1,129 @@
+"""Response compression tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_compression.py
+
+
+import gzip
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+os.environ.setdefault('DATABASE_URL', "postgresql:///warbler-test")
+
+from flask import Response  # noqa: E402
+
+from app import create_app  # noqa: E402
+from compression import available_encodings, compression  # noqa: E402
+from models import db  # noqa: E402
+
+app = create_app('test')
+db.create_all()
+
+PAGE = '<p>warble warble</p>\n' * 200
+
+
+@app.route('/test-compression/page')
+def page():
+    response = app.make_response(PAGE)
+    response.add_etag()
+    return response
+
+
+@app.route('/test-compression/small')
+def small():
+    return '<p>hi</p>'
+
+
+@app.route('/test-compression/stream')
+def stream():
+    return Response((f'data: {n}\n\n' for n in range(100)),
+                    mimetype='text/event-stream')
+
+
+@app.route('/test-compression/zip')
+def zipped():
+    return Response(b'PK' * 1000, mimetype='application/zip')
+
+
+class CompressionTestCase(TestCase):
+    """Test negotiation, streaming and static variants."""
+
+    def setUp(self):
+        self.client = app.test_client()
+
+    def get(self, url, encoding='gzip'):
+        return self.client.get(url, headers={'Accept-Encoding': encoding})
+
+    def test_compresses_pages(self):
+        resp = self.get('/test-compression/page')
+
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', resp.headers['Vary'])
+        self.assertEqual(int(resp.headers['Content-Length']), len(resp.data))
+        self.assertEqual(gzip.decompress(resp.data).decode(), PAGE)
+        self.assertTrue(resp.headers['ETag'].startswith('W/'))
+
+    def test_negotiation(self):
+        resp = self.get('/test-compression/page', encoding='')
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertEqual(resp.data.decode(), PAGE)
+
+        resp = self.get('/test-compression/page', encoding='gzip;q=0, *')
+        self.assertNotEqual(resp.headers.get('Content-Encoding'), 'gzip')
+
+    def test_skips_small_and_incompressible(self):
+        resp = self.get('/test-compression/small')
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertIn('Accept-Encoding', resp.headers['Vary'])
+
+        resp = self.get('/test-compression/zip')
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertNotIn('Vary', resp.headers)
+
+    def test_streams_chunk_by_chunk(self):
+        resp = self.client.get('/test-compression/stream',
+                               headers={'Accept-Encoding': 'gzip'},
+                               buffered=False)
+        chunks = list(resp.response)
+        resp.close()
+
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', resp.headers)
+        # every event is flushed as it is produced
+        self.assertEqual(len(chunks), 101)
+        self.assertEqual(gzip.decompress(b''.join(chunks)).decode(),
+                         ''.join(f'data: {n}\n\n' for n in range(100)))
+
+    def test_static_files(self):
+        resp = self.get('/static/stylesheets/style.css')
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        with open(os.path.join(app.static_folder,
+                               'stylesheets/style.css'), 'rb') as f:
+            css = f.read()
+        self.assertEqual(gzip.decompress(resp.data), css)
+        resp.close()
+
+    def test_precompressed_static_files(self):
+        static = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, static)
+        shutil.copy(os.path.join(app.static_folder, 'stylesheets/style.css'),
+                    static)
+        saved, app.static_folder = app.static_folder, static
+        self.addCleanup(setattr, app, 'static_folder', saved)
+
+        self.assertEqual(compression.precompress(static),
+                         len(available_encodings()))
+        with open(os.path.join(static, 'style.css.gz'), 'rb') as f:
+            variant = f.read()
+
+        resp = self.get('/static/style.css')
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(resp.data, variant)
+        self.assertEqual(resp.mimetype, 'text/css')
+        resp.close()
+
+        # up-to-date variants aren't written again
+        self.assertEqual(compression.precompress(static), 0)
@@ -0,0 +1,134 @@
+"""User data export tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_export.py
+
+
+import io
+import json
+import os
+import tempfile
+import zipfile
+from datetime import datetime
+from unittest import TestCase
+
+os.environ.setdefault('DATABASE_URL', "postgresql:///warbler-test")
+
+from app import create_app, CURR_USER_KEY  # noqa: E402
+from archive import archive  # noqa: E402
+from models import db, User, Message, Likes, Follows  # noqa: E402
+
+app = create_app('test')
+db.create_all()
+
+
+class ExportTestCase(TestCase):
+    """Test the streamed zip export."""
+
+    def setUp(self):
+        Likes.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        user = User.signup('exporter', 'exporter@test.com', '123456', None)
+        other = User.signup('other', 'other@test.com', '123456', None)
+        db.session.commit()
+
+        msgs = [Message(text=f"warble {n}", user_id=user.id)
+                for n in range(3)]
+        liked = Message(text="liked", user_id=other.id)
+        db.session.add_all(msgs + [liked])
+        db.session.add(Follows(user_being_followed_id=other.id,
+                               user_following_id=user.id))
+        db.session.commit()
+        db.session.add(Likes(user_id=user.id, message_id=liked.id))
+        db.session.commit()
+
+        self.user_id = user.id
+        self.other_id = other.id
+        self.liked_id = liked.id
+        self.client = app.test_client()
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        return res
+
+    def download(self, query=''):
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.user_id
+        resp = self.client.get(f'/users/export{query}')
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.is_streamed)
+        return zipfile.ZipFile(io.BytesIO(resp.data))
+
+    def test_ndjson(self):
+        """Does the zip hold one NDJSON file per section?"""
+
+        archive = self.download()
+
+        self.assertEqual(sorted(archive.namelist()),
+                         ['followers.ndjson', 'following.ndjson',
+                          'likes.ndjson', 'messages.ndjson',
+                          'profile.ndjson'])
+
+        def rows(name):
+            return [json.loads(line) for line
+                    in archive.read(name).decode().splitlines()]
+
+        profile, = rows('profile.ndjson')
+        self.assertEqual(profile['username'], 'exporter')
+        self.assertNotIn('password', profile)
+        self.assertEqual([m['text'] for m in rows('messages.ndjson')],
+                         ['warble 0', 'warble 1', 'warble 2'])
+        self.assertEqual([like['message_id'] for like in rows('likes.ndjson')],
+                         [self.liked_id])
+        self.assertEqual(rows('following.ndjson'),
+                         [{'id': self.other_id, 'username': 'other'}])
+        self.assertEqual(rows('followers.ndjson'), [])
+
+    def test_csv(self):
+        """Does the CSV export start each file with a header row?"""
+
+        archive = self.download('?format=csv')
+
+        lines = archive.read('messages.csv').decode().splitlines()
+        self.assertEqual(lines[0], 'id,text,timestamp')
+        self.assertEqual(len(lines), 4)
+
+    def test_anonymous(self):
+        """Are anonymous users turned away?"""
+
+        resp = self.client.get('/users/export')
+        self.assertEqual(resp.status_code, 302)
+
+    def test_archived_messages(self):
+        """Are archived messages exported along with the hot ones?"""
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        directory, archive.directory = archive.directory, tmp.name
+        self.addCleanup(setattr, archive, 'directory', directory)
+        self.addCleanup(self.close_archive)
+        archive._scanned = None
+
+        db.session.add(Message(text="archived warble", user_id=self.user_id,
+                               timestamp=datetime(2015, 1, 1)))
+        db.session.commit()
+        archive.run()
+        self.assertEqual(Message.query.filter_by(
+            text="archived warble").count(), 0)
+
+        with self.download().open('messages.ndjson') as f:
+            texts = [json.loads(line)['text'] for line in f]
+
+        self.assertEqual(texts, ["archived warble", "warble 0", "warble 1",
+                                 "warble 2"])
+
+    def close_archive(self):
+        for segment in archive._segments:
+            segment.close()
+        archive._segments = []
+        archive._scanned = None
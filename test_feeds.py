@@ -0,0 +1,142 @@
+"""Feed engine tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_feeds.py
+
+
+import os
+from collections import deque
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+os.environ.setdefault('DATABASE_URL', "postgresql:///warbler-test")
+
+from app import app  # noqa: E402,F401
+from feeds import AuthorTimelines, timelines, feed_messages  # noqa: E402
+from models import db, User, Message, Follows  # noqa: E402
+
+db.create_all()
+
+
+class FeedEngineTestCase(TestCase):
+    """Compare the merge feed engine with the SQL one."""
+
+    def setUp(self):
+        """Create users with interleaved messages."""
+
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+
+        self.users = [User.signup(f'user{i}', f'user{i}@test.com',
+                                  '123456', None) for i in range(3)]
+        db.session.commit()
+
+        start = datetime(2020, 1, 1)
+        for n in range(30):
+            db.session.add(Message(
+                text=f"message {n}",
+                user_id=self.users[n % 3].id,
+                timestamp=start + timedelta(minutes=n)))
+        db.session.commit()
+
+        self.user_ids = [u.id for u in self.users]
+        timelines.clear()
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        return res
+
+    def test_merge_matches_sql(self):
+        """Does the merge engine return the same feed as the SQL engine?"""
+
+        sql = feed_messages(self.user_ids[:2], limit=10, engine='sql')
+        merged = feed_messages(self.user_ids[:2], limit=10, engine='merge')
+
+        self.assertEqual([m.id for m in merged], [m.id for m in sql])
+        self.assertEqual(merged[0].text, "message 28")
+
+    def test_merge_reads_only_what_it_returns(self):
+        """Does the merge walk the author lists instead of copying them?"""
+
+        read = []
+
+        class Entries(deque):
+            def __iter__(self):
+                for entry in super().__iter__():
+                    read.append(entry)
+                    yield entry
+
+        for user_id in self.user_ids:
+            timelines.get(user_id)
+            timelines._lists[user_id] = Entries(timelines._lists[user_id])
+
+        self.assertEqual(len(timelines.merge(self.user_ids, 3)), 3)
+        # the three returned, plus the head of each list
+        self.assertLessEqual(len(read), 3 + len(self.user_ids))
+
+    def test_engines_honour_since(self):
+        """Do both engines read within `since` first, then fill the page?"""
+
+        since = datetime(2020, 1, 1, 0, 24)
+        self.assertEqual(len(timelines.merge(self.user_ids, 10, since)), 6)
+
+        for limit in (4, 20):
+            sql = feed_messages(self.user_ids, limit=limit, engine='sql',
+                                since=since)
+            merged = feed_messages(self.user_ids, limit=limit,
+                                   engine='merge', since=since)
+            self.assertEqual([m.id for m in merged], [m.id for m in sql])
+            self.assertEqual(len(sql), min(limit, 30))
+
+    def test_push_and_remove(self):
+        """Do new and deleted messages show up in the author lists?"""
+
+        feed_messages(self.user_ids, limit=5, engine='merge')
+
+        msg = Message(text="newest", user_id=self.user_ids[0],
+                      timestamp=datetime(2021, 1, 1))
+        db.session.add(msg)
+        db.session.commit()
+        timelines.push(msg.user_id, msg.timestamp, msg.id)
+
+        feed = feed_messages(self.user_ids, limit=5, engine='merge')
+        self.assertEqual(feed[0].text, "newest")
+
+        timelines.remove(msg.user_id, msg.id)
+        db.session.delete(msg)
+        db.session.commit()
+
+        feed = feed_messages(self.user_ids, limit=5, engine='merge')
+        self.assertEqual(feed[0].text, "message 29")
+
+    def test_workers_agree(self):
+        """Do two workers' lists end up the same whatever order the new
+        messages reach them in?"""
+
+        this, other = AuthorTimelines(size=5), AuthorTimelines(size=5)
+        author = self.user_ids[0]
+        this.get(author)
+        other.get(author)
+
+        posted = []
+        for n in range(3):
+            msg = Message(text=f"new {n}", user_id=author,
+                          timestamp=datetime(2021, 1, 1 + n))
+            db.session.add(msg)
+            db.session.commit()
+            posted.append((msg.timestamp, msg.id))
+
+        # this worker posted them; the other gets the events late, out
+        # of order and twice
+        for timestamp, msg_id in posted:
+            this.push(author, timestamp, msg_id)
+        for timestamp, msg_id in reversed(posted + posted):
+            other.push(author, timestamp, msg_id)
+
+        self.assertEqual(list(this.get(author)), list(other.get(author)))
+        self.assertEqual([m for _, m in this.get(author)][:3],
+                         [m for _, m in reversed(posted)])
+        self.assertEqual(len(other.get(author)), 5)
@@ -0,0 +1,93 @@
+"""Bulk follow tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_follows.py
+
+
+import os
+from unittest import TestCase
+
+os.environ.setdefault('DATABASE_URL', "postgresql:///warbler-test")
+
+from app import create_app, CURR_USER_KEY  # noqa: E402
+from models import db, User, Message, Follows, Notification  # noqa: E402
+
+app = create_app('test')
+db.create_all()
+
+
+class BulkFollowTestCase(TestCase):
+    """Test the bulk follow endpoint."""
+
+    def setUp(self):
+        Notification.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        users = [User.signup(f'user{n}', f'user{n}@test.com', '123456', None)
+                 for n in range(4)]
+        db.session.commit()
+        db.session.add(Follows(user_being_followed_id=users[1].id,
+                               user_following_id=users[0].id))
+        db.session.commit()
+
+        self.ids = [user.id for user in users]
+        self.client = app.test_client()
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        return res
+
+    def login(self):
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.ids[0]
+
+    def follow(self, users):
+        return self.client.post('/api/follows', json={'users': users})
+
+    def test_bulk_follow(self):
+        self.login()
+        entries = [self.ids[1], 'user2', self.ids[3], 'user3', 'nobody',
+                   self.ids[0]]
+
+        resp = self.follow(entries)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json['followed'], 2)
+        self.assertEqual(
+            [(result['user'], result['id'], result['status'])
+             for result in resp.json['results']],
+            [(self.ids[1], self.ids[1], 'already_following'),
+             ('user2', self.ids[2], 'followed'),
+             (self.ids[3], self.ids[3], 'followed'),
+             ('user3', self.ids[3], 'already_following'),
+             ('nobody', None, 'not_found'),
+             (self.ids[0], self.ids[0], 'self')])
+
+        followed = {row.user_being_followed_id for row in
+                    Follows.query.filter_by(user_following_id=self.ids[0])}
+        self.assertEqual(followed, set(self.ids[1:]))
+
+        # following again changes nothing
+        resp = self.follow(['user2'])
+        self.assertEqual(resp.json['followed'], 0)
+
+    def test_rejects_bad_requests(self):
+        self.assertEqual(self.follow(['user1']).status_code, 401)
+
+        self.login()
+        self.assertEqual(self.follow('user1').status_code, 400)
+        self.assertEqual(self.follow([['user1']]).status_code, 400)
+        self.assertEqual(self.follow([True]).status_code, 400)
+        self.assertEqual(self.client.post('/api/follows',
+                                          data={'users': 'user1'})
+                         .status_code, 400)
+
+        app.config['BULK_FOLLOW_MAX'] = 2
+        try:
+            self.assertEqual(self.follow(['a', 'b', 'c']).status_code, 413)
+        finally:
+            app.config['BULK_FOLLOW_MAX'] = 10_000
@@ -0,0 +1,162 @@
+"""Image cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_images.py
+
+
+import os
+import shutil
+import tempfile
+import threading
+from functools import partial
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+from io import BytesIO
+from unittest import TestCase, mock
+
+from PIL import Image
+
+import images as images_module
+from app import create_app
+from images import images, HttpSource, ImageSourceError
+
+# Images come from the static folder (IMAGE_SOURCE = 'local'), so these
+# tests never touch the network.
+app = create_app('test')
+app.config['IMAGE_CACHE_DIR'] = tempfile.mkdtemp()
+images.init_app(app)
+
+
+class ImageCacheTestCase(TestCase):
+    """Test ingestion and serving of resized user images."""
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(app.config['IMAGE_CACHE_DIR'], ignore_errors=True)
+
+    def test_ingest_variants(self):
+        """Are all variants stored under the image's content digest?"""
+
+        digest = images.ingest('/static/images/warbler-hero.jpg')
+        directory = images.variant_dir(digest)
+
+        with Image.open(os.path.join(directory, 'avatar48.png')) as img:
+            self.assertEqual(img.size, (48, 48))
+        with Image.open(os.path.join(directory, 'avatar96.png')) as img:
+            self.assertEqual(img.size, (96, 96))
+        with Image.open(os.path.join(directory, 'avatar200.png')) as img:
+            self.assertEqual(img.size, (200, 200))
+        with Image.open(os.path.join(directory, 'header600.jpg')) as img:
+            self.assertEqual(img.size, (600, 219))
+
+    def test_same_content_same_digest(self):
+        """Do two URLs for the same bytes share one set of variants?"""
+
+        first = images.ingest('/static/images/default-pic.png')
+        second = images.ingest('https://example.com/images/default-pic.png')
+
+        self.assertEqual(first, second)
+
+    def test_new_variants_backfilled(self):
+        """Are variants added to VARIANTS later made for stored images?"""
+
+        url = '/static/images/warbler-hero.jpg'
+        digest = images.ingest(url)
+        os.remove(os.path.join(images.variant_dir(digest), 'avatar200.png'))
+        with images._lock:
+            images._digests.clear()
+
+        self.assertEqual(images.thumbnail_url(url, 'avatar200'), url)
+
+        images.join()
+        self.assertEqual(images.thumbnail_url(url, 'avatar200'),
+                         f'/images/{digest}/avatar200.png')
+        self.assertEqual(images._missing_variants(digest), [])
+
+    def test_thumbnail_url(self):
+        """Does the filter fall back until the image is ingested?"""
+
+        url = '/static/images/warbler-logo.png'
+        self.assertEqual(images.thumbnail_url(url, 'avatar48'), url)
+
+        images.join()
+        self.assertRegex(images.thumbnail_url(url, 'avatar48'),
+                         r'^/images/[0-9a-f]{64}/avatar48\.png$')
+
+    def test_missing_source(self):
+        """Do unreadable sources raise ImageSourceError?"""
+
+        with self.assertRaises(ImageSourceError):
+            images.ingest('/static/images/nope.png')
+        with self.assertRaises(ImageSourceError):
+            images.ingest('/static/../app.py')
+
+    def test_serve_variant(self):
+        """Are variants served with long-lived cache headers?"""
+
+        digest = images.ingest('/static/images/default-pic.png')
+
+        with app.test_client() as client:
+            resp = client.get(f'/images/{digest}/avatar96.png')
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('immutable', resp.headers['Cache-Control'])
+            self.assertIsNotNone(resp.expires)
+            self.assertEqual(Image.open(BytesIO(resp.data)).size, (96, 96))
+
+            resp = client.get(f'/images/{digest}/original.png')
+            self.assertEqual(resp.status_code, 404)
+
+
+class HttpSourceTestCase(TestCase):
+    """Test that image fetches stay off the server's own network."""
+
+    def setUp(self):
+        self.source = HttpSource(app.static_folder, timeout=2)
+
+    def serve_static(self):
+        """Serve the static folder on a local port; return its base URL."""
+
+        handler = partial(SimpleHTTPRequestHandler,
+                          directory=app.static_folder)
+        handler.log_message = lambda *args: None
+        server = HTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return f"http://127.0.0.1:{server.server_port}"
+
+    def test_refuses_internal_hosts(self):
+        for url in ('http://127.0.0.1/a.png', 'http://localhost/a.png',
+                    'http://169.254.169.254/latest/meta-data',
+                    'http://10.1.2.3/a.png', 'http://[::1]/a.png',
+                    'https://192.168.0.1/a.png', 'ftp://example.com/a.png',
+                    'file:///etc/passwd'):
+            with self.assertRaises(ImageSourceError, msg=url):
+                self.source.read(url)
+
+    def test_refuses_internal_hosts_before_connecting(self):
+        base = self.serve_static()
+        with self.assertRaisesRegex(ImageSourceError, 'not a public'):
+            self.source.read(f"{base}/images/default-pic.png")
+
+    def test_requires_image_content_type(self):
+        base = self.serve_static()
+        with mock.patch.object(images_module, 'is_public_address',
+                               lambda address: True):
+            data = self.source.read(f"{base}/images/default-pic.png")
+            with self.assertRaisesRegex(ImageSourceError, 'Not an image'):
+                self.source.read(f"{base}/stylesheets/style.css")
+
+        with open(os.path.join(app.static_folder,
+                               'images/default-pic.png'), 'rb') as f:
+            self.assertEqual(data, f.read())
+
+    def test_failures_are_retried_later(self):
+        url = 'https://example.com/broken.png'
+        images._record_failure(url)
+        self.assertTrue(images.failed_recently(url))
+
+        with mock.patch.object(images_module, 'FAILED_RETRY_SECONDS', 0):
+            self.assertFalse(images.failed_recently(url))
+        self.assertNotIn(url, images._failed)
@@ -0,0 +1,125 @@
+"""Cross-worker invalidation tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_invalidation.py
+
+
+import os
+import time
+from unittest import TestCase
+
+os.environ.setdefault('DATABASE_URL', "postgresql:///warbler-test")
+
+from app import create_app, CURR_USER_KEY  # noqa: E402
+from channels import channels  # noqa: E402
+from feeds import timelines  # noqa: E402
+from invalidation import (  # noqa: E402
+    invalidation, MESSAGE_DELETED, MESSAGE_POSTED)
+from livefeed import live_hub  # noqa: E402
+from models import db, User, Message, Follows, Notification  # noqa: E402
+
+app = create_app('test')
+db.create_all()
+
+
+class InvalidationTestCase(TestCase):
+    """Test that published events reach the registered caches."""
+
+    def setUp(self):
+        Notification.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        author = User.signup('author', 'author@test.com', '123456', None)
+        fan = User.signup('fan', 'fan@test.com', '123456', None)
+        db.session.commit()
+        msg = Message(text="soon gone", user_id=author.id)
+        db.session.add(msg)
+        db.session.commit()
+
+        self.author_id = author.id
+        self.fan_id = fan.id
+        self.msg_id = msg.id
+        self.client = app.test_client()
+
+        timelines.clear()
+        channels._last_id = None
+        channels.poll()
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        return res
+
+    def test_message_deleted_elsewhere(self):
+        """Is a message deleted by another worker dropped from timelines?"""
+
+        self.assertEqual([m for _, m in timelines.get(self.author_id)],
+                         [self.msg_id])
+
+        # what another worker's messages_destroy does
+        Message.query.filter_by(id=self.msg_id).delete()
+        invalidation.publish(MESSAGE_DELETED, message_id=self.msg_id,
+                             user_id=self.author_id)
+        db.session.commit()
+
+        before = invalidation.lag().events
+        channels.poll()
+
+        self.assertEqual(list(timelines.get(self.author_id)), [])
+        self.assertEqual(invalidation.lag().events, before + 1)
+
+    def test_message_posted_elsewhere(self):
+        """Does a message posted on another worker reach timelines?"""
+
+        timelines.get(self.author_id)
+
+        # what another worker's messages_add does
+        msg = Message(text="fresh", user_id=self.author_id)
+        db.session.add(msg)
+        db.session.flush()
+        invalidation.publish(MESSAGE_POSTED, message_id=msg.id,
+                             user_id=self.author_id,
+                             timestamp=msg.timestamp.isoformat())
+        db.session.commit()
+
+        channels.poll()
+
+        self.assertEqual([m for _, m in timelines.get(self.author_id)],
+                         [msg.id, self.msg_id])
+
+    def test_follow_updates_live_streams(self):
+        """Does following someone widen the follower's open streams?"""
+
+        stream = live_hub.connect(self.fan_id, {self.fan_id})
+        try:
+            with self.client.session_transaction() as session:
+                session[CURR_USER_KEY] = self.fan_id
+            self.client.post(f'/users/follow/{self.author_id}')
+            channels.poll()
+
+            live_hub.publish(self.msg_id, self.author_id)
+            db.session.commit()
+            channels.poll()
+
+            self.assertEqual(stream.get_nowait(), self.msg_id)
+        finally:
+            live_hub.disconnect(stream)
+
+    def test_lag(self):
+        """Are late events measured and logged?"""
+
+        with self.assertLogs('invalidation', 'WARNING'):
+            invalidation.apply({'type': MESSAGE_DELETED,
+                                'at': time.time() - 60,
+                                'message_id': 0, 'user_id': 0})
+
+        self.assertGreaterEqual(invalidation.lag().max, 60)
+
+    def test_unknown_event(self):
+        """Are unknown event types refused?"""
+
+        with self.assertRaises(ValueError):
+            invalidation.publish('nonsense')
@@ -0,0 +1,76 @@
+"""Template bytecode cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_jinjacache.py
+
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from flask import request
+
+os.environ.setdefault('DATABASE_URL', "postgresql:///warbler-test")
+
+from app import create_app  # noqa: E402
+from config import TestConfig  # noqa: E402
+from jinjacache import (  # noqa: E402
+    precompile, warmup, warm_routes, HOT_TEMPLATES, WARMUP_URLS)
+
+
+class JinjaCacheTestCase(TestCase):
+    """Test precompiling and warming up templates."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        TestConfig.JINJA_BYTECODE_CACHE = True
+        TestConfig.JINJA_CACHE_DIR = self.directory
+
+    def tearDown(self):
+        TestConfig.JINJA_BYTECODE_CACHE = False
+        TestConfig.JINJA_CACHE_DIR = None
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_precompile(self):
+        """Does precompiling write one cache file per template?"""
+
+        app = create_app('test')
+        count = precompile(app)
+
+        self.assertGreaterEqual(count, len(HOT_TEMPLATES))
+        self.assertEqual(len(os.listdir(self.directory)), count)
+
+    def test_fresh_worker_uses_cache(self):
+        """Does a new app load templates from the bytecode cache?"""
+
+        precompile(create_app('test'))
+
+        app = create_app('test')
+        cache = app.jinja_env.bytecode_cache
+        hits = []
+        original = cache.load_bytecode
+
+        def load_bytecode(bucket):
+            original(bucket)
+            hits.append(bucket.code is not None)
+
+        cache.load_bytecode = load_bytecode
+        warmup(app)
+
+        self.assertGreaterEqual(len(hits), len(HOT_TEMPLATES))
+        self.assertTrue(all(hits))
+
+    def test_warmup_sends_no_requests(self):
+        """Does the pre-fork warmup stay out of the request stack?"""
+
+        app = create_app('test')
+        requests = []
+        app.before_request(lambda: requests.append(request.path))
+
+        warmup(app)
+        self.assertEqual(requests, [])
+
+        warm_routes(app)
+        self.assertEqual(requests, list(WARMUP_URLS))
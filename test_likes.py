@@ -0,0 +1,134 @@
+"""Like write-behind buffer tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_likes.py
+
+
+import os
+from unittest import TestCase
+
+os.environ.setdefault('DATABASE_URL', "postgresql:///warbler-test")
+
+from app import create_app, CURR_USER_KEY  # noqa: E402
+from likes import like_buffer, LikeBuffer  # noqa: E402
+from models import db, User, Message, Likes  # noqa: E402
+
+app = create_app('test')
+db.create_all()
+
+
+class LikeBufferTestCase(TestCase):
+    """Test coalescing and flushing of like toggles."""
+
+    def setUp(self):
+        """Create two users and a message to like."""
+
+        Likes.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        self.author = User.signup('author', 'author@test.com', '123456', None)
+        self.fan = User.signup('fan', 'fan@test.com', '123456', None)
+        db.session.commit()
+
+        msg = Message(text="Like me", user_id=self.author.id)
+        db.session.add(msg)
+        db.session.commit()
+
+        self.msg_id = msg.id
+        self.fan_id = self.fan.id
+
+        # Hold toggles in the buffer until the test flushes them.
+        like_buffer.window = 3600
+
+    def tearDown(self):
+        res = super().tearDown()
+        like_buffer.window = 0
+        like_buffer.flush()
+        db.session.rollback()
+        return res
+
+    def test_toggles_coalesce(self):
+        """Do repeated toggles end up as a single row change?"""
+
+        for _ in range(5):
+            like_buffer.toggle(self.fan_id, self.msg_id)
+
+        self.assertEqual(like_buffer.pending_for(self.fan_id),
+                         {self.msg_id: True})
+        self.assertEqual(Likes.query.count(), 0)
+
+        like_buffer.flush()
+
+        self.assertEqual(Likes.query.count(), 1)
+        self.assertEqual(Message.query.get(self.msg_id).like_count, 1)
+
+        like_buffer.toggle(self.fan_id, self.msg_id)
+        like_buffer.flush()
+
+        self.assertEqual(Likes.query.count(), 0)
+        self.assertEqual(Message.query.get(self.msg_id).like_count, 0)
+
+    def test_reader_sees_pending_like(self):
+        """Does the liker see their unflushed like on the home page?"""
+
+        with app.test_client() as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = self.fan_id
+
+            client.post(f'/users/add_like/{self.msg_id}')
+            self.assertEqual(Likes.query.count(), 0)
+
+            self.assertEqual(
+                like_buffer.liked_ids(self.fan_id, []), {self.msg_id})
+
+            resp = client.get(f'/users/{self.fan_id}/likes')
+            self.assertIn("Like me", resp.get_data(as_text=True))
+
+    def test_cannot_like_own_message(self):
+        """Is liking your own message ignored?"""
+
+        with app.test_client() as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = self.author.id
+
+            client.post(f'/users/add_like/{self.msg_id}')
+            self.assertEqual(like_buffer.pending_for(self.author.id), {})
+
+    def test_unlike_from_another_worker(self):
+        """Does an unlike stay an unlike when the like is still pending in
+        another worker?"""
+
+        other_worker = LikeBuffer()
+        other_worker.set(self.fan_id, self.msg_id, True)
+
+        with app.test_client() as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = self.fan_id
+            client.post(f'/users/add_like/{self.msg_id}', data={'liked': 0})
+
+        other_worker.flush()
+        like_buffer.flush()
+
+        self.assertEqual(Likes.query.count(), 0)
+
+    def test_drops_likes_of_missing_messages(self):
+        """Is a like of a message gone by flush time dropped, without
+        holding up the rest?"""
+
+        gone = Message(text="Soon archived", user_id=self.author.id)
+        db.session.add(gone)
+        db.session.commit()
+        gone_id = gone.id
+
+        like_buffer.set(self.fan_id, gone_id, True)
+        like_buffer.set(self.fan_id, self.msg_id, True)
+        Message.query.filter_by(id=gone_id).delete()
+        db.session.commit()
+
+        like_buffer.flush()
+
+        self.assertEqual([like.message_id for like in Likes.query],
+                         [self.msg_id])
+        self.assertEqual(like_buffer.pending_for(self.fan_id), {})
@@ -0,0 +1,116 @@
+"""Live feed tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_livefeed.py
+
+
+import os
+from unittest import TestCase
+
+os.environ.setdefault('DATABASE_URL', "postgresql:///warbler-test")
+
+from app import create_app, CURR_USER_KEY  # noqa: E402
+from channels import channels  # noqa: E402
+from livefeed import live_hub  # noqa: E402
+from models import db, User, Message, Follows, Notification  # noqa: E402
+
+app = create_app('test')
+db.create_all()
+
+
+class LiveFeedTestCase(TestCase):
+    """Test fan-out of new messages and the delta endpoint."""
+
+    def setUp(self):
+        Notification.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        author = User.signup('author', 'author@test.com', '123456', None)
+        fan = User.signup('fan', 'fan@test.com', '123456', None)
+        stranger = User.signup('stranger', 'stranger@test.com', '123456',
+                               None)
+        db.session.commit()
+        db.session.add(Follows(user_being_followed_id=author.id,
+                               user_following_id=fan.id))
+        db.session.commit()
+
+        self.author_id = author.id
+        self.fan_id = fan.id
+        self.stranger_id = stranger.id
+        self.client = app.test_client()
+
+        # start delivering from here on
+        channels._last_id = None
+        channels.poll()
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        return res
+
+    def login(self, user_id):
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = user_id
+
+    def post(self, text):
+        self.login(self.author_id)
+        self.client.post('/messages/new', data={'text': text})
+        return Message.query.filter_by(text=text).one().id
+
+    def test_fan_out(self):
+        """Are new messages pushed to followers' streams only?"""
+
+        fan = live_hub.connect(self.fan_id, {self.author_id})
+        stranger = live_hub.connect(self.stranger_id, {self.stranger_id})
+        try:
+            msg_id = self.post("live!")
+            self.assertTrue(fan.empty())
+
+            channels.poll()
+
+            self.assertEqual(fan.get_nowait(), msg_id)
+            self.assertTrue(stranger.empty())
+        finally:
+            live_hub.disconnect(fan)
+            live_hub.disconnect(stranger)
+
+    def test_delta(self):
+        """Does /feed/since render only the newer messages?"""
+
+        first = self.post("first")
+        self.post("second")
+
+        self.login(self.fan_id)
+        html = self.client.get(f'/feed/since?after={first}').get_data(
+            as_text=True)
+
+        self.assertIn('second', html)
+        self.assertNotIn('first', html)
+
+    def test_stream(self):
+        """Does /live stream events, and turn clients away when full?"""
+
+        self.login(self.fan_id)
+        resp = self.client.get('/live', buffered=False)
+        self.assertEqual(resp.mimetype, 'text/event-stream')
+        self.assertEqual(len(live_hub), 1)
+
+        old_max, live_hub.max_connections = live_hub.max_connections, 1
+        try:
+            self.assertEqual(self.client.get('/live').status_code, 503)
+        finally:
+            live_hub.max_connections = old_max
+
+        events = iter(resp.response)
+        self.assertEqual(next(events), b"retry: 5000\n\n")
+        msg_id = self.post("streamed")
+        channels.poll()
+        self.assertEqual(next(events),
+                         f"event: message\nid: {msg_id}\n"
+                         f"data: {msg_id}\n\n".encode())
+
+        resp.close()
+        self.assertEqual(len(live_hub), 0)
@@ -2,6 +2,7 @@
 
 from app import app
 import os
+from datetime import datetime
 from unittest import TestCase
 from models import db, User, Message, Follows, Likes
 
@@ -55,6 +56,15 @@ class MessageModelTest(TestCase):
         self.assertEqual(user1.messages[1].text, "Hello Lou")
         self.assertEqual(user2.messages[0].text, "Hello user2")
 
+    # Does each message get its own timestamp when it is written
+    def test_message_timestamp(self):
+        before = datetime.utcnow().replace(microsecond=0)
+        message = Message(text="Hello lou", user_id=self.user1.id)
+        db.session.add(message)
+        db.session.commit()
+
+        self.assertGreaterEqual(message.timestamp, before)
+
     # Does follower can like message
     def test_message_like(self):
         message1 = Message(text="Hello lou", user_id=self.user1.id)
@@ -0,0 +1,206 @@
+"""Anonymous page cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_pagecache.py
+
+
+import fcntl
+import os
+import threading
+import time
+from unittest import TestCase
+
+os.environ.setdefault('DATABASE_URL', "postgresql:///warbler-test")
+
+from app import create_app, CURR_USER_KEY, message_deleted  # noqa: E402
+from pagecache import page_cache, _write_flight  # noqa: E402
+from models import db, User, Message, Follows, Notification  # noqa: E402
+
+app = create_app('test')
+db.create_all()
+
+
+class PageCacheTestCase(TestCase):
+    """Test hits, keys, single flight, expiry and invalidation."""
+
+    def setUp(self):
+        Notification.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        user = User.signup('cached', 'cached@test.com', '123456', None)
+        db.session.commit()
+        msg = Message(text='cached warble', user_id=user.id)
+        db.session.add(msg)
+        db.session.commit()
+        self.user_id, self.message_id = user.id, msg.id
+
+        page_cache.clear()
+        page_cache.enabled = True
+        self.client = app.test_client()
+
+    def tearDown(self):
+        res = super().tearDown()
+        page_cache.enabled = False
+        page_cache.ttl, page_cache.stale = 5.0, 60.0
+        page_cache.max_bytes = 64 * 2 ** 20
+        page_cache.clear()
+        db.session.rollback()
+        return res
+
+    def rename(self, username):
+        """Change the user behind the cache's back."""
+
+        User.query.filter_by(id=self.user_id).update({'username': username})
+        db.session.commit()
+
+    def test_serves_anonymous_pages_from_cache(self):
+        first = self.client.get(f'/users/{self.user_id}')
+        self.rename('renamed')
+        second = self.client.get(f'/users/{self.user_id}')
+
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data, first.data)
+        self.assertIn(b'@cached', second.data)
+        self.assertIn('Age', second.headers)
+
+        # stray and empty query arguments share the entry
+        resp = self.client.get(f'/users/{self.user_id}?utm_source=x&before=')
+        self.assertEqual(resp.data, first.data)
+
+    def test_skips_logged_in_users(self):
+        self.client.get(f'/users/{self.user_id}')
+        self.rename('renamed')
+
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.user_id
+        resp = self.client.get(f'/users/{self.user_id}')
+        self.assertIn(b'@renamed', resp.data)
+
+    def test_expiry_and_stale_refresh(self):
+        page_cache.ttl, page_cache.stale = 0.05, 60.0
+        self.client.get(f'/users/{self.user_id}')
+        self.rename('renamed')
+        time.sleep(0.1)
+
+        # expired: this request renders again; a concurrent one gets the
+        # stale page while it does
+        key = ('warbler.users_show', (('user_id', self.user_id),), (), None)
+        page_cache._flights[key] = threading.Event()
+        try:
+            resp = self.client.get(f'/users/{self.user_id}')
+            self.assertIn(b'@cached', resp.data)
+        finally:
+            del page_cache._flights[key]
+
+        resp = self.client.get(f'/users/{self.user_id}')
+        self.assertIn(b'@renamed', resp.data)
+
+    def test_single_flight(self):
+        renders = []
+        original = app.view_functions['warbler.list_users']
+
+        def slow_list_users():
+            renders.append(1)
+            time.sleep(0.2)
+            return original()
+
+        app.view_functions['warbler.list_users'] = slow_list_users
+        self.addCleanup(app.view_functions.__setitem__,
+                        'warbler.list_users', original)
+
+        results = []
+
+        def get():
+            results.append(app.test_client().get('/users?q=cach').data)
+
+        threads = [threading.Thread(target=get) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(renders), 1)
+        self.assertEqual(len(set(results)), 1)
+        self.assertIn(b'@cached', results[0])
+
+    def test_bounded(self):
+        size = len(self.client.get(f'/users/{self.user_id}').data)
+        page_cache.max_bytes = size + 10
+        self.client.get(f'/messages/{self.message_id}')
+
+        self.assertLessEqual(page_cache.size, page_cache.max_bytes)
+        self.assertEqual(len(page_cache._pages), 1)
+
+    def test_invalidation(self):
+        self.client.get(f'/messages/{self.message_id}')
+        self.client.get(f'/users/{self.user_id}')
+        Message.query.delete()
+        db.session.commit()
+
+        message_deleted(self.message_id, self.user_id)
+
+        self.assertEqual(
+            self.client.get(f'/messages/{self.message_id}').status_code,
+            404)
+        self.assertNotIn(b'cached warble',
+                         self.client.get(f'/users/{self.user_id}').data)
+
+    def other_worker(self, key):
+        """Open the flight file of `key` the way another worker would."""
+
+        fd = os.open(page_cache._flight_path(key), os.O_RDWR | os.O_CREAT)
+        self.addCleanup(os.close, fd)
+        return fd
+
+    def test_render_is_shared_with_other_workers(self):
+        first = self.client.get(f'/users/{self.user_id}')
+        key = ('warbler.users_show', (('user_id', self.user_id),), (), None)
+
+        # another worker, missing the page, takes it from the flight file
+        self.rename('renamed')
+        with page_cache._lock:
+            page_cache._pages.clear()
+        self.assertEqual(self.client.get(f'/users/{self.user_id}').data,
+                         first.data)
+
+        # ... unless it was rendered before the last invalidation
+        page_cache.forget('warbler.users_show', user_id=self.user_id)
+        self.assertIn(b'@renamed',
+                      self.client.get(f'/users/{self.user_id}').data)
+
+    def test_single_flight_across_workers(self):
+        key = ('warbler.users_show', (('user_id', self.user_id),), (), None)
+        fd = self.other_worker(key)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+        def render_elsewhere():
+            time.sleep(0.1)
+            _write_flight(fd, (key, time.time(), 200,
+                               [('Content-Type', 'text/html')],
+                               b'rendered elsewhere'))
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+        thread = threading.Thread(target=render_elsewhere)
+        thread.start()
+        resp = self.client.get(f'/users/{self.user_id}')
+        thread.join()
+
+        self.assertEqual(resp.data, b'rendered elsewhere')
+
+    def test_stale_while_another_worker_renders(self):
+        page_cache.ttl = 0.05
+        self.client.get(f'/users/{self.user_id}')
+        self.rename('renamed')
+        time.sleep(0.1)
+
+        key = ('warbler.users_show', (('user_id', self.user_id),), (), None)
+        fd = self.other_worker(key)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+        started = time.monotonic()
+        resp = self.client.get(f'/users/{self.user_id}')
+        self.assertIn(b'@cached', resp.data)
+        self.assertLess(time.monotonic() - started, page_cache.wait)
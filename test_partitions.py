@@ -0,0 +1,146 @@
+"""Message partitioning and bounded feed tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_partitions.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateTable
+
+os.environ.setdefault('DATABASE_URL', "postgresql:///warbler-test")
+
+import partitions  # noqa: E402
+import readmodels  # noqa: E402
+from app import create_app, profile_messages, CURR_USER_KEY  # noqa: E402
+from models import db, User, Message  # noqa: E402
+from snowflake import min_id_for  # noqa: E402
+
+app = create_app('test')
+db.create_all()
+
+
+class PartitionsTestCase(TestCase):
+    """Test the partition layout and the feed window."""
+
+    def tearDown(self):
+        res = super().tearDown()
+        partitions.enabled = False
+        db.session.rollback()
+        return res
+
+    def test_month_start(self):
+        """Are month boundaries right across years?"""
+
+        when = datetime(2026, 11, 19, 13, 30)
+
+        self.assertEqual(partitions.month_start(when), datetime(2026, 11, 1))
+        self.assertEqual(partitions.month_start(when, 2), datetime(2027, 1, 1))
+        self.assertEqual(partitions.month_start(when, -11),
+                         datetime(2025, 12, 1))
+        self.assertEqual(partitions.partition_name(datetime(2027, 1, 1)),
+                         'messages_p202701')
+
+    def test_partition_ddl(self):
+        """Is messages partitioned by id range only when enabled?"""
+
+        class Connection:
+            dialect = postgresql.dialect()
+
+        def ddl():
+            partitions._partition_by(Message.__table__, Connection)
+            return str(CreateTable(Message.__table__).compile(
+                dialect=postgresql.dialect()))
+
+        self.assertNotIn('PARTITION BY', ddl())
+        partitions.enabled = True
+        self.assertIn('PARTITION BY RANGE (id)', ddl())
+
+    def test_month_ranges_are_contiguous(self):
+        """Does each month's id range start where the last one ended?"""
+
+        start = datetime(2026, 1, 1)
+        ends = [min_id_for(partitions.month_start(start, n))
+                for n in range(1, 13)]
+        starts = [min_id_for(partitions.month_start(start, n))
+                  for n in range(0, 12)]
+
+        self.assertEqual(starts[1:], ends[:-1])
+        self.assertTrue(all(a < b for a, b in zip(starts, ends)))
+
+    def test_feed_window(self):
+        """Does the bounded feed leave out messages older than `since`?"""
+
+        Message.query.delete()
+        User.query.delete()
+        user = User.signup('windowed', 'windowed@test.com', '123456', None)
+        db.session.commit()
+
+        old = datetime.utcnow() - timedelta(days=200)
+        db.session.add_all([
+            Message(text="ancient", user_id=user.id, timestamp=old),
+            Message(text="recent", user_id=user.id)])
+        db.session.commit()
+
+        since = datetime.utcnow() - timedelta(days=90)
+        self.assertEqual([m.text for m in readmodels.feed([user.id])],
+                         ['recent', 'ancient'])
+        self.assertEqual([m.text for m in readmodels.feed([user.id],
+                                                          since=since)],
+                         ['recent'])
+
+    def test_profile_window(self):
+        """Is a profile read within the window first, then filled out?"""
+
+        Message.query.delete()
+        User.query.delete()
+        user = User.signup('windowed', 'windowed@test.com', '123456', None)
+        db.session.commit()
+
+        old = datetime.utcnow() - timedelta(days=200)
+        db.session.add_all([
+            Message(text="ancient", user_id=user.id, timestamp=old),
+            Message(text="older", user_id=user.id, timestamp=old),
+            Message(text="recent", user_id=user.id)])
+        db.session.commit()
+
+        since = datetime.utcnow() - timedelta(days=90)
+        self.assertEqual(
+            [m.text for m in readmodels.user_messages(user.id, since=since)],
+            ['recent'])
+
+        with app.test_request_context():
+            self.assertEqual(
+                [m.text for m in profile_messages(user.id, None, limit=2)],
+                ['recent', 'older'])
+            self.assertEqual(
+                [m.text for m in profile_messages(user.id, None, limit=5)],
+                ['recent', 'older', 'ancient'])
+
+    def test_quiet_feed_is_filled(self):
+        """Does a home feed of long-quiet authors still show their
+        messages?"""
+
+        Message.query.delete()
+        User.query.delete()
+        reader = User.signup('reader', 'reader@test.com', '123456', None)
+        quiet = User.signup('quiet', 'quiet@test.com', '123456', None)
+        db.session.commit()
+        reader.following.append(quiet)
+        db.session.add(Message(text="from 2017", user_id=quiet.id,
+                               timestamp=datetime(2017, 6, 1)))
+        db.session.commit()
+
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session[CURR_USER_KEY] = reader.id
+
+        for partitioned in (False, True):
+            app.config['MESSAGE_PARTITIONS'] = partitioned
+            self.addCleanup(app.config.__setitem__, 'MESSAGE_PARTITIONS',
+                            False)
+            self.assertIn(b'from 2017', client.get('/').data)
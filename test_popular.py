@@ -0,0 +1,116 @@
+"""Popular feed tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_popular.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+os.environ.setdefault('DATABASE_URL', "postgresql:///warbler-test")
+
+from app import create_app, CURR_USER_KEY  # noqa: E402
+from models import db, User, Message, Likes, MessageScore  # noqa: E402
+from popular import decayed_score, popular  # noqa: E402
+
+app = create_app('test')
+db.create_all()
+
+
+class PopularTestCase(TestCase):
+    """Test like-velocity scores and the popular page."""
+
+    def setUp(self):
+        MessageScore.query.delete()
+        Likes.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        self.users = [User.signup(f'user{n}', f'user{n}@test.com', '123456',
+                                  None)
+                      for n in range(3)]
+        db.session.commit()
+
+        msgs = [Message(text=f"message {n}", user_id=self.users[0].id)
+                for n in range(3)]
+        db.session.add_all(msgs)
+        db.session.commit()
+
+        self.user_ids = [u.id for u in self.users]
+        self.msg_ids = [m.id for m in msgs]
+        self.client = app.test_client()
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        return res
+
+    def like(self, user_id, msg_id):
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = user_id
+        self.client.post(f'/users/add_like/{msg_id}')
+
+    def test_decayed_score(self):
+        """Does a like lose half its weight every half-life?"""
+
+        now = datetime(2021, 6, 1)
+        hour = timedelta(hours=1)
+
+        one = decayed_score([now], hour)
+        self.assertAlmostEqual(decayed_score([now, now], hour), one + 1)
+        self.assertAlmostEqual(decayed_score([now - hour] * 2, hour), one)
+
+    def test_likes_rank_messages(self):
+        """Are messages ranked by their likes as the likes arrive?"""
+
+        first, second, third = self.msg_ids
+        self.like(self.user_ids[1], second)
+        self.like(self.user_ids[2], second)
+        self.like(self.user_ids[1], third)
+
+        self.assertEqual(popular.top(), [second, third])
+
+        # unliking drops the message from the ranking
+        self.like(self.user_ids[1], third)
+        self.assertEqual(popular.top(), [second])
+
+        html = self.client.get('/popular').get_data(as_text=True)
+        self.assertIn('message 1', html)
+        self.assertNotIn('message 0', html)
+
+    def test_recompute_drops_old_likes(self):
+        """Does the bulk recompute forget likes older than the window?"""
+
+        old = datetime.utcnow() - popular.window - timedelta(hours=1)
+        db.session.add(Likes(user_id=self.user_ids[1],
+                             message_id=self.msg_ids[0], timestamp=old))
+        db.session.add(Likes(user_id=self.user_ids[1],
+                             message_id=self.msg_ids[1]))
+        db.session.add(MessageScore(message_id=self.msg_ids[0], score=1e6))
+        db.session.commit()
+
+        popular.recompute()
+
+        self.assertEqual(popular.top(), [self.msg_ids[1]])
+
+    def test_recompute_updates_in_place(self):
+        """Does the recompute keep current rows and run in one worker?"""
+
+        self.like(self.user_ids[1], self.msg_ids[2])
+        before = MessageScore.query.get(self.msg_ids[2]).score
+
+        # rescored meanwhile, e.g. by another worker's like flush
+        MessageScore.query.filter_by(message_id=self.msg_ids[2]).update(
+            {'score': 0.0})
+        db.session.commit()
+        popular.recompute()
+
+        self.assertEqual(
+            [(row.message_id, row.score) for row in MessageScore.query],
+            [(self.msg_ids[2], before)])
+
+        with app.app_context():
+            # SQLite has one database user: this process
+            self.assertTrue(popular.leads())
@@ -0,0 +1,79 @@
+"""Request profiler tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_profiler.py
+
+
+import os
+import pstats
+import shutil
+import tempfile
+from unittest import TestCase
+
+os.environ.setdefault('DATABASE_URL', "postgresql:///warbler-test")
+
+from app import create_app  # noqa: E402
+from models import db  # noqa: E402
+from profiler import profiler, HEADER  # noqa: E402
+
+app = create_app('test')
+db.create_all()
+
+
+class RequestProfilerTestCase(TestCase):
+    """Test which requests get profiled and what gets written."""
+
+    def setUp(self):
+        profiler.directory = tempfile.mkdtemp()
+        profiler.rate = profiler._configured_rate = 0.0
+        profiler.format = 'pstats'
+        profiler.keep = 200
+        profiler.recheck = 3600
+        profiler._next_check = 0.0
+
+    def tearDown(self):
+        shutil.rmtree(profiler.directory, ignore_errors=True)
+
+    def profiles(self):
+        return sorted(os.listdir(profiler.directory))
+
+    def test_off_by_default(self):
+        """Are requests left alone without a token or sample rate?"""
+
+        with app.test_client() as client:
+            client.get('/login')
+
+        self.assertEqual(self.profiles(), [])
+
+    def test_signed_header(self):
+        """Does a valid token profile the request, and a forged one not?"""
+
+        with app.test_request_context():
+            token = profiler.make_token()
+
+        with app.test_client() as client:
+            client.get('/login', headers={HEADER: token + 'x'})
+            self.assertEqual(self.profiles(), [])
+
+            client.get('/login', headers={HEADER: token})
+
+        [name] = self.profiles()
+        self.assertIn('-warbler.login-q0-uanon-', name)
+        stats = pstats.Stats(os.path.join(profiler.directory, name))
+        self.assertGreater(stats.total_calls, 0)
+
+    def test_collapsed_and_rotation(self):
+        """Are sampled stacks written and old profiles rotated out?"""
+
+        profiler.format = 'collapsed'
+        profiler.rate = profiler._configured_rate = 1.0
+        profiler.keep = 2
+
+        with app.test_client() as client:
+            for _ in range(4):
+                client.get('/login')
+
+        names = self.profiles()
+        self.assertEqual(len(names), 2)
+        self.assertTrue(all(name.endswith('.collapsed') for name in names))
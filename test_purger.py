@@ -0,0 +1,121 @@
+"""Soft delete and purger tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_purger.py
+
+
+import os
+from datetime import datetime
+from unittest import TestCase
+
+os.environ.setdefault('DATABASE_URL', "postgresql:///warbler-test")
+
+from app import create_app, CURR_USER_KEY  # noqa: E402
+import readmodels  # noqa: E402
+from models import db, User, Message, Likes, MessageTag  # noqa: E402
+from pagecache import page_cache  # noqa: E402
+from purger import purger  # noqa: E402
+
+app = create_app('test')
+db.create_all()
+
+
+class PurgerTestCase(TestCase):
+    """Test that deleted messages disappear at once and are purged later."""
+
+    def setUp(self):
+        Likes.query.delete()
+        MessageTag.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        author = User.signup('author', 'author@test.com', '123456', None)
+        fan = User.signup('fan', 'fan@test.com', '123456', None)
+        db.session.commit()
+
+        messages = [Message(text=f"warble {n}", user_id=author.id)
+                    for n in range(5)]
+        db.session.add_all(messages)
+        db.session.commit()
+        db.session.add(Likes(user_id=fan.id, message_id=messages[0].id))
+        db.session.add(MessageTag(tag='gone', message_id=messages[0].id))
+        db.session.commit()
+
+        self.author_id = author.id
+        self.message_ids = [msg.id for msg in messages]
+        self.client = app.test_client()
+
+        self.batch = purger.batch
+        self.active = purger._active
+
+    def tearDown(self):
+        purger.batch = self.batch
+        purger._active = self.active
+        res = super().tearDown()
+        db.session.rollback()
+        return res
+
+    def soft_delete(self, ids):
+        db.session.execute(Message.__table__.update()
+                           .where(Message.id.in_(ids))
+                           .values(deleted_at=datetime.utcnow()))
+        db.session.commit()
+
+    def test_delete_hides_message(self):
+        msg_id = self.message_ids[0]
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.author_id
+
+        resp = self.client.post(f'/messages/{msg_id}/delete')
+        self.assertEqual(resp.status_code, 302)
+
+        # marked, not removed
+        self.assertIsNotNone(Message.query.get(msg_id).deleted_at)
+        self.assertEqual(Likes.query.count(), 1)
+
+        self.assertEqual(self.client.get(f'/messages/{msg_id}').status_code,
+                         404)
+        self.assertNotIn(msg_id, [row.id for row in
+                                  readmodels.user_messages(self.author_id)])
+        self.assertEqual(readmodels.user_stats(self.author_id).messages, 4)
+        self.assertEqual(readmodels.tag_messages('gone'), [])
+        self.assertIsNone(readmodels.message_author_id(msg_id))
+
+        # a second delete finds nothing
+        resp = self.client.post(f'/messages/{msg_id}/delete')
+        self.assertEqual(resp.status_code, 404)
+
+    def test_purge_in_batches(self):
+        self.soft_delete(self.message_ids[:3])
+        purger.batch = 2
+
+        self.assertEqual(purger.purge_batch(), 2)
+        self.assertEqual(purger.run(max_batches=0, yield_to_requests=False),
+                         1)
+
+        self.assertEqual(
+            sorted(msg_id for msg_id, in db.session.query(Message.id)),
+            sorted(self.message_ids[3:]))
+        self.assertEqual(Likes.query.count(), 0)
+        self.assertEqual(MessageTag.query.count(), 0)
+
+    def test_yields_when_busy(self):
+        self.soft_delete(self.message_ids)
+        purger._active = purger.busy_requests + 1
+
+        self.assertEqual(purger.run(), 0)
+        self.assertEqual(purger.run(yield_to_requests=False), 5)
+
+    def test_counts_requests_answered_early(self):
+        """Do cached pages leave the in-flight count alone?"""
+
+        page_cache.enabled = True
+        self.addCleanup(setattr, page_cache, 'enabled', False)
+        self.addCleanup(page_cache.clear)
+
+        active = purger._active
+        for _ in range(5):
+            self.assertEqual(self.client.get('/').status_code, 200)
+
+        self.assertEqual(purger._active, active)
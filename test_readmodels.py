@@ -0,0 +1,96 @@
+"""Read model tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_readmodels.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+os.environ.setdefault('DATABASE_URL', "postgresql:///warbler-test")
+
+from app import create_app  # noqa: E402
+import querycache  # noqa: E402
+import readmodels  # noqa: E402
+from models import db, User, Message, Follows, Likes  # noqa: E402
+
+app = create_app('test')
+db.create_all()
+
+
+class ReadModelTestCase(TestCase):
+    """Test the column-only list queries."""
+
+    def setUp(self):
+        Likes.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+
+        user1 = User.signup('user1', 'user1@test.com', '123456', None)
+        user2 = User.signup('user2', 'user2@test.com', '123456', None)
+        db.session.commit()
+
+        user1.following.append(user2)
+        start = datetime(2020, 1, 1)
+        for n in range(3):
+            db.session.add(Message(text=f"message {n}", user_id=user2.id,
+                                   timestamp=start + timedelta(hours=n)))
+        db.session.commit()
+
+        db.session.add(Likes(user_id=user1.id,
+                             message_id=Message.query.first().id))
+        db.session.commit()
+
+        self.user1_id = user1.id
+        self.user2_id = user2.id
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        return res
+
+    def test_feed_rows(self):
+        """Are feed rows newest first, with their author attached?"""
+
+        rows = readmodels.feed([self.user2_id])
+
+        self.assertEqual([row.text for row in rows],
+                         ["message 2", "message 1", "message 0"])
+        self.assertEqual(rows[0].user.username, 'user2')
+        self.assertFalse(hasattr(rows[0].user, 'password'))
+
+    def test_user_stats(self):
+        """Do the counts match the relationships?"""
+
+        self.assertEqual(readmodels.user_stats(self.user1_id), (0, 1, 0, 1))
+        self.assertEqual(readmodels.user_stats(self.user2_id), (3, 0, 1, 0))
+
+    def test_follow_cards(self):
+        """Do follow lists return cards for the right users?"""
+
+        [card] = readmodels.following(self.user1_id)
+        self.assertEqual(card.username, 'user2')
+
+        [card] = readmodels.followers(self.user2_id)
+        self.assertEqual(card.username, 'user1')
+
+        self.assertEqual(readmodels.following_ids(self.user1_id),
+                         {self.user2_id})
+
+    def test_query_cache_off(self):
+        """Do hot queries return the same rows when rebuilt every call?"""
+
+        cached = readmodels.feed([self.user2_id], limit=2)
+
+        querycache.enabled = False
+        try:
+            rebuilt = readmodels.feed([self.user2_id], limit=2)
+        finally:
+            querycache.enabled = True
+
+        self.assertEqual(cached, rebuilt)
+        self.assertEqual(len(cached), 2)
+        self.assertIn('readmodels.feed', querycache.HOT_QUERIES)
@@ -0,0 +1,97 @@
+"""Slow-query log tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_slowlog.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+
+os.environ.setdefault('DATABASE_URL', "postgresql:///warbler-test")
+
+from app import create_app  # noqa: E402
+from models import db, User  # noqa: E402
+from slowlog import (slow_queries, normalize, redact,  # noqa: E402
+                     explainable)
+
+app = create_app('test')
+db.create_all()
+
+
+class SlowQueryLogTestCase(TestCase):
+    """Test recording of slow statements."""
+
+    def setUp(self):
+        User.query.delete()
+        db.session.commit()
+
+        slow_queries.path = os.path.join(tempfile.mkdtemp(), 'slow.log')
+        slow_queries.ring.clear()
+        # record everything
+        slow_queries.threshold = 0
+
+    def tearDown(self):
+        slow_queries.threshold = None
+        db.session.rollback()
+
+    def test_normalize(self):
+        """Do different literals and IN-list lengths share one shape?"""
+
+        first = normalize("SELECT *\n  FROM users WHERE id IN (1, 2, 3) "
+                          "AND name = 'o''brien' LIMIT 10")
+        second = normalize("SELECT * FROM users WHERE id IN (7) "
+                           "AND name = 'x' LIMIT 5")
+
+        self.assertEqual(first, second)
+        self.assertEqual(first, "SELECT * FROM users WHERE id IN (...) "
+                                "AND name = ? LIMIT ?")
+
+    def test_redact(self):
+        """Are sensitive parameters masked by name?"""
+
+        self.assertEqual(redact({'password': 'x', 'username_1': 'bob'}),
+                         {'password': '***', 'username_1': 'bob'})
+        self.assertEqual(redact(('a@b.c', 'bob'), ['email', 'username']),
+                         ['***', 'bob'])
+
+    def test_redact_executemany(self):
+        """Is every parameter set of an executemany masked?"""
+
+        self.assertEqual(redact([{'email': 'a@b.c', 'username': 'a'},
+                                 {'email': 'd@e.f', 'username': 'd'}]),
+                         [{'email': '***', 'username': 'a'},
+                          {'email': '***', 'username': 'd'}])
+        self.assertEqual(redact((('a@b.c', 'a'), ('d@e.f', 'd')),
+                                ['email', 'username'], many=True),
+                         [['***', 'a'], ['***', 'd']])
+
+    def test_explainable(self):
+        """Is EXPLAIN ANALYZE limited to reads without side effects?"""
+
+        self.assertTrue(explainable("  select * from messages"))
+        self.assertFalse(explainable("WITH d AS (DELETE FROM messages "
+                                     "RETURNING id) SELECT * FROM d"))
+        self.assertFalse(explainable("SELECT * FROM users FOR UPDATE"))
+        self.assertFalse(explainable("UPDATE users SET bio = 'x'"))
+        self.assertFalse(explainable("SELECT pg_notify(%(channel)s, "
+                                     "%(payload)s)"))
+        self.assertFalse(explainable("SELECT pg_try_advisory_lock(42)"))
+        self.assertFalse(explainable("SELECT nextval('messages_id_seq') "
+                                     "FROM generate_series(1, 5)"))
+
+    def test_records_route_and_redacts(self):
+        """Are slow statements recorded with route and masked values?"""
+
+        with app.test_request_context('/signup'):
+            User.signup('slowuser', 'slow@test.com', 'hunter22', None)
+            db.session.commit()
+
+        [insert] = [entry for entry in slow_queries.recent()
+                    if entry['sql'].startswith('INSERT INTO users')]
+
+        self.assertEqual(insert['route'], 'warbler.signup')
+        self.assertIn('slowuser', insert['params'])
+        self.assertNotIn('slow@test.com', insert['params'])
+        self.assertNotIn('hunter22', str(insert['params']))
@@ -0,0 +1,90 @@
+"""Snowflake id tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_snowflake.py
+
+
+import importlib.util
+import os
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from unittest import TestCase
+
+from snowflake import SnowflakeIds, timestamp_of, min_id_for
+
+
+class SnowflakeIdsTestCase(TestCase):
+    """Test time-ordered message ids."""
+
+    def test_ids_increase(self):
+        """Are ids from one worker strictly increasing?"""
+
+        ids = SnowflakeIds(worker_id=7, enabled=True)
+        issued = [ids.next_id() for _ in range(10000)]
+
+        self.assertEqual(issued, sorted(issued))
+        self.assertEqual(len(set(issued)), len(issued))
+        self.assertLess(max(issued), 2 ** 63)
+
+    def test_worker_bits(self):
+        """Do workers issuing in the same millisecond get distinct ids?"""
+
+        first = SnowflakeIds(worker_id=1).next_id()
+        second = SnowflakeIds(worker_id=2).next_id()
+
+        self.assertNotEqual(first, second)
+        self.assertEqual((first >> 12) & 0x3ff, 1)
+        self.assertEqual((second >> 12) & 0x3ff, 2)
+
+    def test_timestamp_round_trip(self):
+        """Can the creation time be read back from an id?"""
+
+        before = datetime.now(timezone.utc)
+        snowflake_id = SnowflakeIds(worker_id=0).next_id()
+
+        when = timestamp_of(snowflake_id)
+        self.assertLess(abs((when - before).total_seconds()), 1)
+        self.assertLessEqual(min_id_for(before.replace(microsecond=0)),
+                             snowflake_id)
+
+    def test_workers_need_their_own_id(self):
+        """Does a forked worker refuse to reuse the inherited worker id?"""
+
+        ids = SnowflakeIds(worker_id=5, enabled=True)
+        self.assertEqual(ids.worker_id, 5)
+
+        # what os.register_at_fork runs in the child
+        ids._forget_worker()
+        with self.assertRaises(RuntimeError):
+            ids.next_id()
+
+        ids.assign_slot(3)
+        self.assertEqual((ids.next_id() >> 12) & 0x3ff, 8)
+
+        with self.assertRaises(RuntimeError):
+            ids.assign_slot(1024)
+
+    def test_gunicorn_slots(self):
+        """Does each live gunicorn worker get a distinct, reusable slot?"""
+
+        spec = importlib.util.spec_from_file_location(
+            'gunicorn_conf', os.path.join(os.path.dirname(__file__),
+                                          'gunicorn.conf.py'))
+        conf = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(conf)
+
+        server = SimpleNamespace(WORKERS={})
+        for pid in range(100, 104):
+            worker = SimpleNamespace()
+            conf.pre_fork(server, worker)
+            server.WORKERS[pid] = worker
+        self.assertEqual([worker.snowflake_slot
+                          for worker in server.WORKERS.values()],
+                         [0, 1, 2, 3])
+
+        # a replacement worker takes the dead one's slot
+        del server.WORKERS[101]
+        worker = SimpleNamespace()
+        conf.pre_fork(server, worker)
+        self.assertEqual(worker.snowflake_slot, 1)
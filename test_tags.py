@@ -0,0 +1,115 @@
+"""Hashtag, mention and trending tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_tags.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+os.environ.setdefault('DATABASE_URL', "postgresql:///warbler-test")
+
+from app import create_app, CURR_USER_KEY  # noqa: E402
+from models import (  # noqa: E402
+    db, User, Message, Mention, MessageTag, TagBucket)
+from tags import extract, linkify, trending  # noqa: E402
+
+app = create_app('test')
+db.create_all()
+
+
+class TagTestCase(TestCase):
+    """Test tag and mention indexing and timelines."""
+
+    def setUp(self):
+        MessageTag.query.delete()
+        Mention.query.delete()
+        TagBucket.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        self.user1 = User.signup('user1', 'user1@test.com', '123456', None)
+        self.user2 = User.signup('user2', 'user2@test.com', '123456', None)
+        db.session.commit()
+
+        self.user1_id = self.user1.id
+        self.user2_id = self.user2.id
+        self.client = app.test_client()
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        return res
+
+    def post(self, text):
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.user1_id
+        return self.client.post('/messages/new', data={'text': text})
+
+    def test_extract(self):
+        """Are tags lower-cased and emails not taken for mentions?"""
+
+        tags, usernames = extract("#Flask and #flask, @user2 a@b.com #")
+
+        self.assertEqual(tags, {'flask'})
+        self.assertEqual(usernames, {'user2'})
+
+    def test_linkify(self):
+        """Is text escaped before tags and mentions are linked?"""
+
+        html = linkify("<b>#Hi</b> @user2 it's")
+
+        self.assertIn('&lt;b&gt;<a href="/tags/hi">#Hi</a>&lt;/b&gt;', html)
+        self.assertIn('<a href="/users?q=user2">@user2</a>', html)
+        self.assertNotIn('/tags/39', html)
+
+    def test_index_on_post(self):
+        """Does posting a message index its tags and mentions?"""
+
+        self.post("Hello @user2 and @nobody #Warbler #python")
+
+        self.assertEqual({t.tag for t in MessageTag.query.all()},
+                         {'warbler', 'python'})
+        self.assertEqual([m.user_id for m in Mention.query.all()],
+                         [self.user2_id])
+
+        resp = self.client.get(f'/users/{self.user2_id}/mentions')
+        self.assertIn('Hello', resp.get_data(as_text=True))
+
+    def test_tag_timeline_pages(self):
+        """Does the tag timeline page back with a 'before' cursor?"""
+
+        for n in range(3):
+            self.post(f"post {n} #paging")
+
+        ids = [t.message_id for t in
+               MessageTag.query.order_by(MessageTag.message_id).all()]
+
+        html = self.client.get(f'/tags/paging?before={ids[2]}').get_data(
+            as_text=True)
+        self.assertIn('post 1', html)
+        self.assertIn('post 0', html)
+        self.assertNotIn('post 2', html)
+
+    def test_trending(self):
+        """Are tag counts summed over the window only?"""
+
+        trending.record({'old'}, when=datetime.utcnow() - timedelta(days=1))
+        self.post("#hot #hot #cold")
+        self.post("#hot")
+
+        self.assertEqual(trending.top(), [('hot', 2), ('cold', 1)])
+        self.assertEqual(TagBucket.query.filter_by(tag='old').count(), 0)
+
+        html = self.client.get('/trending').get_data(as_text=True)
+        self.assertIn('#hot', html)
+
+    def test_trending_is_a_tag_too(self):
+        """Does #trending get its own timeline like any other tag?"""
+
+        self.post("what's #trending today")
+
+        html = self.client.get('/tags/trending').get_data(as_text=True)
+        self.assertIn("today", html)
@@ -0,0 +1,31 @@
+"""WSGI entry point for production servers.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Builds the app once with the 'prod' profile (or WARBLER_PROFILE). With
+gunicorn's `preload_app` the master imports this module before forking,
+so workers start with the app already built, its templates compiled,
+and share its memory.
+"""
+
+import gc
+import os
+
+# Objects allocated while building the app live for the whole process.
+# Keep the collector from walking them during import, then move them to
+# the permanent generation so later collections in the forked workers
+# never write to those pages (which would un-share them copy-on-write).
+gc.disable()
+
+from app import create_app  # noqa: E402
+from jinjacache import warmup  # noqa: E402
+
+app = create_app(os.environ.get('WARBLER_PROFILE', 'prod'))
+
+# Compile the hot templates before any worker takes traffic; with
+# preloading the forked workers inherit them. Warmup requests run per
+# worker, in gunicorn.conf.py's post_fork.
+warmup(app)
+
+gc.freeze()
+gc.enable()